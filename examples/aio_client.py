@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# Fetches many resources concurrently over a single SPDY/3 connection, e.g.
+# from examples/aio_server.py: python3 aio_client.py localhost 9599 200
+import sys
+import time
+import asyncio
+from spdy.client import SpdyClient
+
+async def main(host, port, count):
+    async with SpdyClient(host, port) as client:
+        start = time.time()
+        responses = await asyncio.gather(*[client.get('/res%i' % i)
+                                           for i in range(count)])
+        bodies = await asyncio.gather(*[r.read() for r in responses])
+        elapsed = time.time() - start
+        print('%i responses, %i bytes in %.3f s over 1 connection' %
+              (len(responses), sum(map(len, bodies)), elapsed))
+        print('status codes:', sorted(set(r.status for r in responses)))
+
+if __name__ == '__main__':
+    host = sys.argv[1] if len(sys.argv) > 1 else 'localhost'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 9599
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    asyncio.run(main(host, port, count))
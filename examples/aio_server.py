@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# asyncio SPDY server: one process, one thread, many concurrent connections.
+# Try it with examples/aio_client.py or any SPDY/3 client over plain TCP.
+import sys
+import asyncio
+import spdy.aio
+
+async def handler(stream):
+    print('<<', stream, stream.headers)
+    await stream.readall()
+    stream.reply({':status': '200 OK', ':version': 'HTTP/1.1',
+                  'content-type': 'text/plain'})
+    stream.write(b'hello, world!', fin=True)
+    await stream.drain()
+
+async def main(port):
+    server = await spdy.aio.start_server(handler, '', port,
+                                         protocol_kwargs={'keepalive': (30, 10)})
+    print('Serving SPDY/3 on port %i' % port)
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 9599
+    asyncio.run(main(port))
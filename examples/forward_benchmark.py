@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# coding: utf-8
+""" Bulk download throughput through a SPDY proxy, compared with a plain TCP
+    relay:
+
+        direct   client -> origin
+        tcp      client -> byte relay -> origin
+        splice   client -> Forwarder.feed() -> origin
+        decode   client -> get_frame() / forward_frame() / outgoing() -> origin
+
+        python3 forward_benchmark.py -b 4194304 -n 50 -s 4 """
+import argparse
+import asyncio
+import multiprocessing
+import selectors
+import socket
+import time
+from collections import deque
+
+from spdy.client import SpdyClient
+from spdy.context import Context, SERVER, CLIENT
+from spdy.forward import Forwarder
+from spdy.server import Server
+
+READ_SIZE = 256 * 1024
+
+def listen():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(128)
+    return sock
+
+def origin(sock, body):
+    def handler(request):
+        request.respond(200, {'content-type': 'application/octet-stream'}, body)
+    Server(handler, sock=sock).serve_forever()
+
+
+class Leg(object):
+    def __init__(self, sock, ctx=None):
+        self.sock = sock
+        self.ctx = ctx
+        self.out = deque()
+        self.peer = None
+
+    def queue(self, chunks):
+        self.out.extend(chunks)
+
+    def flush(self):
+        out = self.out
+        while out:
+            try:
+                sent = self.sock.sendmsg(list(out)[:512])
+            except (BlockingIOError, InterruptedError):
+                return
+            while sent:
+                if len(out[0]) <= sent:
+                    sent -= len(out.popleft())
+                else:
+                    out[0] = memoryview(out[0])[sent:]
+                    sent = 0
+
+
+def proxy(sock, origin_address, mode):
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ, None)
+    buf = bytearray(READ_SIZE)
+    view = memoryview(buf)
+    forwarders = {}
+    while True:
+        for key, _ in selector.select():
+            if key.data is None:
+                client, _ = sock.accept()
+                upstream = socket.create_connection(origin_address)
+                legs = []
+                for s, side in ((client, SERVER), (upstream, CLIENT)):
+                    s.setblocking(False)
+                    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    ctx = None
+                    if mode != 'tcp':
+                        ctx = Context(side)
+                        ctx.auto_ping = True
+                        ctx.auto_settings = True
+                    legs.append(Leg(s, ctx))
+                legs[0].peer, legs[1].peer = legs[1], legs[0]
+                if mode != 'tcp':
+                    forwarder = Forwarder(legs[0].ctx, legs[1].ctx)
+                    forwarders[legs[0]] = forwarders[legs[1]] = forwarder
+                for leg in legs:
+                    selector.register(leg.sock, selectors.EVENT_READ, leg)
+                continue
+            leg = key.data
+            try:
+                if mode == 'splice':
+                    # a fresh bytes object: Forwarder.feed() slices it
+                    data = leg.sock.recv(READ_SIZE)
+                    n = len(data)
+                else:
+                    n = leg.sock.recv_into(buf)
+            except (BlockingIOError, InterruptedError):
+                continue
+            except OSError:
+                n = 0
+            if not n:
+                for l in (leg, leg.peer):
+                    selector.unregister(l.sock)
+                    l.sock.close()
+                continue
+            if mode == 'tcp':
+                leg.peer.queue([bytes(view[:n])])
+            else:
+                forwarder = forwarders[leg]
+                if mode == 'splice':
+                    forwarder.feed(leg.ctx, data)
+                    for l in (leg, leg.peer):
+                        l.queue(l.ctx.outgoing_chunks())
+                else:
+                    leg.ctx.incoming(view[:n])
+                    while True:
+                        frame = leg.ctx.get_frame()
+                        if frame is None:
+                            break
+                        forwarder.forward_frame(leg.ctx, frame)
+                    for l in (leg, leg.peer):
+                        out = l.ctx.outgoing()
+                        if out:
+                            l.queue([out])
+            # blocking flush keeps the relay simple, sockets are on loopback
+            for l in (leg.peer, leg):
+                l.sock.setblocking(True)
+                l.flush()
+                l.sock.setblocking(False)
+
+async def download(address, count, streams):
+    async with SpdyClient(address[0], address[1]) as client:
+        started = time.perf_counter()
+        total = 0
+        async def fetch(n):
+            nonlocal total
+            for _ in range(n):
+                response = await client.get('/')
+                async for chunk in response:
+                    total += len(chunk)
+        await asyncio.gather(*[fetch(count // streams) for _ in range(streams)])
+        return total, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-b', '--body-size', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('-n', '--requests', type=int, default=40)
+    parser.add_argument('-s', '--streams', type=int, default=4,
+                        help='concurrent streams')
+    args = parser.parse_args()
+
+    origin_sock = listen()
+    server = multiprocessing.Process(target=origin,
+        args=(origin_sock, b'x' * args.body_size))
+    server.start()
+    try:
+        for mode in ('direct', 'tcp', 'splice', 'decode'):
+            address = origin_sock.getsockname()
+            relay = None
+            if mode != 'direct':
+                proxy_sock = listen()
+                address = proxy_sock.getsockname()
+                relay = multiprocessing.Process(target=proxy,
+                            args=(proxy_sock, origin_sock.getsockname(), mode))
+                relay.start()
+            try:
+                total, elapsed = asyncio.run(download(address, args.requests,
+                                                      args.streams))
+            finally:
+                if relay is not None:
+                    relay.terminate()
+                    relay.join()
+            print('%-7s %8.1f MB/s' % (mode, total / elapsed / 1e6))
+    finally:
+        server.terminate()
+        server.join()
+
+if __name__ == '__main__':
+    main()
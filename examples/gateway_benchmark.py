@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# coding: utf-8
+""" Serves the same WSGI app through spdy.gateway.WSGIGateway and through a
+    plain threaded HTTP/1.1 keep-alive server, and compares req/s and latency
+    under the same number of requests in flight.
+
+        python3 gateway_benchmark.py -c 50 -s 8 -d 10
+
+    SPDY gets `-c` connections with `-s` streams each, HTTP/1.1 gets c * s
+    connections with one request each. """
+import argparse
+import multiprocessing
+import selectors
+import socket
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from spdy.gateway import WSGIGateway
+from spdy.loadgen import run_parallel, summarize, raise_nofile_limit
+from spdy.server import Server
+
+def make_app(size):
+    body = b'x' * size
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'application/octet-stream'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+    return app
+
+def serve_spdy(sock, size, workers):
+    raise_nofile_limit()
+    Server(WSGIGateway(make_app(size), max_workers=workers),
+           sock=sock).serve_forever()
+
+def serve_http(sock, size):
+    raise_nofile_limit()
+    app = make_app(size)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': self.path,
+                       'SERVER_PROTOCOL': self.request_version}
+            status = []
+            def start_response(line, headers, exc_info=None):
+                status[:] = [line, headers]
+            body = b''.join(app(environ, start_response))
+            code, _, reason = status[0].partition(' ')
+            self.send_response(int(code), reason)
+            for name, value in status[1]:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class HTTPServer(ThreadingHTTPServer):
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            pass # clients going away at the end of the run
+
+    server = HTTPServer(sock.getsockname(), Handler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    server.serve_forever()
+
+def http_load(address, connections, duration, warmup=1.0):
+    """ Closed-loop HTTP/1.1 keep-alive load, one request per connection """
+    request = b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n'
+    selector = selectors.DefaultSelector()
+    conns = {}
+    for _ in range(connections):
+        sock = socket.create_connection(address)
+        sock.setblocking(False)
+        conns[sock] = [bytearray(), 0.0]
+        selector.register(sock, selectors.EVENT_READ)
+    latencies, requests, errors, bytes_in = [], 0, 0, 0
+    start = time.perf_counter()
+    measure_start, end = start + warmup, start + warmup + duration
+    for sock, state in conns.items():
+        state[1] = time.perf_counter()
+        sock.send(request)
+    while time.perf_counter() < end:
+        for key, _ in selector.select(0.05):
+            sock = key.fileobj
+            state = conns[sock]
+            try:
+                data = sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                continue
+            if not data:
+                errors += 1
+                selector.unregister(sock)
+                continue
+            state[0].extend(data)
+            head, sep, body = bytes(state[0]).partition(b'\r\n\r\n')
+            if not sep:
+                continue
+            length = 0
+            for line in head.split(b'\r\n')[1:]:
+                name, _, value = line.partition(b':')
+                if name.strip().lower() == b'content-length':
+                    length = int(value)
+            if len(body) < length:
+                continue
+            now = time.perf_counter()
+            if now >= measure_start:
+                latencies.append(now - state[1])
+                requests += 1
+                bytes_in += length
+            del state[0][:len(head) + 4 + length]
+            state[1] = now
+            sock.send(request)
+    for sock in conns:
+        sock.close()
+    return summarize(latencies, duration, requests, errors, bytes_in)
+
+def bind():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(4096)
+    return sock
+
+def report(name, result):
+    print('%-9s %9.0f req/s  p50 %7.2f ms  p99 %7.2f ms  errors %i' % (
+          name, result['req_per_sec'], result['p50_ms'] or 0,
+          result['p99_ms'] or 0, result['errors']))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-c', '--connections', type=int, default=50)
+    parser.add_argument('-s', '--streams', type=int, default=8)
+    parser.add_argument('-d', '--duration', type=float, default=10.0)
+    parser.add_argument('-b', '--body-size', type=int, default=1024)
+    parser.add_argument('-t', '--threads', type=int, default=16,
+                        help='WSGIGateway worker threads')
+    args = parser.parse_args()
+    raise_nofile_limit()
+
+    sock = bind()
+    proc = multiprocessing.Process(target=serve_spdy,
+                                   args=(sock, args.body_size, args.threads))
+    proc.start()
+    try:
+        result = run_parallel(sock.getsockname(), args.connections, 1,
+                              streams=args.streams, duration=args.duration)
+    finally:
+        proc.terminate()
+        proc.join()
+    report('spdy', result)
+
+    sock = bind()
+    proc = multiprocessing.Process(target=serve_http,
+                                   args=(sock, args.body_size))
+    proc.start()
+    try:
+        result = http_load(sock.getsockname(),
+                           args.connections * args.streams, args.duration)
+    finally:
+        proc.terminate()
+        proc.join()
+    report('http/1.1', result)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# coding: utf-8
+""" Legacy HTTP/1.1 clients opening one connection per request, sent either
+    straight to an HTTP/1.1 backend or through spdy.http1.HTTP1Gateway to a
+    SPDY backend. Prints latency and how many connections the backend had
+    to accept in each case.
+
+        python3 http1_gateway_benchmark.py -c 64 -d 10 --backend-delay 5 """
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from spdy.http1 import HTTP1Gateway
+from spdy.loadgen import summarize, raise_nofile_limit
+from spdy.server import Server
+
+def listen():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(4096)
+    return sock
+
+def http_backend(sock, body, delay, accepted):
+    raise_nofile_limit()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class HTTPServer(ThreadingHTTPServer):
+        daemon_threads = True
+
+        def process_request(self, request, client_address):
+            accepted.value += 1
+            ThreadingHTTPServer.process_request(self, request, client_address)
+
+        def handle_error(self, request, client_address):
+            pass
+
+    server = HTTPServer(sock.getsockname(), Handler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    server.serve_forever()
+
+def spdy_backend(sock, body, delay, accepted):
+    raise_nofile_limit()
+    headers = {'content-type': 'application/octet-stream',
+               'content-length': str(len(body))}
+    server = None
+    def handler(request):
+        if delay:
+            # same backend work as the HTTP/1.1 side, off the server thread
+            threading.Timer(delay, server.call_soon_threadsafe,
+                            (request.respond, 200, headers, body)).start()
+        else:
+            request.respond(200, headers, body)
+    server = Server(handler, sock=sock)
+    def report():
+        accepted.value = server.accepted
+    server.add_timer(0.1, report)
+    server.serve_forever()
+
+def gateway(sock, backend_address, max_connections):
+    raise_nofile_limit()
+    async def main():
+        gw = HTTP1Gateway(backend_address[0], backend_address[1],
+                          max_connections=max_connections)
+        server = await asyncio.start_server(gw.handle_client, sock=sock)
+        await server.serve_forever()
+    asyncio.run(main())
+
+async def load(address, clients, duration, warmup=1.0):
+    """ `clients` loops of connect / GET / read until close """
+    request = b'GET /index.html HTTP/1.1\r\nHost: localhost\r\n' \
+              b'Connection: close\r\n\r\n'
+    latencies = []
+    counts = {'requests': 0, 'errors': 0, 'bytes': 0}
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    measure_start, end = start + warmup, start + warmup + duration
+
+    async def client():
+        while loop.time() < end:
+            began = time.perf_counter()
+            try:
+                reader, writer = await asyncio.open_connection(*address)
+                writer.write(request)
+                data = await reader.read()
+                writer.close()
+            except OSError:
+                counts['errors'] += 1
+                continue
+            if not data.startswith(b'HTTP/1.1 200'):
+                counts['errors'] += 1
+            elif loop.time() >= measure_start:
+                latencies.append(time.perf_counter() - began)
+                counts['requests'] += 1
+                counts['bytes'] += len(data)
+
+    await asyncio.gather(*[client() for _ in range(clients)])
+    return summarize(latencies, duration, counts['requests'], counts['errors'],
+                     counts['bytes'])
+
+def run(targets, address, args, accepted):
+    procs = [multiprocessing.Process(target=target, args=target_args)
+             for target, target_args in targets]
+    for proc in procs:
+        proc.start()
+    time.sleep(0.5)
+    try:
+        before = accepted.value
+        result = asyncio.run(load(address, args.clients, args.duration))
+        time.sleep(0.2)
+        result['backend_connections'] = accepted.value - before
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.join()
+    return result
+
+def report(name, result):
+    print('%-8s %7.0f req/s  p50 %7.2f ms  p99 %7.2f ms  errors %i  '
+          'backend connections %i' % (name, result['req_per_sec'],
+          result['p50_ms'] or 0, result['p99_ms'] or 0, result['errors'],
+          result['backend_connections']))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-c', '--clients', type=int, default=64)
+    parser.add_argument('-d', '--duration', type=float, default=10.0)
+    parser.add_argument('-b', '--body-size', type=int, default=4096)
+    parser.add_argument('-m', '--max-connections', type=int, default=2,
+                        help='gateway SPDY sessions to the backend')
+    parser.add_argument('--backend-delay', type=float, default=0.0,
+                        help='backend work per request (ms)')
+    args = parser.parse_args()
+    raise_nofile_limit()
+    body = b'x' * args.body_size
+    delay = args.backend_delay / 1000.0
+
+    accepted = multiprocessing.Value('l', 0, lock=False)
+    backend = listen()
+    result = run([(http_backend, (backend, body, delay, accepted))],
+                 backend.getsockname(), args, accepted)
+    report('direct', result)
+
+    accepted = multiprocessing.Value('l', 0, lock=False)
+    backend, front = listen(), listen()
+    result = run([(spdy_backend, (backend, body, delay, accepted)),
+                  (gateway, (front, backend.getsockname(),
+                             args.max_connections))],
+                 front.getsockname(), args, accepted)
+    report('gateway', result)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# coding: utf-8
+""" Measures how spdy.prefork.PreforkServer scales with its worker count over
+    loopback TCP. Needs spare cores for the load generator as well, e.g. on a
+    16 core box:
+
+        python3 prefork_benchmark.py -n 1,2,4,8 -c 2000 -w 8 """
+import argparse
+import multiprocessing
+import os
+import signal
+import time
+
+from spdy.prefork import PreforkServer
+from spdy.loadgen import run_parallel, raise_nofile_limit
+
+PORT = 9598
+
+def supervise(workers, body):
+    raise_nofile_limit()
+    def handler(request):
+        request.respond(200, {'content-type': 'application/octet-stream'}, body)
+    PreforkServer(handler, '127.0.0.1', PORT, workers=workers).serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--server-workers', default='1,2,4',
+                        help='comma separated worker counts')
+    parser.add_argument('-c', '--connections', type=int, default=1000)
+    parser.add_argument('-s', '--streams', type=int, default=4)
+    parser.add_argument('-d', '--duration', type=float, default=10.0)
+    parser.add_argument('-w', '--workers', type=int,
+                        default=max(1, (os.cpu_count() or 2) // 2),
+                        help='load generator processes')
+    parser.add_argument('-b', '--body-size', type=int, default=128)
+    args = parser.parse_args()
+    raise_nofile_limit()
+
+    baseline = None
+    print('cores: %i' % (os.cpu_count() or 0))
+    for workers in [int(n) for n in args.server_workers.split(',')]:
+        proc = multiprocessing.Process(target=supervise,
+                                       args=(workers, b'x' * args.body_size))
+        proc.start()
+        time.sleep(0.5 + 0.1 * workers)
+        try:
+            result = run_parallel(('127.0.0.1', PORT), args.connections,
+                                  args.workers, streams=args.streams,
+                                  duration=args.duration)
+        finally:
+            os.kill(proc.pid, signal.SIGTERM)
+            proc.join()
+        if baseline is None:
+            baseline = result['req_per_sec'] / workers
+        print('%3i workers  %9.0f req/s  scaling %5.2fx of linear  '
+              'p99 %7.2f ms  errors %i' % (workers, result['req_per_sec'],
+              result['req_per_sec'] / (baseline * workers),
+              result['p99_ms'] or 0, result['errors']))
+
+if __name__ == '__main__':
+    main()
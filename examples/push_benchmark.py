@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" Loopback page-load benchmark: counts the round trips needed to fetch a page
+    and its subresources without push (one by one, like spdydownloader_v2.py,
+    or all at once after parsing the page) and with server push.
+    No network involved, both endpoints are Contexts talking in memory. """
+
+import sys
+from spdy.context import Context, CLIENT, SERVER
+from spdy.frames import SynStream, SynReply, DataFrame, FLAG_FIN
+from spdy.push import PushCache
+
+SPDY_VERSION = 3
+HOST = 'www.example.com'
+
+def make_site(subresources):
+    paths = ['/static/res%i.css' % i for i in range(subresources)]
+    page = '<html>' + ''.join('<link href="%s">' % p for p in paths) + '</html>'
+    site = {'/': page.encode('utf-8')}
+    for path in paths:
+        site[path] = b'x' * 2048
+    return site, paths
+
+def get_headers(version, host, path):
+    if version == 2:
+        return {'method': 'GET', 'url': path, 'version': 'HTTP/1.1',
+                'host': host, 'scheme': 'https'}
+    else:
+        return {':method': 'GET', ':path': path, ':version': 'HTTP/1.1',
+                ':host': host, ':scheme': 'https'}
+
+def push_headers(version, host, path):
+    if version == 2:
+        return {'url': 'https://%s%s' % (host, path), 'status': '200 OK',
+                'version': 'HTTP/1.1'}
+    else:
+        return {':scheme': 'https', ':host': host, ':path': path,
+                ':status': '200 OK', ':version': 'HTTP/1.1'}
+
+def serve(server, site, paths, push):
+    while True:
+        frame = server.get_frame()
+        if not frame:
+            break
+        if not isinstance(frame, SynStream):
+            continue
+        path = frame.headers[':path' if SPDY_VERSION == 3 else 'url']
+        server.put_frame(SynReply(frame.stream_id,
+                                  {':status': '200 OK', ':version': 'HTTP/1.1'},
+                                  version=SPDY_VERSION))
+        server.put_frame(DataFrame(frame.stream_id, site[path], FLAG_FIN))
+        if push and path == '/':
+            for sub in paths:
+                server.push(frame.stream_id,
+                            push_headers(SPDY_VERSION, HOST, sub), site[sub])
+
+def page_load(subresources, mode):
+    site, paths = make_site(subresources)
+    client = Context(CLIENT, SPDY_VERSION)
+    server = Context(SERVER, SPDY_VERSION)
+    cache = PushCache(SPDY_VERSION, ctx=client)
+    pending = {}
+    done = set()
+    to_request = ['/']
+    round_trips = 0
+    wire_bytes = 0
+
+    while len(done) < len(site):
+        if mode == 'sequential' and pending:
+            batch = []
+        elif mode == 'sequential':
+            batch = to_request[:1]
+        else:
+            batch = list(to_request)
+        for path in batch:
+            to_request.remove(path)
+            headers = get_headers(SPDY_VERSION, HOST, path)
+            resource = cache.lookup(headers)
+            if resource is not None:
+                done.add(path)
+                continue
+            sid = client.next_stream_id
+            client.put_frame(SynStream(sid, headers, version=SPDY_VERSION))
+            pending[sid] = path
+        if not pending:
+            continue
+
+        out = client.outgoing()
+        round_trips += 1
+        wire_bytes += len(out)
+        server.incoming(out)
+        serve(server, site, paths, mode == 'push')
+        answer = server.outgoing()
+        wire_bytes += len(answer)
+        client.incoming(answer)
+
+        while True:
+            frame = client.get_frame()
+            if not frame:
+                break
+            if cache.handle_frame(frame):
+                continue
+            if isinstance(frame, DataFrame) and frame.fin:
+                path = pending.pop(frame.stream_id)
+                done.add(path)
+                if path == '/':
+                    to_request.extend(paths)
+    return round_trips, wire_bytes
+
+if __name__ == '__main__':
+    subresources = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print('Page with %i subresources, SPDY/%i' % (subresources, SPDY_VERSION))
+    for mode in ('sequential', 'parallel', 'push'):
+        round_trips, wire_bytes = page_load(subresources, mode)
+        print('%-10s round trips: %4i  bytes on the wire: %i' %
+              (mode, round_trips, wire_bytes))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# coding: utf-8
+""" Benchmarks spdy.server.Server over loopback TCP: one server process, a
+    closed-loop load generator (spdy.loadgen) in other processes, and req/s
+    plus latency percentiles for each connection count.
+
+        python3 server_benchmark.py -c 1000,10000,50000 -d 10 -w 4
+
+    Every connection holds two Contexts (one per side) with their own zlib
+    state, so high connection counts need several GB of RAM and a raised
+    open files limit (the script raises the soft limit to the hard one). """
+import argparse
+import json
+import multiprocessing
+import socket
+
+from spdy.server import Server
+from spdy.loadgen import run_parallel, raise_nofile_limit
+
+def serve(sock, body, version):
+    raise_nofile_limit()
+    def handler(request):
+        request.respond(200, {'content-type': 'application/octet-stream'}, body)
+    Server(handler, sock=sock, version=version).serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-c', '--connections', default='1000,10000,50000',
+                        help='comma separated connection counts')
+    parser.add_argument('-s', '--streams', type=int, default=1,
+                        help='concurrent streams per connection')
+    parser.add_argument('-d', '--duration', type=float, default=10.0)
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='load generator processes')
+    parser.add_argument('-b', '--body-size', type=int, default=128)
+    parser.add_argument('-v', '--version', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help='JSON output')
+    args = parser.parse_args()
+
+    limit = raise_nofile_limit()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(4096)
+    address = sock.getsockname()
+
+    results = []
+    for connections in [int(c) for c in args.connections.split(',')]:
+        if connections * 2 > limit:
+            print('skipping %i connections: open files limit is %i' %
+                  (connections, limit))
+            continue
+        server = multiprocessing.Process(target=serve,
+                    args=(sock, b'x' * args.body_size, args.version))
+        server.start()
+        try:
+            result = run_parallel(address, connections, args.workers,
+                                  streams=args.streams, duration=args.duration,
+                                  version=args.version)
+        finally:
+            server.terminate()
+            server.join()
+        result['target_connections'] = connections
+        results.append(result)
+        if not args.json:
+            print('%6i conns  %9.0f req/s  p50 %7.2f ms  p99 %7.2f ms  '
+                  'p999 %7.2f ms  errors %i' % (result['connections'],
+                  result['req_per_sec'], result['p50_ms'] or 0,
+                  result['p99_ms'] or 0, result['p999_ms'] or 0,
+                  result['errors']))
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
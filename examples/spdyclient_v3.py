@@ -50,10 +50,10 @@ def parse_args():
     return (host, port)
 
 def ping_test(spdy_ctx):
-    """ Just Pings the server through a SPDY Ping Frame """
-    ping_frame = Ping(spdy_ctx.next_ping_id, version=SPDY_VERSION)
-    print('>>', ping_frame)
-    spdy_ctx.put_frame(ping_frame)
+    """ Just Pings the server through a SPDY Ping Frame, the RTT is measured
+        by the context when the echo arrives (see spdy_ctx.srtt) """
+    ping_id = spdy_ctx.send_ping()
+    print('>> PING v%i id=%i' % (SPDY_VERSION, ping_id))
 
 def get_headers(version, host, path):
     # TODO: Review gzip content-type
@@ -127,6 +127,8 @@ if __name__ == '__main__':
                 print ('<<', frame, 'Data:\n', data[:512].decode('utf-8', 'ignore'))
                 file_out.write(data)
                 file_out.flush()
+            elif isinstance(frame, Ping):
+                print ('<<', frame, 'RTT: %.3f ms' % (spdy_ctx.last_rtt * 1000))
             else:
                 print ('<<', frame)
             frame = get_frame(spdy_ctx)
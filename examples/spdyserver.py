@@ -2,8 +2,8 @@
 # You can try this example with a spdyclient test or Mozilla Firefox.
 import socket
 import ssl
-from spdy.context import Context, SERVER 
-from spdy.frames import SynStream, SynReply, Ping, Goaway, DataFrame
+from spdy.context import Context, SERVER
+from spdy.frames import SynReply, Goaway, DataFrame
 
 server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 server.bind(('', 9599))
@@ -19,13 +19,13 @@ ctx.set_ciphers('DES-CBC3-SHA')
 ctx.load_cert_chain('server.crt', 'server.key')
 ctx.set_npn_protocols(['spdy/2'])
 
-def handle_frame(conn, f):
-    print("CLIENT SAYS,", f)
-    if isinstance(f, Ping):
-        ping = Ping(f.uniq_id)
-        conn.put_frame(ping)
-        print(str(ping) + ", SAYS SERVER")
-    elif isinstance(f, SynStream):
+def make_connection():
+    conn = Context(SERVER)
+    conn.auto_ping = True # PINGs are echoed by the context itself
+    conn.finished = False
+
+    def on_syn_stream(f):
+        print("CLIENT SAYS,", f)
         resp = SynReply(f.stream_id, {'status': '200 OK', 'version': 'HTTP/1.1'}, flags=0)
         conn.put_frame(resp)
         print(str(resp) + ", SAYS SERVER")
@@ -35,25 +35,29 @@ def handle_frame(conn, f):
         goaway = Goaway(f.stream_id)
         conn.put_frame(goaway)
         print(str(goaway) + ", SAYS SERVER")
-    elif isinstance(f, Goaway):
-        return True
+
+    def on_goaway(f):
+        print("CLIENT SAYS,", f)
+        conn.finished = True
+
+    conn.set_handlers(on_syn_stream=on_syn_stream, on_goaway=on_goaway)
+    return conn
 
 try:
     print ('Running one-time one-client SPDY Server...')
     client_socket, address = server.accept()
     ss = ctx.wrap_socket(client_socket, server_side=True)
-    conn = Context(SERVER)
-    finish = False
-    while not finish:
+    conn = make_connection()
+    while not conn.finished:
         d = ss.recv(1024)
+        if not d:
+            break
         conn.incoming(d)
-        frame = conn.get_frame()
-        if frame:
-            finish = handle_frame(conn, frame)
-            outgoing = conn.outgoing()
-            if outgoing:
-                ss.sendall(outgoing)
-        
+        conn.dispatch()
+        outgoing = conn.outgoing()
+        if outgoing:
+            ss.sendall(outgoing)
+
 
 except Exception as exc:
     print(exc)
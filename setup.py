@@ -8,6 +8,6 @@ setup(
     author='Marcelo Fernandez',
     author_email='marcelo.fidel.fernandez@gmail.com',
     url='http//www.github.com/marcelofernandez/python-spdy',
-    packages=['spdy'],
+    packages=['spdy', 'spdy.bench'],
     package_dir={'spdy': 'spdy'}
 )
@@ -0,0 +1,626 @@
+# coding: utf-8
+""" asyncio integration (Python 3.7+): Protocols that drive a Context over an
+    asyncio transport and expose every SPDY stream as an async reader/writer.
+
+    Server:
+
+        async def handler(stream):
+            body = await stream.readall()
+            stream.reply({':status': '200 OK', ':version': 'HTTP/1.1'})
+            stream.write(b'hello', fin=True)
+            await stream.drain()
+
+        server = await spdy.aio.start_server(handler, '', 9599)
+
+    Client:
+
+        conn = await spdy.aio.open_connection('localhost', 9599)
+        stream = conn.open_stream(headers)
+        reply_headers = await stream.response()
+        body = await stream.readall()
+"""
+import asyncio
+import logging
+from collections import deque
+
+from spdy.context import Context, SERVER, CLIENT, SpdyProtocolError
+from spdy.frames import SynStream, SynReply, RstStream, Settings, DataFrame, \
+                        WindowUpdate, DEFAULT_VERSION, FLAG_FIN, CANCEL, \
+                        INTERNAL_ERROR, REFUSED_STREAM, INITIAL_WINDOW_SIZE, \
+                        PERSIST_NONE, ERROR_CODES
+
+log = logging.getLogger(__name__)
+
+# SPDY/3 flow control window of every stream until SETTINGS says otherwise
+DEFAULT_WINDOW_SIZE = 64 * 1024
+# Largest DATA frame we produce
+MAX_DATA_FRAME_SIZE = 16 * 1024
+# Size of the buffer handed to the transport by get_buffer()
+READ_BUFFER_SIZE = 256 * 1024
+
+class StreamReset(SpdyProtocolError):
+    def __init__(self, stream_id, error_code):
+        super(StreamReset, self).__init__('stream {0} reset: {1}'.format(
+                stream_id, ERROR_CODES.get(error_code, error_code)))
+        self.stream_id = stream_id
+        self.error_code = error_code
+
+class SpdyStream(object):
+    """ One SPDY stream: `headers` are the SYN_STREAM headers, the body is read
+        with read()/readall() or `async for chunk in stream`, and written with
+        write() + drain(). """
+
+    def __init__(self, protocol, stream_id, headers, priority=0):
+        self._protocol = protocol
+        self.stream_id = stream_id
+        self.headers = headers
+        self.priority = priority
+        self.reply_headers = None
+        self._reply_waiter = None
+        # incoming side
+        self._chunks = deque()
+        # unread bytes counted in the protocol's _buffered
+        self._unread = 0
+        self._eof = False
+        self._error = None
+        self._read_waiter = None
+        # outgoing side
+        self._pending = deque()
+        self._pending_fin = False
+        self._local_closed = False
+        self._send_window = protocol.initial_window
+
+    def __repr__(self):
+        return 'SpdyStream id={0}'.format(self.stream_id)
+
+    # Reading
+
+    def _feed(self, data, fin):
+        if data:
+            self._chunks.append(data)
+        if fin:
+            self._eof = True
+        self._wake_reader()
+
+    def _set_error(self, exc):
+        self._error = exc
+        self._pending.clear()
+        self._local_closed = True
+        self._wake_reader()
+        if self._reply_waiter is not None and not self._reply_waiter.done():
+            self._reply_waiter.set_exception(exc)
+            # retrieved here: nobody may ever await response()
+            self._reply_waiter.exception()
+
+    def _wake_reader(self):
+        waiter = self._read_waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    @property
+    def at_eof(self):
+        return self._eof and not self._chunks
+
+    async def read(self, n=-1):
+        """ Returns up to n bytes (everything buffered if n < 0), b'' at the
+            end of the stream. """
+        while not self._chunks and not self._eof and self._error is None:
+            self._read_waiter = self._protocol._loop.create_future()
+            try:
+                await self._read_waiter
+            finally:
+                self._read_waiter = None
+        if not self._chunks:
+            if self._error is not None:
+                raise self._error
+            return b''
+        if n < 0:
+            data = b''.join(self._chunks)
+            self._chunks.clear()
+        else:
+            data = self._chunks.popleft()
+            if len(data) > n:
+                self._chunks.appendleft(data[n:])
+                data = data[:n]
+        self._protocol._data_consumed(self, len(data))
+        return bytes(data)
+
+    async def readall(self):
+        parts = []
+        while True:
+            data = await self.read()
+            if not data:
+                return b''.join(parts)
+            parts.append(data)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        data = await self.read()
+        if not data:
+            raise StopAsyncIteration
+        return data
+
+    async def response(self):
+        """ Client side: waits for the SYN_REPLY and returns its headers """
+        if self.reply_headers is None:
+            await self._reply_waiter
+        return self.reply_headers
+
+    # Writing
+
+    def reply(self, headers, fin=False):
+        """ Server side: sends the SYN_REPLY, unless the stream was reset """
+        if self._error is not None:
+            return
+        flags = FLAG_FIN if fin else 0
+        self._protocol.ctx.put_frame(SynReply(self.stream_id, headers,
+                                flags=flags, version=self._protocol.version))
+        if fin:
+            self._local_closed = True
+            self._protocol._maybe_forget(self)
+        self._protocol._schedule_flush()
+
+    def write(self, data, fin=False):
+        """ Queues body data, `fin` closes our side. Data is framed and sent
+            as the peer's flow control window allows; use drain() to wait. """
+        if self._local_closed:
+            raise SpdyProtocolError('stream {0} is closed'.format(self.stream_id))
+        if data:
+            self._pending.append(bytes(data))
+        if fin:
+            self._local_closed = True
+            self._pending_fin = True
+        self._protocol._stream_writable(self)
+
+    def close(self):
+        if not self._local_closed:
+            self.write(b'', fin=True)
+
+    def reset(self, error_code=CANCEL):
+        if self._error is None:
+            self._protocol.ctx.put_frame(RstStream(self.stream_id, error_code,
+                                         version=self._protocol.version))
+            self._protocol._forget(self)
+            self._set_error(StreamReset(self.stream_id, error_code))
+            self._protocol._schedule_flush()
+
+    async def drain(self):
+        """ Waits until the queued data has been handed to the transport and
+            the transport is not asking us to pause. """
+        await self._protocol._drain(self)
+
+
+class SpdyProtocol(asyncio.BufferedProtocol):
+    """ Common server/client machinery. The Context is available as `ctx`;
+        PINGs are echoed and peer SETTINGS applied automatically. """
+    side = None
+
+    def __init__(self, version=DEFAULT_VERSION, settings=None, keepalive=None,
+                 read_high_water=1024 * 1024, memory_budget=None,
+                 tracer=None, capture=None, dictionary=None):
+        self.version = version
+        self.ctx = Context(self.side, version, dictionary)
+        self.ctx.tracer = tracer
+        self.ctx.capture = capture
+        self.ctx.auto_ping = True
+        self.ctx.auto_settings = True
+        self.ctx.set_handlers(on_syn_stream=self._on_syn_stream,
+                              on_syn_reply=self._on_syn_reply,
+                              on_headers=self._on_headers,
+                              on_data=self._on_data,
+                              on_rst_stream=self._on_rst_stream,
+                              on_settings=self._on_settings,
+                              on_window_update=self._on_window_update,
+                              on_goaway=self._on_goaway)
+        self.ctx.on_frames_queued = self._frames_queued
+        self.ctx.on_pause_reading = self._update_reading
+        self.ctx.on_resume_reading = self._update_reading
+        self.memory_budget = memory_budget
+        self.settings = settings
+        self.keepalive = keepalive
+        self.initial_window = DEFAULT_WINDOW_SIZE if version >= 3 else None
+        self.streams = {}
+        # Called with each SpdyStream once both of its sides are done
+        self.on_stream_closed = None
+        # Called with the exception (None on a clean close) once the
+        # connection is gone and its streams failed
+        self.on_connection_lost = None
+        self.transport = None
+        self._loop = None
+        self._buffer = memoryview(bytearray(READ_BUFFER_SIZE))
+        self._writable = deque()
+        self._flush_handle = None
+        self._write_paused = False
+        self._drain_waiters = []
+        self._read_high_water = read_high_water
+        self._buffered = 0
+        self._read_paused = False
+        self._transport_paused = False
+        self._write_limits = None
+        self._threadsafe_flush = False
+        self._keepalive_handle = None
+        self._closed = None
+
+    # asyncio.BufferedProtocol
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._loop = asyncio.get_event_loop()
+        if self.memory_budget is not None:
+            self.memory_budget.register(self.ctx, '{0}:{1}'.format(
+                        *(transport.get_extra_info('peername') or ('?', 0))[:2]))
+        self._closed = self._loop.create_future()
+        if self.settings:
+            pairs = dict((id, (PERSIST_NONE, value))
+                         for id, value in self.settings.items())
+            self.ctx.put_frame(Settings(len(pairs), pairs, version=self.version))
+        if self.keepalive:
+            self.ctx.set_keepalive(*self.keepalive)
+            self._schedule_keepalive()
+        self._flush()
+
+    def get_buffer(self, sizehint):
+        return self._buffer
+
+    def buffer_updated(self, nbytes):
+        self.ctx.incoming(self._buffer[:nbytes])
+        try:
+            self.ctx.dispatch()
+        except SpdyProtocolError as exc:
+            log.warning('closing connection: %s', exc)
+            self.transport.abort()
+            return
+        self._flush()
+
+    def eof_received(self):
+        return False
+
+    def connection_lost(self, exc):
+        if self.memory_budget is not None:
+            self.memory_budget.unregister(self.ctx)
+        if self.ctx.tracer is not None:
+            self.ctx.tracer.flush(self.ctx)
+        if self.ctx.capture is not None:
+            self.ctx.capture.closed(self.ctx)
+        if self._keepalive_handle is not None:
+            self._keepalive_handle.cancel()
+        error = exc or ConnectionResetError('connection closed')
+        for stream in list(self.streams.values()):
+            if not stream._eof:
+                stream._set_error(error)
+            self._forget(stream)
+        self._wake_drain_waiters()
+        if not self._closed.done():
+            self._closed.set_result(None)
+        if self.on_connection_lost is not None:
+            self.on_connection_lost(exc)
+
+    def pause_writing(self):
+        self._write_paused = True
+
+    def resume_writing(self):
+        self._write_paused = False
+        self._flush()
+
+    # Frame handlers
+
+    def _on_syn_stream(self, frame):
+        raise NotImplementedError()
+
+    def _on_syn_reply(self, frame):
+        stream = self.streams.get(frame.stream_id)
+        if stream is None:
+            return
+        stream.reply_headers = frame.headers
+        if stream._reply_waiter is not None and not stream._reply_waiter.done():
+            stream._reply_waiter.set_result(frame.headers)
+        if frame.fin:
+            stream._feed(b'', True)
+            self._maybe_forget(stream)
+
+    def _on_headers(self, frame):
+        stream = self.streams.get(frame.stream_id)
+        if stream is not None:
+            if stream.reply_headers is None:
+                stream.reply_headers = {}
+            stream.reply_headers.update(frame.headers)
+
+    def _on_data(self, frame):
+        stream = self.streams.get(frame.stream_id)
+        if stream is None:
+            return
+        self._buffered += len(frame.data)
+        stream._unread += len(frame.data)
+        stream._feed(frame.data, frame.fin)
+        # SPDY/3 windows already bound what each stream buffers
+        if self.version < 3 and not self._read_paused and \
+                self._buffered > self._read_high_water:
+            self._read_paused = True
+            self._update_reading()
+        if frame.fin:
+            self._maybe_forget(stream)
+
+    def _on_rst_stream(self, frame):
+        stream = self.streams.get(frame.stream_id)
+        if stream is not None:
+            self._forget(stream)
+            stream._set_error(StreamReset(frame.stream_id, frame.error_code))
+
+    def _on_settings(self, frame):
+        window = self.ctx.peer_settings.get(INITIAL_WINDOW_SIZE)
+        if window is not None and self.initial_window is not None:
+            delta = window - self.initial_window
+            self.initial_window = window
+            for stream in self.streams.values():
+                stream._send_window += delta
+                if stream._pending:
+                    self._writable.append(stream)
+
+    def _on_window_update(self, frame):
+        stream = self.streams.get(frame.stream_id)
+        if stream is not None:
+            stream._send_window += frame.delta_window_size
+            if stream._pending or stream._pending_fin:
+                self._writable.append(stream)
+
+    def _on_goaway(self, frame):
+        # The context already dropped our streams the peer never processed
+        for stream in list(self.streams.values()):
+            if stream.stream_id not in self.ctx.streams and not stream._eof:
+                self._forget(stream)
+                stream._set_error(StreamReset(stream.stream_id, REFUSED_STREAM))
+
+    # Streams bookkeeping
+
+    def _new_stream(self, stream_id, headers, priority):
+        stream = SpdyStream(self, stream_id, headers, priority)
+        self.streams[stream_id] = stream
+        return stream
+
+    def _forget(self, stream):
+        # what's left unread no longer holds up the connection, though it
+        # can still be read
+        self._release(stream._unread)
+        stream._unread = 0
+        if self.streams.pop(stream.stream_id, None) is not None and \
+                self.on_stream_closed is not None:
+            self.on_stream_closed(stream)
+
+    def _maybe_forget(self, stream):
+        if stream.stream_id not in self.ctx.streams and not stream._pending:
+            self._forget(stream)
+
+    def _release(self, nbytes):
+        self._buffered -= nbytes
+        if self._read_paused and self._buffered < self._read_high_water // 2:
+            self._read_paused = False
+            self._update_reading()
+
+    def _data_consumed(self, stream, nbytes):
+        counted = min(nbytes, stream._unread)
+        stream._unread -= counted
+        self._release(counted)
+        if self.version >= 3 and not stream._eof and nbytes:
+            self.ctx.put_frame(WindowUpdate(stream.stream_id, nbytes,
+                                            version=self.version))
+            self._schedule_flush()
+
+    def _update_reading(self, ctx=None):
+        """ Transport reading follows the unread stream data (SPDY/2) and the
+            Context watermarks / memory budget share """
+        paused = self._read_paused or self.ctx.reading_paused
+        if self.transport is None or paused == self._transport_paused or \
+                self.transport.is_closing():
+            return
+        self._transport_paused = paused
+        if paused:
+            self.transport.pause_reading()
+        else:
+            self.transport.resume_reading()
+
+    def _stream_writable(self, stream):
+        self._writable.append(stream)
+        self._schedule_flush()
+
+    def _send_pending(self, stream):
+        """ Moves a stream's pending data into the context, as far as the
+            flow control window allows """
+        put_frame = self.ctx.put_frame
+        while stream._pending:
+            window = stream._send_window
+            if window is not None and window <= 0:
+                return
+            data = stream._pending.popleft()
+            size = MAX_DATA_FRAME_SIZE
+            if window is not None:
+                size = min(size, window)
+            if len(data) > size:
+                stream._pending.appendleft(data[size:])
+                data = data[:size]
+            if window is not None:
+                stream._send_window -= len(data)
+            fin = stream._pending_fin and not stream._pending
+            put_frame(DataFrame(stream.stream_id, data, FLAG_FIN if fin else 0))
+            if fin:
+                stream._pending_fin = False
+        if stream._pending_fin:
+            stream._pending_fin = False
+            put_frame(DataFrame(stream.stream_id, b'', FLAG_FIN))
+        self._maybe_forget(stream)
+
+    # Output
+
+    def _schedule_flush(self):
+        if self._flush_handle is None and self._loop is not None:
+            self._flush_handle = self._loop.call_soon(self._flush)
+
+    def _frames_queued(self, ctx):
+        # Context.on_frames_queued: frames put from another thread
+        if self._loop is None or self._threadsafe_flush:
+            return
+        self._threadsafe_flush = True
+        self._loop.call_soon_threadsafe(self._flush)
+
+    def _flush(self):
+        self._threadsafe_flush = False
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self.transport is None or self.transport.is_closing():
+            return
+        if not self._write_paused:
+            writable, self._writable = self._writable, deque()
+            for stream in writable:
+                if stream._error is None:
+                    self._send_pending(stream)
+        chunks = self.ctx.outgoing_chunks()
+        if chunks:
+            self.transport.writelines(chunks)
+        if self.ctx._watermarks:
+            # resume_writing() must fire by the time we're under output_low
+            limits = self.ctx._limits()[2:]
+            if limits[0] and limits != self._write_limits:
+                self._write_limits = limits
+                self.transport.set_write_buffer_limits(*limits)
+            self.ctx.set_unsent_bytes(self.transport.get_write_buffer_size())
+        if not self._write_paused:
+            self._wake_drain_waiters()
+        if self.ctx.drained and not self.ctx.frame_queue:
+            self.transport.close()
+
+    def _wake_drain_waiters(self):
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _drain(self, stream):
+        while (stream._pending or stream._pending_fin or self._write_paused) \
+                and stream._error is None and not self._closed.done():
+            waiter = self._loop.create_future()
+            self._drain_waiters.append(waiter)
+            await waiter
+        if stream._error is not None:
+            raise stream._error
+
+    # Connection management
+
+    def _schedule_keepalive(self):
+        timeout = self.ctx.next_keepalive_timeout()
+        if timeout is not None:
+            self._keepalive_handle = self._loop.call_later(timeout + 0.001,
+                                                           self._keepalive_tick)
+
+    def _keepalive_tick(self):
+        if self.transport.is_closing():
+            return
+        if not self.ctx.keepalive():
+            log.warning('peer did not answer PING, closing connection')
+            self.transport.abort()
+            return
+        self._flush()
+        self._schedule_keepalive()
+
+    def ping(self):
+        """ Sends a PING, the context measures the RTT when it comes back """
+        ping_id = self.ctx.send_ping()
+        self._schedule_flush()
+        return ping_id
+
+    def shutdown(self):
+        """ Graceful close: GOAWAY now, close the transport once drained """
+        self.ctx.begin_shutdown()
+        self._flush()
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    async def wait_closed(self):
+        await self._closed
+
+
+class SpdyServerProtocol(SpdyProtocol):
+    """ Runs `handler(stream)` as a task for every stream the client opens """
+    side = SERVER
+
+    def __init__(self, handler, version=DEFAULT_VERSION, **kwargs):
+        super(SpdyServerProtocol, self).__init__(version, **kwargs)
+        self.handler = handler
+
+    def _on_syn_stream(self, frame):
+        stream = self._new_stream(frame.stream_id, frame.headers,
+                                  frame.priority)
+        if frame.fin:
+            stream._feed(b'', True)
+        self._loop.create_task(self._run_handler(stream))
+
+    async def _run_handler(self, stream):
+        try:
+            await self.handler(stream)
+        except Exception:
+            log.exception('error handling stream %i', stream.stream_id)
+            if not stream._local_closed:
+                stream.reset(INTERNAL_ERROR)
+
+
+class SpdyClientProtocol(SpdyProtocol):
+    """ Opens streams with open_stream(). Pushed streams are handed to
+        `push_handler(stream)` if set, refused otherwise. """
+    side = CLIENT
+
+    def __init__(self, version=DEFAULT_VERSION, push_handler=None, **kwargs):
+        super(SpdyClientProtocol, self).__init__(version, **kwargs)
+        self.push_handler = push_handler
+
+    def open_stream(self, headers, priority=0, fin=True):
+        """ Sends a SYN_STREAM, `fin=False` to write a request body after.
+            Raises ConnectionResetError once the connection is closing. """
+        if self.transport is None or self.transport.is_closing() or \
+                self._closed.done():
+            raise ConnectionResetError('connection closed')
+        stream_id = self.ctx.next_stream_id
+        self.ctx.put_frame(SynStream(stream_id, headers, priority=priority,
+                                     flags=FLAG_FIN if fin else 0,
+                                     version=self.version))
+        stream = self._new_stream(stream_id, headers, priority)
+        stream._reply_waiter = self._loop.create_future()
+        stream._local_closed = fin
+        self._schedule_flush()
+        return stream
+
+    def _on_syn_stream(self, frame):
+        if self.push_handler is None or not frame.assoc_stream_id:
+            self.ctx.put_frame(RstStream(frame.stream_id, REFUSED_STREAM,
+                                         version=self.version))
+            return
+        stream = self._new_stream(frame.stream_id, frame.headers,
+                                  frame.priority)
+        stream.reply_headers = frame.headers
+        stream._local_closed = True
+        if frame.fin:
+            stream._feed(b'', True)
+        self.push_handler(stream)
+
+
+async def start_server(handler, host=None, port=None, version=DEFAULT_VERSION,
+                       protocol_kwargs=None, **kwargs):
+    """ loop.create_server() for SPDY, extra kwargs (ssl, reuse_port...) are
+        passed to it. Returns the asyncio Server. """
+    loop = asyncio.get_event_loop()
+    protocol_kwargs = protocol_kwargs or {}
+    return await loop.create_server(
+        lambda: SpdyServerProtocol(handler, version, **protocol_kwargs),
+        host, port, **kwargs)
+
+async def open_connection(host, port, version=DEFAULT_VERSION,
+                          protocol_kwargs=None, **kwargs):
+    """ loop.create_connection() for SPDY, returns the SpdyClientProtocol """
+    loop = asyncio.get_event_loop()
+    protocol_kwargs = protocol_kwargs or {}
+    _, protocol = await loop.create_connection(
+        lambda: SpdyClientProtocol(version, **protocol_kwargs),
+        host, port, **kwargs)
+    return protocol
@@ -0,0 +1,395 @@
+# coding: utf-8
+""" Offline analysis of big captures (see spdy.capture)
+
+        analysis = analyze('edge.spdycap', processes=8)
+        analysis.index          # FrameIndex, one row per frame
+        analysis.report()       # header stats, stream sizes, compression
+
+    The capture is mmapped and scanned once for its records, then every
+    connection goes to a process pool: each worker walks the connection's
+    bytes in place, indexing every frame from its 8 byte header (DATA
+    payloads are never read) and decoding the control frames in order,
+    header blocks have to go through one inflater per direction. The
+    workers' index columns and counters are merged back here.
+
+        python -m spdy.analyze edge.spdycap -j 8
+"""
+import argparse
+import bisect
+import json
+import mmap
+import multiprocessing
+import sys
+from array import array
+
+from spdy.capture import scan, OPEN, IN, OUT, CLOSE, _OPEN, _SIDE_NAMES
+from spdy.context import Context, CLIENT, SERVER, get_int_from_stream, \
+                         _STREAM_CONTROL_FRAMES
+from spdy.frames import FRAME_NAMES, DATA, SYN_STREAM, SYN_REPLY, HEADERS
+from spdy.trace import Histogram
+
+# Who sent a frame, in FrameIndex.sender
+SENDERS = (CLIENT, SERVER)
+
+_HEADER_FRAMES = frozenset([SYN_STREAM, SYN_REPLY, HEADERS])
+_COLUMNS = (('conn_id', 'I'), ('sender', 'B'), ('frame_type', 'H'),
+            ('flags', 'B'), ('stream_id', 'I'), ('length', 'I'),
+            ('offset', 'Q'))
+
+
+class FrameIndex(object):
+    """ Column arrays, one row per frame: connection id, sender (index in
+        SENDERS), frame type (DATA = 0), flags, stream id (0 for frames
+        without one), payload length and the file offset of the frame's
+        first byte (frames can straddle records, see Analysis.frame_bytes()) """
+    __slots__ = tuple(name for name, _ in _COLUMNS)
+
+    def __init__(self):
+        for name, typecode in _COLUMNS:
+            setattr(self, name, array(typecode))
+
+    def __len__(self):
+        return len(self.offset)
+
+    def __repr__(self):
+        return '<FrameIndex {0} frames>'.format(len(self))
+
+    def extend(self, other):
+        for name, _ in _COLUMNS:
+            getattr(self, name).extend(getattr(other, name))
+
+    def row(self, i):
+        return dict((name, getattr(self, name)[i]) for name, _ in _COLUMNS)
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in
+                   (getattr(self, name) for name, _ in _COLUMNS))
+
+
+class Connection(object):
+    """ Where a captured connection's bytes are in the file: per direction,
+        the offsets and lengths of its records' payloads """
+    __slots__ = ('conn_id', 'side', 'version', 'opened', 'closed', 'segments')
+
+    def __init__(self, conn_id, side, version, opened):
+        self.conn_id = conn_id
+        self.side = side
+        self.version = version
+        self.opened = opened
+        self.closed = None
+        # IN / OUT -> (offsets, lengths)
+        self.segments = {IN: (array('Q'), array('I')),
+                         OUT: (array('Q'), array('I'))}
+
+    def __repr__(self):
+        return '<Connection {0} {1} v{2}>'.format(self.conn_id, self.side,
+                                                 self.version)
+
+    def sender(self, kind):
+        """ Who sent the bytes of IN or OUT records """
+        if kind == OUT:
+            return self.side
+        return CLIENT if self.side == SERVER else SERVER
+
+
+class _Stream(object):
+    """ One direction of a connection as a single byte string, read in
+        place from the segments """
+
+    def __init__(self, buf, offsets, lengths):
+        self.buf = buf
+        self.offsets = offsets
+        self.lengths = lengths
+        self.starts = array('Q')
+        total = 0
+        for length in lengths:
+            self.starts.append(total)
+            total += length
+        self.size = total
+
+    def file_offset(self, pos):
+        i = bisect.bisect_right(self.starts, pos) - 1
+        return self.offsets[i] + pos - self.starts[i]
+
+    def read(self, pos, count):
+        i = bisect.bisect_right(self.starts, pos) - 1
+        start = self.offsets[i] + pos - self.starts[i]
+        end = self.offsets[i] + self.lengths[i]
+        if start + count <= end:
+            return self.buf[start:start + count]
+        out = bytearray(self.buf[start:end])
+        while len(out) < count:
+            i += 1
+            need = count - len(out)
+            out.extend(self.buf[self.offsets[i]:
+                                self.offsets[i] + min(need, self.lengths[i])])
+        return bytes(out)
+
+
+def _empty_stats():
+    return {
+        'connections': 0,
+        'frames': {},                   # sender -> {frame name: count}
+        'frame_bytes': {},              # sender -> {frame name: bytes}
+        'header_blocks': {},            # sender -> count
+        'headers_raw': {},              # sender -> bytes
+        'headers_compressed': {},       # sender -> bytes
+        'header_names': {},             # name -> occurrences
+        'decode_errors': 0,
+        'histograms': {},               # name -> Histogram
+    }
+
+def _histogram(stats, name):
+    histogram = stats['histograms'].get(name)
+    if histogram is None:
+        histogram = stats['histograms'][name] = Histogram()
+    return histogram
+
+def _count(table, sender, key, amount=1):
+    into = table.setdefault(sender, {})
+    into[key] = into.get(key, 0) + amount
+
+
+_buffers = {}
+
+def _map(path):
+    # one mmap per file and worker process
+    buf = _buffers.get(path)
+    if buf is None:
+        with open(path, 'rb') as f:
+            buf = _buffers[path] = mmap.mmap(f.fileno(), 0,
+                                             access=mmap.ACCESS_READ)
+    return buf
+
+def _analyze_connection(args):
+    path, conn = args
+    buf = _map(path)
+    index = FrameIndex()
+    stats = _empty_stats()
+    stats['connections'] = 1
+    for kind in (IN, OUT):
+        sender = conn.sender(kind)
+        stream = _Stream(buf, *conn.segments[kind])
+        # the receiving side decodes
+        ctx = Context(CLIENT if sender == SERVER else SERVER, conn.version)
+        counters = ctx.counters
+        sender_id = SENDERS.index(sender)
+        data_per_stream = {}
+        broken = False
+        pos = 0
+        while stream.size - pos >= 8:
+            head = stream.read(pos, 8)
+            length = get_int_from_stream(head[5:8], 'big')
+            if stream.size - pos < 8 + length:
+                break # cut short by the end of the capture
+            if head[0] & 0x80:
+                frame_type = get_int_from_stream(head[2:4], 'big')
+            else:
+                frame_type = DATA
+            stream_id = 0
+            if frame_type == DATA:
+                stream_id = get_int_from_stream(head[0:4], 'big') & 0x7fffffff
+                data_per_stream[stream_id] = \
+                    data_per_stream.get(stream_id, 0) + length
+            else:
+                frame = None
+                if not broken:
+                    raw, compressed = counters.headers_in_raw, \
+                                      counters.headers_in_compressed
+                    try:
+                        frame, _ = ctx._parse_frame(stream.read(pos,
+                                                                8 + length))
+                    except Exception:
+                        # a bad frame, or the inflater is out of step: the
+                        # rest of this direction is only indexed
+                        stats['decode_errors'] += 1
+                        broken = True
+                if frame is None:
+                    if frame_type in _STREAM_CONTROL_FRAMES and length >= 4:
+                        stream_id = get_int_from_stream(
+                            stream.read(pos + 8, 4), 'big') & 0x7fffffff
+                else:
+                    stream_id = getattr(frame, 'stream_id', 0)
+                if frame is not None and frame_type in _HEADER_FRAMES:
+                    stats['header_blocks'][sender] = \
+                        stats['header_blocks'].get(sender, 0) + 1
+                    names = stats['header_names']
+                    for name in frame.headers:
+                        names[name] = names.get(name, 0) + 1
+                    _histogram(stats, sender + '_header_raw_bytes').add(
+                        counters.headers_in_raw - raw)
+                    _histogram(stats, sender + '_header_compressed_bytes').add(
+                        counters.headers_in_compressed - compressed)
+            name = FRAME_NAMES.get(frame_type, str(frame_type))
+            _count(stats['frames'], sender, name)
+            _count(stats['frame_bytes'], sender, name, 8 + length)
+            index.conn_id.append(conn.conn_id)
+            index.sender.append(sender_id)
+            index.frame_type.append(frame_type)
+            index.flags.append(head[4])
+            index.stream_id.append(stream_id)
+            index.length.append(length)
+            index.offset.append(stream.file_offset(pos))
+            pos += 8 + length
+        stats['headers_raw'][sender] = counters.headers_in_raw
+        stats['headers_compressed'][sender] = counters.headers_in_compressed
+        sizes = _histogram(stats, sender + '_stream_data_bytes')
+        for size in data_per_stream.values():
+            sizes.add(size)
+    return conn.conn_id, index, stats
+
+def _merge(total, stats):
+    for name, value in stats.items():
+        if name == 'histograms':
+            for key, histogram in value.items():
+                _histogram(total, key).merge(histogram)
+        elif name in ('frames', 'frame_bytes'):
+            for sender, counts in value.items():
+                for key, count in counts.items():
+                    _count(total[name], sender, key, count)
+        elif isinstance(value, dict):
+            into = total[name]
+            for key, count in value.items():
+                into[key] = into.get(key, 0) + count
+        else:
+            total[name] += value
+
+
+class Analysis(object):
+    """ What analyze() found: `connections` (conn_id -> Connection), the
+        FrameIndex and the merged counters in `stats` """
+
+    def __init__(self, path, connections, index, stats):
+        self.path = path
+        self.connections = connections
+        self.index = index
+        self.stats = stats
+
+    def __repr__(self):
+        return '<Analysis {0}: {1} connections, {2} frames>'.format(
+            self.path, len(self.connections), len(self.index))
+
+    def frame_bytes(self, i):
+        """ The bytes of the frame in row `i` of the index """
+        index = self.index
+        conn = self.connections[index.conn_id[i]]
+        kind = OUT if SENDERS[index.sender[i]] == conn.side else IN
+        offsets, lengths = conn.segments[kind]
+        with open(self.path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            stream = _Stream(buf, offsets, lengths)
+            offset = index.offset[i]
+            j = bisect.bisect_right(offsets, offset) - 1
+            return bytes(stream.read(stream.starts[j] + offset - offsets[j],
+                                     8 + index.length[i]))
+        finally:
+            buf.close()
+
+    def report(self, top=20, percentiles=(50, 90, 99, 99.9)):
+        """ A JSON-friendly summary: frames and bytes by sender and type,
+            header block counts, sizes and compression ratio per sender,
+            the most common header names and the distributions of header
+            block and per-stream DATA sizes """
+        stats = self.stats
+        compression = {}
+        for sender in SENDERS:
+            raw = stats['headers_raw'].get(sender, 0)
+            compressed = stats['headers_compressed'].get(sender, 0)
+            compression[sender] = {
+                'header_blocks': stats['header_blocks'].get(sender, 0),
+                'raw_bytes': raw,
+                'compressed_bytes': compressed,
+                'ratio': float(compressed) / raw if raw else None,
+            }
+        distributions = {}
+        for name, histogram in sorted(stats['histograms'].items()):
+            if not histogram.count:
+                continue
+            result = {'count': histogram.count, 'min': histogram.min,
+                      'mean': histogram.total / float(histogram.count),
+                      'max': histogram.max}
+            for p in percentiles:
+                result['p{0:g}'.format(p).replace('.', '')] = \
+                    histogram.percentile(p)
+            distributions[name] = result
+        names = sorted(stats['header_names'].items(),
+                       key=lambda item: (-item[1], item[0]))[:top]
+        return {
+            'connections': stats['connections'],
+            'frames': len(self.index),
+            'index_bytes': self.index.nbytes(),
+            'decode_errors': stats['decode_errors'],
+            'frames_by_type': stats['frames'],
+            'bytes_by_type': stats['frame_bytes'],
+            'compression': compression,
+            'top_header_names': names,
+            'distributions': distributions,
+        }
+
+
+def connections(buf):
+    """ conn_id -> Connection for every connection in a mapped capture """
+    found = {}
+    for kind, conn_id, when, offset, length in scan(buf):
+        if kind == OPEN:
+            side, version = _OPEN.unpack_from(buf, offset)
+            found[conn_id] = Connection(conn_id, _SIDE_NAMES[side], version,
+                                        when)
+            continue
+        conn = found.get(conn_id)
+        if conn is None:
+            continue
+        if kind == CLOSE:
+            conn.closed = when
+        elif length:
+            offsets, lengths = conn.segments[kind]
+            offsets.append(offset)
+            lengths.append(length)
+    return found
+
+def analyze(path, processes=None, chunksize=4):
+    """ Indexes and decodes a capture file, connections spread over
+        `processes` worker processes (default: one per CPU; 1 runs
+        everything here) """
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        found = connections(buf)
+    finally:
+        buf.close()
+    jobs = [(path, found[conn_id]) for conn_id in sorted(found)]
+    if processes == 1 or len(jobs) <= 1:
+        results = [_analyze_connection(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = list(pool.imap_unordered(_analyze_connection, jobs,
+                                               chunksize))
+        finally:
+            pool.close()
+            pool.join()
+    index = FrameIndex()
+    stats = _empty_stats()
+    for _, part, part_stats in sorted(results, key=lambda result: result[0]):
+        index.extend(part)
+        _merge(stats, part_stats)
+    return Analysis(path, found, index, stats)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m spdy.analyze',
+                                     description='Analyze a SPDY capture')
+    parser.add_argument('capture')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--top', type=int, default=20,
+                        help='header names to list (default 20)')
+    args = parser.parse_args(argv)
+    analysis = analyze(args.capture, args.processes)
+    json.dump(analysis.report(args.top), sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# coding: utf-8
+""" Benchmark suites, run with `python -m spdy.bench`.
+
+    Every suite yields (name, make_run, ops, nbytes) cases: make_run() does
+    the untimed setup and returns a callable performing `ops` operations
+    over `nbytes` bytes of payload. Results are plain dicts, written as JSON
+    with the environment they were measured in, and compare() checks them
+    against a saved baseline.
+"""
+import gc
+import os
+import platform
+import subprocess
+import sys
+import time
+import zlib
+
+def environment():
+    """ Where the numbers come from """
+    try:
+        import bitarray
+        bitarray_version = bitarray.__version__
+    except (ImportError, AttributeError):
+        bitarray_version = None
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'bitarray': bitarray_version,
+        'zlib': zlib.ZLIB_RUNTIME_VERSION,
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+def measure(make_run, ops, nbytes=0, repeat=5, min_time=0.1):
+    """ Times make_run()() `repeat` times (each at least `min_time` seconds,
+        looping as needed) and keeps the best run, the least disturbed one """
+    best = None
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            elapsed = 0.0
+            loops = 0
+            while elapsed < min_time or not loops:
+                run = make_run()
+                started = time.perf_counter()
+                run()
+                elapsed += time.perf_counter() - started
+                loops += 1
+            per_op = elapsed / (loops * ops)
+            if best is None or per_op < best:
+                best = per_op
+    finally:
+        if gc_enabled:
+            gc.enable()
+    result = {'ns_per_op': best * 1e9, 'ops_per_sec': 1.0 / best}
+    if nbytes:
+        result['mb_per_sec'] = nbytes / ops / best / 1e6
+    return result
+
+def run_cases(cases, repeat=5, min_time=0.1, match=None, progress=None):
+    """ {name: result} for the cases whose name contains `match` """
+    results = {}
+    for name, make_run, ops, nbytes in cases:
+        if match and match not in name:
+            continue
+        results[name] = measure(make_run, ops, nbytes, repeat, min_time)
+        if progress is not None:
+            progress(name, results[name])
+    return results
+
+# What compare() looks at, lower is better for all of them
+METRICS = ('ns_per_op', 'bytes_per_conn', 'load_time_ms')
+
+def compare(baseline, current, threshold=0.10):
+    """ [(name, metric, baseline value, current value, change)] for the
+        cases at least `threshold` worse than in `baseline` (both as written
+        by the runner), worst first """
+    regressions = []
+    old = baseline.get('results', baseline)
+    for name, result in current.get('results', current).items():
+        if name not in old:
+            continue
+        metric = next((m for m in METRICS if m in result), None)
+        if metric is None or not old[name].get(metric):
+            continue
+        before, after = old[name][metric], result[metric]
+        change = after / before - 1.0
+        if change >= threshold:
+            regressions.append((name, metric, before, after, change))
+    regressions.sort(key=lambda row: row[4], reverse=True)
+    return regressions
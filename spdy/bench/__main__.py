@@ -0,0 +1,179 @@
+# coding: utf-8
+""" python -m spdy.bench [suite] [options]
+
+        python -m spdy.bench -o baseline.json
+        python -m spdy.bench --compare baseline.json     # exits 1 on regressions
+        python -m spdy.bench e2e -c 1,100 -s 1,16 --sizes 0,16384 --tls
+        python -m spdy.bench memory --count 10000
+        python -m spdy.bench netsim --seed 1
+"""
+import argparse
+import json
+import sys
+
+from spdy import bench
+from spdy.bench import codec, e2e, memory, netsim
+
+def _ints(value):
+    return [int(v) for v in value.split(',') if v]
+
+def _run_codec(args, progress):
+    repeat, min_time = args.repeat, args.min_time
+    if args.quick:
+        repeat, min_time = 1, 0.0
+    settings = {'repeat': repeat, 'min_time': min_time,
+                'versions': args.versions}
+    return settings, bench.run_cases(codec.cases(args.versions), repeat,
+                                     min_time, args.filter, progress)
+
+def _run_e2e(args, progress):
+    duration, warmup = args.duration, args.warmup
+    if args.quick:
+        duration, warmup = 1.0, 0.2
+    settings = {'engine': args.engine, 'transport': args.transport,
+                'tls': args.tls, 'duration': duration, 'warmup': warmup,
+                'workers': args.workers, 'versions': args.versions}
+    return settings, e2e.sweep(args.engine, args.transport, args.versions,
+                               args.connections, args.streams, args.sizes,
+                               duration, warmup, args.workers, args.tls,
+                               args.filter, progress)
+
+def _run_memory(args, progress):
+    count = 200 if args.quick else args.count
+    settings = {'count': count, 'streams': args.active_streams,
+                'data_size': args.data_size, 'versions': args.versions}
+    return settings, memory.sweep(args.states.split(','), args.versions,
+                                  count, args.active_streams, args.data_size,
+                                  args.filter, progress)
+
+def _run_netsim(args, progress):
+    settings = {'seed': args.seed, 'versions': args.versions}
+    return settings, netsim.sweep(args.versions, args.seed, args.filter,
+                                  progress)
+
+SUITES = {
+    'codec': _run_codec,
+    'e2e': _run_e2e,
+    'memory': _run_memory,
+    'netsim': _run_netsim,
+}
+
+def _print_result(name, result):
+    if 'bytes_per_conn' in result:
+        line = '{0:<20} {1:>10.0f} bytes/conn {2:>8.0f} conns/GB  '.format(
+            name, result['bytes_per_conn'], result['conns_per_gb'] or 0)
+        line += '  '.join('{0} {1:.0f}'.format(component, size) for
+                          component, size in result['components'].items())
+    elif 'load_time_ms' in result:
+        line = '{0:<36} {1:>10.1f} ms load  {2:>9.1f} ms CPU'.format(
+            name, result['load_time_ms'], result['cpu_ms'])
+        if result.get('critical_ms') is not None:
+            line += '  critical {0:.1f} ms'.format(result['critical_ms'])
+        if result.get('mbps') is not None:
+            line += '  {0:.2f} Mbit/s'.format(result['mbps'])
+        if result['segments_lost']:
+            line += '  lost {0}'.format(result['segments_lost'])
+    elif 'p50_ms' in result:
+        line = ('{0:<36} {1:>9.0f} req/s {2:>8.1f} MB/s  p50 {3:>7.2f}  '
+                'p99 {4:>7.2f}  p999 {5:>7.2f} ms').format(
+                name, result['req_per_sec'], result['mb_per_sec'],
+                result['p50_ms'] or 0, result['p99_ms'] or 0,
+                result['p999_ms'] or 0)
+        for side in ('client', 'server'):
+            cpu = result.get(side + '_cpu_us_per_req')
+            if cpu is not None:
+                line += '  {0} {1:.0f} us/req'.format(side, cpu)
+        if result['errors']:
+            line += '  errors {0}'.format(result['errors'])
+    else:
+        line = '{0:<44} {1:>12.0f} ns/op {2:>12.0f} ops/s'.format(
+            name, result['ns_per_op'], result['ops_per_sec'])
+        if 'mb_per_sec' in result:
+            line += ' {0:>9.1f} MB/s'.format(result['mb_per_sec'])
+    print(line)
+    sys.stdout.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m spdy.bench',
+                                     description='SPDY benchmark suites')
+    parser.add_argument('suite', nargs='?', default='codec',
+                        choices=sorted(SUITES))
+    parser.add_argument('--quick', action='store_true',
+                        help='short runs, for smoke testing')
+    parser.add_argument('-k', '--filter', default=None,
+                        help='only run cases whose name contains this')
+    parser.add_argument('--versions', type=_ints, default=[2, 3],
+                        help='comma separated SPDY versions (default 2,3)')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='JSON results to check for regressions against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative worsening flagged as a regression '
+                             '(default 0.10)')
+
+    group = parser.add_argument_group('codec')
+    group.add_argument('--repeat', type=int, default=5)
+    group.add_argument('--min-time', type=float, default=0.2,
+                       help='seconds per timed run (default 0.2)')
+
+    group = parser.add_argument_group('e2e')
+    group.add_argument('--engine', choices=e2e.ENGINES, default='server')
+    group.add_argument('--transport', choices=e2e.TRANSPORTS, default='tcp')
+    group.add_argument('--tls', action='store_true',
+                       help='self-signed TLS (aio engine, needs openssl)')
+    group.add_argument('-c', '--connections', type=_ints, default=[1, 10, 100],
+                       help='comma separated connection counts')
+    group.add_argument('-s', '--streams', type=_ints, default=[1, 8],
+                       help='comma separated concurrent streams per connection')
+    group.add_argument('--sizes', type=_ints, default=[0, 1024, 65536],
+                       help='comma separated response sizes')
+    group.add_argument('-d', '--duration', type=float, default=5.0)
+    group.add_argument('--warmup', type=float, default=1.0)
+    group.add_argument('-w', '--workers', type=int, default=1,
+                       help='load generator processes')
+
+    group = parser.add_argument_group('memory')
+    group.add_argument('--count', type=int, default=2000,
+                       help='Contexts built per state (default 2000)')
+    group.add_argument('--states', default=','.join(memory.STATES),
+                       help='comma separated states (default all)')
+    group.add_argument('--active-streams', type=int, default=4,
+                       help='open streams per active Context (default 4)')
+    group.add_argument('--data-size', type=int, default=4096,
+                       help='DATA queued per active stream (default 4096)')
+
+    group = parser.add_argument_group('netsim')
+    group.add_argument('--seed', type=int, default=0,
+                       help='simulation seed (default 0)')
+    args = parser.parse_args(argv)
+    if args.tls and args.engine != 'aio':
+        parser.error('--tls needs --engine aio')
+
+    settings, results = SUITES[args.suite](args, _print_result)
+    report = {
+        'suite': args.suite,
+        'environment': bench.environment(),
+        'settings': settings,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = bench.compare(baseline, report, args.threshold)
+        if not regressions:
+            print('no regressions against {0}'.format(args.compare))
+            return 0
+        print('{0} regression(s) against {1}:'.format(len(regressions),
+                                                      args.compare))
+        for name, metric, before, after, change in regressions:
+            print('  {0:<44} {1:>12.0f} -> {2:>12.0f} {3}  +{4:.0%}'.format(
+                name, before, after, metric, change))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
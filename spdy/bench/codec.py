@@ -0,0 +1,182 @@
+# coding: utf-8
+""" Frame codec benchmarks: encode / decode of every frame type, n/v header
+    blocks of realistic sizes, DATA frames from empty to the 24 bit length
+    limit, and compressor setup, for SPDY/2 and SPDY/3. """
+from spdy.c_zlib import Deflater, Inflater
+from spdy.context import Context, CLIENT, SERVER, serialize_headers
+from spdy.frames import FRAME_TYPES, FRAME_NAMES, VERSIONS, SYN_STREAM, \
+                        SYN_REPLY, RST_STREAM, SETTINGS, PING, GOAWAY, \
+                        HEADERS, WINDOW_UPDATE, SynStream, SynReply, \
+                        RstStream, Settings, Ping, Goaway, Headers, \
+                        WindowUpdate, DataFrame, CANCEL, UPLOAD_BANDWIDTH, \
+                        DOWNLOAD_BANDWIDTH, PERSIST_NONE
+from spdy.http import request_headers, response_headers
+
+# Largest DATA payload the 24 bit length field allows
+MAX_DATA_SIZE = 2 ** 24 - 1
+DATA_SIZES = [0, 64, 1024, 16 * 1024, 256 * 1024, 1024 * 1024, MAX_DATA_SIZE]
+# Bytes pushed through per timed run for DATA cases
+DATA_VOLUME = 32 * 1024 * 1024
+# Frames per timed run for control frame cases
+BATCH = 200
+
+_USER_AGENT = ('Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+               '(KHTML, like Gecko) Chrome/30.0.1599.101 Safari/537.36')
+
+def header_blocks(version):
+    """ Request n/v blocks of increasing size: a bare API call, a browser
+        page load, and the same with a pile of cookies """
+    small = request_headers(version, 'GET', '/api/v1/items?page=2',
+                            'api.example.com', 'https',
+                            {'accept': 'application/json'})
+    medium = request_headers(version, 'GET', '/news/2013/10/article.html',
+                             'www.example.com', 'https', {
+        'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,'
+                  '*/*;q=0.8',
+        'accept-encoding': 'gzip,deflate,sdch',
+        'accept-language': 'en-US,en;q=0.8,fr;q=0.6',
+        'cache-control': 'max-age=0',
+        'referer': 'https://www.example.com/news/',
+        'user-agent': _USER_AGENT,
+        'if-none-match': '"5c2a1d-3f7b-4e8f9a2b"',
+        'if-modified-since': 'Sat, 19 Oct 2013 10:12:44 GMT',
+    })
+    large = dict(medium)
+    large['cookie'] = '; '.join('c{0}={1}'.format(i, 'v' * 48)
+                                for i in range(64))
+    return [('small', small), ('medium', medium), ('large', large)]
+
+def sample_frame(frame_type, version):
+    """ A typical frame of each type, None if `version` doesn't have it """
+    if frame_type == SYN_STREAM:
+        return SynStream(1, header_blocks(version)[1][1], priority=1,
+                         version=version)
+    if frame_type == SYN_REPLY:
+        return SynReply(1, response_headers(version, 200, {
+            'content-type': 'text/html; charset=utf-8',
+            'cache-control': 'private, max-age=0',
+            'date': 'Sat, 19 Oct 2013 10:12:44 GMT',
+            'server': 'spdy'}), version=version)
+    if frame_type == RST_STREAM:
+        return RstStream(1, CANCEL, version=version)
+    if frame_type == SETTINGS:
+        return Settings(2, {UPLOAD_BANDWIDTH: (PERSIST_NONE, 60),
+                            DOWNLOAD_BANDWIDTH: (PERSIST_NONE, 128)},
+                        version=version)
+    if frame_type == PING:
+        return Ping(1, version=version)
+    if frame_type == GOAWAY:
+        if version == 2:
+            return Goaway(1, version=version)
+        return Goaway(1, 0, version=version)
+    if frame_type == HEADERS:
+        return Headers(1, {'x-trailer': 'done'}, version=version)
+    if frame_type == WINDOW_UPDATE:
+        if version < 3:
+            return None
+        return WindowUpdate(1, 65536, version=version)
+    return None
+
+def _encode_case(version, frames):
+    def make_run():
+        encode = Context(CLIENT, version)._encode_frame
+        def run():
+            for frame in frames:
+                encode(frame)
+        return run
+    return make_run
+
+def _decode_case(version, frames):
+    # header blocks share one zlib stream: decode the whole batch in order,
+    # with a fresh Context each time
+    encoder = Context(CLIENT, version)
+    wire = [bytes(encoder._encode_frame(frame)) for frame in frames]
+    def make_run():
+        parse = Context(SERVER, version)._parse_frame
+        def run():
+            for chunk in wire:
+                parse(chunk)
+        return run
+    return make_run
+
+def _data_cases(version):
+    for size in DATA_SIZES:
+        count = max(1, min(BATCH * 10, DATA_VOLUME // max(size, 1)))
+        payload = b'x' * size
+        frames = [DataFrame(1, payload, 0) for _ in range(count)]
+        ctx = Context(CLIENT, version)
+        wire = bytes(ctx._encode_frame(frames[0]))
+        prefix = 'v{0}/data/{1}'.format(version, size)
+
+        def encode(frames=frames):
+            encode = Context(CLIENT, version)._encode_frame
+            def run():
+                for frame in frames:
+                    encode(frame)
+            return run
+
+        def chunks(frames=frames):
+            ctx = Context(CLIENT, version)
+            for frame in frames:
+                ctx.put_frame(frame)
+            return ctx.outgoing_chunks
+
+        def decode(wire=wire, count=count):
+            parse = Context(SERVER, version)._parse_frame
+            def run():
+                for _ in range(count):
+                    parse(wire)
+            return run
+
+        yield prefix + '/encode', encode, count, size * count
+        yield prefix + '/outgoing_chunks', chunks, count, size * count
+        yield prefix + '/decode', decode, count, size * count
+
+def cases(versions=VERSIONS):
+    """ (name, make_run, ops, nbytes) for every codec benchmark """
+    for version in versions:
+        for frame_type in sorted(FRAME_TYPES):
+            frame = sample_frame(frame_type, version)
+            if frame is None:
+                continue
+            name = 'v{0}/frame/{1}'.format(version, FRAME_NAMES[frame_type])
+            frames = [frame] * BATCH
+            yield name + '/encode', _encode_case(version, frames), BATCH, 0
+            yield name + '/decode', _decode_case(version, frames), BATCH, 0
+
+        for label, headers in header_blocks(version):
+            name = 'v{0}/headers/{1}'.format(version, label)
+            block = serialize_headers(headers, version)
+            frames = [SynStream(1, headers, version=version)] * BATCH
+            nbytes = len(block) * BATCH
+
+            def serialize(headers=headers):
+                def run():
+                    for _ in range(BATCH):
+                        serialize_headers(headers, version)
+                return run
+
+            def compress(block=block):
+                deflate = Deflater(version).compress
+                def run():
+                    for _ in range(BATCH):
+                        deflate(block)
+                return run
+
+            yield name + '/serialize', serialize, BATCH, nbytes
+            yield name + '/compress', compress, BATCH, nbytes
+            yield name + '/encode', _encode_case(version, frames), BATCH, nbytes
+            yield name + '/decode', _decode_case(version, frames), BATCH, nbytes
+
+        for case in _data_cases(version):
+            yield case
+
+        def deflater():
+            return lambda: Deflater(version)
+        def inflater():
+            return lambda: Inflater(version)
+        def context():
+            return lambda: Context(CLIENT, version)
+        yield 'v{0}/setup/deflater'.format(version), deflater, 1, 0
+        yield 'v{0}/setup/inflater'.format(version), inflater, 1, 0
+        yield 'v{0}/setup/context'.format(version), context, 1, 0
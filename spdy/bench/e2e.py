@@ -0,0 +1,182 @@
+# coding: utf-8
+""" End-to-end benchmarks: a server process answering GET /<size> with
+    <size> bytes, and spdy.loadgen clients over loopback TCP or a Unix
+    socket, plain or TLS with a throwaway self-signed certificate. Sweeps
+    versions, connection counts, streams per connection and response sizes;
+    reports req/s, MB/s, latency percentiles and CPU per request on both
+    sides.
+
+    The server is spdy.server.Server (engine 'server', plain sockets only)
+    or spdy.aio (engine 'aio', which also does TLS). """
+import asyncio
+import itertools
+import multiprocessing
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+from spdy.aio import start_server
+from spdy.http import parse_request, response_headers
+from spdy.loadgen import run_parallel, raise_nofile_limit
+from spdy.server import Server
+
+ENGINES = ('server', 'aio')
+TRANSPORTS = ('tcp', 'unix')
+
+def self_signed_cert(directory):
+    """ (certfile, keyfile) for CN=localhost in `directory`, made with the
+        openssl command line tool """
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+                           '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                           '-keyout', keyfile, '-out', certfile],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+def _body_size(path):
+    try:
+        return int(path.strip('/').split('?')[0])
+    except ValueError:
+        return 0
+
+def _report(pipe, served):
+    # answers every poke with (CPU seconds, requests served) until the
+    # harness closes its end
+    while True:
+        try:
+            pipe.recv()
+        except EOFError:
+            return
+        pipe.send((time.process_time(), served()))
+
+def _serve(engine, sock, version, pipe, tls):
+    raise_nofile_limit()
+    bodies = {}
+    def body(path):
+        size = _body_size(path)
+        if size not in bodies:
+            bodies[size] = b'x' * size
+        return bodies[size]
+    headers = {'content-type': 'application/octet-stream'}
+
+    if engine == 'server':
+        def handler(request):
+            request.respond(200, headers, body(request.path))
+        server = Server(handler, sock=sock, version=version)
+        threading.Thread(target=_report, args=(pipe, lambda: server.requests),
+                         daemon=True).start()
+        server.serve_forever()
+        return
+
+    served = [0]
+    reply = response_headers(version, 200, headers)
+    async def handler(stream):
+        served[0] += 1
+        data = body(parse_request(version, stream.headers)[1])
+        stream.reply(reply, fin=not data)
+        if data:
+            stream.write(data, fin=True)
+            await stream.drain()
+    async def main():
+        context = None
+        if tls:
+            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            context.load_cert_chain(*tls)
+        server = await start_server(handler, sock=sock, version=version,
+                                    ssl=context)
+        await server.serve_forever()
+    threading.Thread(target=_report, args=(pipe, lambda: served[0]),
+                     daemon=True).start()
+    asyncio.run(main())
+
+def _listen(transport, directory):
+    if transport == 'unix':
+        path = os.path.join(directory, 'spdy.sock')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.listen(4096)
+        return sock, path
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(4096)
+    return sock, sock.getsockname()
+
+def run_one(engine='server', transport='tcp', version=3, connections=10,
+            streams=1, size=1024, duration=5.0, warmup=1.0, workers=1,
+            tls=False):
+    """ One load run against a fresh server process, returns loadgen's
+        result dict plus server side CPU and ns_per_op (per request, at the
+        measured throughput) """
+    if tls and engine != 'aio':
+        raise ValueError("TLS needs the 'aio' engine")
+    directory = tempfile.mkdtemp(prefix='spdy-bench-')
+    try:
+        certs = self_signed_cert(directory) if tls else None
+        sock, address = _listen(transport, directory)
+        ours, theirs = multiprocessing.Pipe()
+        server = multiprocessing.Process(target=_serve,
+                    args=(engine, sock, version, theirs, certs))
+        server.start()
+        sock.close()
+        samples = []
+        def sample():
+            # CPU over the measured window only, not the connection setup
+            time.sleep(warmup)
+            for delay in (duration, None):
+                ours.send(None)
+                samples.append(ours.recv())
+                if delay:
+                    time.sleep(delay)
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        try:
+            result = run_parallel(address, connections, workers,
+                                  streams=streams, duration=duration,
+                                  warmup=warmup, version=version,
+                                  path='/{0}'.format(size),
+                                  ssl=True if tls else None)
+            sampler.join(duration + warmup + 5)
+        finally:
+            ours.close()
+            server.terminate()
+            server.join()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    result['server_cpu_us_per_req'] = None
+    if len(samples) == 2:
+        (cpu0, served0), (cpu1, served1) = samples
+        if served1 > served0:
+            result['server_cpu_us_per_req'] = (cpu1 - cpu0) / \
+                                              (served1 - served0) * 1e6
+    result['client_cpu_us_per_req'] = result.pop('cpu_us_per_req', None)
+    result['ops_per_sec'] = result['req_per_sec']
+    result['ns_per_op'] = 1e9 / result['req_per_sec'] \
+                          if result['req_per_sec'] else float('inf')
+    return result
+
+def sweep(engine='server', transport='tcp', versions=(3,), connections=(10,),
+          streams=(1,), sizes=(1024,), duration=5.0, warmup=1.0, workers=1,
+          tls=False, match=None, progress=None):
+    """ {name: run_one() result} over every combination """
+    raise_nofile_limit()
+    results = {}
+    for version, conns, nstreams, size in itertools.product(
+            versions, connections, streams, sizes):
+        name = '{0}/{1}{2}/v{3}/c{4}/s{5}/{6}'.format(
+            engine, transport, '+tls' if tls else '', version, conns,
+            nstreams, size)
+        if match and match not in name:
+            continue
+        results[name] = run_one(engine, transport, version, conns, nstreams,
+                                size, duration, warmup, workers, tls)
+        if progress is not None:
+            progress(name, results[name])
+    return results
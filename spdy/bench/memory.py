@@ -0,0 +1,164 @@
+# coding: utf-8
+""" Memory density: what one server Context costs, in three states
+
+        idle        just created, nothing received
+        handshake   SETTINGS received, first SYN_STREAM half way in
+        active      `streams` open streams, SYN_REPLY sent and a DATA frame
+                    of `data_size` bytes queued on each
+
+    N Contexts are built in a fresh process per state and measured twice
+    (tracemalloc costs memory of its own): RSS growth gives the total, and
+    tracemalloc splits the Python side by the spdy module that allocated it
+    (`c_zlib` is the ctypes z_streams and the output buffers they keep).
+    What RSS sees and tracemalloc doesn't is the native zlib state of the
+    Deflater and Inflater (malloc()ed by libz), reported as `zlib_native`. """
+import gc
+import multiprocessing
+import os
+import resource
+import sys
+import tracemalloc
+
+from spdy import c_zlib, context, frames
+from spdy.context import Context, CLIENT, SERVER
+from spdy.frames import SynStream, SynReply, Settings, DataFrame, \
+                        MAX_CONCURRENT_STREAMS, INITIAL_WINDOW_SIZE, \
+                        PERSIST_NONE
+from spdy.http import request_headers, response_headers
+
+STATES = ('idle', 'handshake', 'active')
+
+# tracemalloc filename -> component
+_COMPONENTS = {
+    os.path.abspath(context.__file__): 'context',
+    os.path.abspath(c_zlib.__file__): 'c_zlib',
+    os.path.abspath(frames.__file__): 'frames',
+    os.path.abspath(__file__): 'queued_data',
+}
+
+def rss():
+    """ Resident set size of this process in bytes """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # peak rather than current, fine in a fresh process that only grows
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+def _client_bytes(version, streams):
+    """ What a client sends first: SETTINGS and `streams` SYN_STREAMs. A
+        fresh deflater always produces the same bytes, so every server
+        Context can be fed the same wire data. """
+    client = Context(CLIENT, version)
+    client.put_frame(Settings(2, {MAX_CONCURRENT_STREAMS: (PERSIST_NONE, 100),
+                                  INITIAL_WINDOW_SIZE: (PERSIST_NONE, 65536)},
+                              version=version))
+    settings = bytes(client.outgoing())
+    headers = request_headers(version, 'GET', '/index.html', 'www.example.com',
+                              'https', {'accept': '*/*',
+                                        'accept-encoding': 'gzip,deflate',
+                                        'user-agent': 'spdy-bench'})
+    syns = []
+    for _ in range(streams):
+        client.put_frame(SynStream(client.next_stream_id, headers,
+                                   version=version))
+        syns.append(bytes(client.outgoing()))
+    return settings, syns
+
+def build(state, version=3, streams=4, data_size=4096, wire=None):
+    """ One server Context in `state` """
+    settings, syns = wire or _client_bytes(version, streams)
+    ctx = Context(SERVER, version)
+    ctx.auto_settings = True
+    ctx.auto_ping = True
+    if state == 'idle':
+        return ctx
+    if state == 'handshake':
+        ctx.incoming(settings)
+        ctx.incoming(syns[0][:len(syns[0]) // 2])
+        ctx.dispatch()
+        return ctx
+    ctx.incoming(settings + b''.join(syns))
+    reply = response_headers(version, 200, {'content-type': 'text/html'})
+    stream_ids = []
+    ctx.set_handlers(on_syn_stream=lambda frame:
+                     stream_ids.append(frame.stream_id))
+    ctx.dispatch()
+    for stream_id in stream_ids:
+        ctx.put_frame(SynReply(stream_id, reply, version=version))
+    # headers compressed and written out, the body still waiting
+    ctx.outgoing()
+    for stream_id in stream_ids:
+        ctx.put_frame(DataFrame(stream_id, bytearray(data_size), 0))
+    ctx.set_handlers(on_syn_stream=None)
+    return ctx
+
+def _measure(queue, state, count, version, streams, data_size, trace):
+    wire = _client_bytes(version, streams)
+    contexts = [None] * count
+    gc.collect()
+    if trace:
+        tracemalloc.start(32)
+    before = rss()
+    for i in range(count):
+        contexts[i] = build(state, version, streams, data_size, wire)
+    # c_zlib's ctypes casts leave reference cycles holding 64 KB output
+    # buffers, count what a connection keeps, not what's waiting for the gc
+    gc.collect()
+    result = {'rss': rss() - before}
+    if trace:
+        components = {}
+        for stat in tracemalloc.take_snapshot().statistics('traceback'):
+            # the innermost spdy module on the stack owns the allocation
+            component = 'other'
+            for frame in reversed(stat.traceback):
+                name = _COMPONENTS.get(os.path.abspath(frame.filename))
+                if name is not None:
+                    component = name
+                    break
+            components[component] = components.get(component, 0) + stat.size
+        tracemalloc.stop()
+        input_buffer = sum(sys.getsizeof(ctx.input_buffer) for ctx in contexts)
+        components['input_buffer'] = input_buffer
+        components['context'] = components.get('context', 0) - input_buffer
+        result['components'] = components
+    queue.put(result)
+
+def _in_child(*args):
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_measure, args=(queue,) + args)
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def measure(state, count=1000, version=3, streams=4, data_size=4096):
+    """ Bytes per Context in `state`, total and by component, averaged over
+        `count` Contexts """
+    total = _in_child(state, count, version, streams, data_size, False)['rss']
+    components = _in_child(state, count, version, streams, data_size,
+                           True)['components']
+    traced = sum(components.values())
+    components['zlib_native'] = max(0, total - traced)
+    per_conn = float(max(total, traced)) / count
+    return {
+        'bytes_per_conn': per_conn,
+        'conns_per_gb': 2 ** 30 / per_conn if per_conn else None,
+        'components': dict((name, size / float(count))
+                           for name, size in sorted(components.items())),
+    }
+
+def sweep(states=STATES, versions=(3,), count=1000, streams=4,
+          data_size=4096, match=None, progress=None):
+    """ {name: measure() result} for every state and version """
+    results = {}
+    for version in versions:
+        for state in states:
+            name = 'v{0}/{1}'.format(version, state)
+            if match and match not in name:
+                continue
+            results[name] = measure(state, count, version, streams, data_size)
+            if progress is not None:
+                progress(name, results[name])
+    return results
@@ -0,0 +1,43 @@
+# coding: utf-8
+""" Simulated network scenarios (see spdy.netsim): page loads and bulk
+    downloads over fixed link profiles, timed on the virtual clock. The
+    results are deterministic for a seed, so compare() flags any change in
+    load time, not noise; CPU time is reported alongside for reference. """
+import time
+
+from spdy import netsim
+
+# (name, scenario, keyword arguments)
+SCENARIOS = (
+    ('page_load/3g', netsim.page_load, {'profile': '3g'}),
+    ('page_load/3g/tls', netsim.page_load, {'profile': '3g', 'setup_rtts': 3}),
+    ('page_load/3g/no_priority', netsim.page_load,
+     {'profile': '3g', 'prioritize': False}),
+    ('page_load/lte', netsim.page_load, {'profile': 'lte'}),
+    ('page_load/lossy_wifi', netsim.page_load, {'profile': 'lossy_wifi'}),
+    ('bulk/transatlantic', netsim.bulk_download, {'profile': 'transatlantic'}),
+    ('bulk/transatlantic/window_4m', netsim.bulk_download,
+     {'profile': 'transatlantic', 'window': 4 * 1024 * 1024}),
+    ('bulk/satellite/window_4m', netsim.bulk_download,
+     {'profile': 'satellite', 'window': 4 * 1024 * 1024}),
+)
+
+def run(scenario, kwargs):
+    started = time.process_time()
+    result = scenario(**kwargs)
+    result['cpu_ms'] = (time.process_time() - started) * 1e3
+    return result
+
+def sweep(versions=(3,), seed=0, match=None, progress=None):
+    """ {name: scenario result} for every scenario and version """
+    results = {}
+    for version in versions:
+        for name, scenario, kwargs in SCENARIOS:
+            name = 'v{0}/{1}'.format(version, name)
+            if match and match not in name:
+                continue
+            kwargs = dict(kwargs, version=version, seed=seed)
+            results[name] = run(scenario, kwargs)
+            if progress is not None:
+                progress(name, results[name])
+    return results
@@ -167,6 +167,8 @@ Z_NULL = 0x00
 Z_OK = 0x00
 Z_STREAM_END = 0x01
 Z_NEED_DICT = 0x02
+Z_DATA_ERROR = -3
+Z_BUF_ERROR = -5
 
 Z_NO_FLUSH = 0x00
 Z_FINISH = 0x04
@@ -174,8 +176,25 @@ Z_SYNC_FLUSH = 2
 
 CHUNK = 1024 * 64
 
+class ZlibError(Exception):
+    """ A header block that doesn't inflate """
+
+class DictionaryMismatch(ZlibError):
+    """ The peer compresses against another dictionary than ours """
+
+
+def _out_pointer(outbuf):
+    # cast() from the address: casting the buffer itself makes it reference
+    # itself, a cycle only the gc frees, with CHUNK bytes attached
+    return C.cast(C.addressof(outbuf), C.POINTER(C.c_ubyte))
+
+
 class Deflater(object):
-    def __init__(self, version):
+    _initialized = False
+
+    def __init__(self, version, dictionary=None):
+        """ `dictionary` replaces the standard SPDY one, both ends have to
+            use the same """
         self._stream = _z_stream()
         self._stream.avail_in = Z_NULL
         self._stream.next_in = C.cast(Z_NULL, C.POINTER(C.c_ubyte))
@@ -183,7 +202,9 @@ class Deflater(object):
         self._stream.next_out = C.cast(Z_NULL, C.POINTER(C.c_ubyte))
         err = _zlib.deflateInit_(C.byref(self._stream), 6, ZLIB_VERSION, C.sizeof(self._stream))
         assert err == Z_OK, err
-        self.dictionary = ZLIB_DICT_V3 if 3 == version else ZLIB_DICT_V2
+        self._initialized = True
+        self.dictionary = dictionary or \
+                          (ZLIB_DICT_V3 if 3 == version else ZLIB_DICT_V2)
         err = _zlib.deflateSetDictionary(
             C.byref(self._stream), C.cast(C.c_char_p(self.dictionary), C.POINTER(C.c_ubyte)), len(self.dictionary))
         assert err == Z_OK, err
@@ -197,7 +218,7 @@ class Deflater(object):
         while True:
             self._stream.avail_out = CHUNK
             outbuf = C.create_string_buffer(CHUNK)
-            self._stream.next_out = C.cast(outbuf, C.POINTER(C.c_ubyte))
+            self._stream.next_out = _out_pointer(outbuf)
 
             status = _zlib.deflate(C.byref(self._stream), Z_SYNC_FLUSH)
             boundary = CHUNK - self._stream.avail_out
@@ -207,11 +228,22 @@ class Deflater(object):
                 break
             elif status != Z_OK:
                 raise AssertionError(status)
+        # don't keep the input alive between calls
+        self._stream.next_in = None
+        self._stream.next_out = None
         return bytes(buf)
 
+    def __del__(self):
+        # the deflate state is malloc()ed by libz, ~256 KB of it
+        if self._initialized:
+            self._initialized = False
+            _zlib.deflateEnd(C.byref(self._stream))
+
 
 class Inflater(object):
-    def __init__(self, version):
+    _initialized = False
+
+    def __init__(self, version, dictionary=None):
         self._stream = _z_stream()
         self._stream.avail_in = Z_NULL
         self._stream.next_in = C.cast(Z_NULL, C.POINTER(C.c_ubyte))
@@ -219,7 +251,9 @@ class Inflater(object):
         self._stream.next_out = C.cast(Z_NULL, C.POINTER(C.c_ubyte))
         err = _zlib.inflateInit2_(C.byref(self._stream), 15, ZLIB_VERSION, C.sizeof(self._stream))
         assert err == Z_OK, err
-        self.dictionary = ZLIB_DICT_V3 if 3 == version else ZLIB_DICT_V2
+        self._initialized = True
+        self.dictionary = dictionary or \
+                          (ZLIB_DICT_V3 if 3 == version else ZLIB_DICT_V2)
 
     def decompress(self, input):
         self._stream.next_in = C.cast(C.c_char_p(input), C.POINTER(C.c_ubyte))
@@ -230,26 +264,46 @@ class Inflater(object):
         while True:
             self._stream.avail_out = CHUNK
             outbuf = C.create_string_buffer(CHUNK)
-            self._stream.next_out = C.cast(outbuf, C.POINTER(C.c_ubyte))
+            self._stream.next_out = _out_pointer(outbuf)
 
             status = _zlib.inflate(C.byref(self._stream), Z_SYNC_FLUSH)
             if status == Z_NEED_DICT:
                 err = _zlib.inflateSetDictionary(
                     C.byref(self._stream), C.cast(C.c_char_p(self.dictionary), C.POINTER(C.c_ubyte)),
                     len(self.dictionary))
-                assert err == Z_OK
+                if err != Z_OK:
+                    # Z_DATA_ERROR: the adler32 the peer asks for isn't ours
+                    self._fail(DictionaryMismatch(
+                        'header compression dictionary mismatch: the peer '
+                        'uses another dictionary (zlib error {0})'.format(err)))
                 continue
 
             boundary = CHUNK - self._stream.avail_out
             buf += outbuf[:boundary]
 
-            if status == Z_STREAM_END or self._stream.avail_in == 0:
+            # checked even when the input is used up: a corrupt last frame
+            # consumes it all and still fails. Z_BUF_ERROR only means there
+            # was nothing left to do
+            if status not in (Z_OK, Z_STREAM_END, Z_BUF_ERROR):
+                self._fail(ZlibError('corrupt header block (zlib error '
+                                     '{0})'.format(status)))
+            if status != Z_OK or self._stream.avail_in == 0:
                 break
-            else:
-                assert status == Z_OK, 'failed to decompress! status is ' + str(status)
 
+        self._stream.next_in = None
+        self._stream.next_out = None
         return bytes(buf)
 
+    def _fail(self, exc):
+        self._stream.next_in = None
+        self._stream.next_out = None
+        raise exc
+
+    def __del__(self):
+        if self._initialized:
+            self._initialized = False
+            _zlib.inflateEnd(C.byref(self._stream))
+
     
 def _test():
     print(Inflater().decompress(Deflater().compress('abcd')))
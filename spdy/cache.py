@@ -0,0 +1,220 @@
+# coding: utf-8
+""" In-memory response cache for spdy.server.Server
+
+        Server(handler, cache=ResponseCache(max_bytes=64 * 1024 * 1024))
+
+    Complete GET responses (Request.respond()) are stored, keyed by host, path,
+    method and the request headers named by the response's Vary, and served to
+    later GET/HEAD requests without calling the handler; requests sending
+    Cache-Control: no-cache or max-age=0 go to the handler and refresh the
+    entry. Entries keep their n/v block serialized per SPDY version and the
+    body as one immutable buffer, so a hit costs a header compression on the
+    connection and nothing else.
+
+    Freshness comes from Cache-Control (s-maxage, max-age) or Expires,
+    `default_ttl` otherwise; no-store, no-cache, private, Set-Cookie and
+    Vary: * responses are not stored. The least recently used entries go
+    first once `max_bytes` or `max_entries` is reached.
+"""
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+import time
+
+from spdy.context import SerializedHeaders, _clock
+from spdy.http import response_headers
+
+CACHEABLE_STATUS = frozenset([200, 203, 204, 300, 301, 404, 410])
+# Bookkeeping per entry, on top of the body and header blocks
+ENTRY_OVERHEAD = 256
+
+def _directives(value):
+    directives = {}
+    for part in value.split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"')
+    return directives
+
+def _http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def freshness(headers, default_ttl=0):
+    """ Seconds a response with these headers may be served from cache, None
+        if it must not be stored """
+    if 'set-cookie' in headers or headers.get('vary', '').strip() == '*':
+        return None
+    directives = _directives(headers.get('cache-control', ''))
+    if 'no-store' in directives or 'no-cache' in directives or \
+            'private' in directives:
+        return None
+    for name in ('s-maxage', 'max-age'):
+        if name in directives:
+            try:
+                return max(0, int(directives[name]))
+            except ValueError:
+                return None
+    if 'expires' in headers:
+        expires = _http_date(headers['expires'])
+        if expires is None:
+            return 0
+        date = _http_date(headers.get('date', '')) or time.time()
+        return max(0, expires - date)
+    return default_ttl
+
+def revalidate(headers):
+    """ True if a request asks not to be answered from cache (Cache-Control
+        no-cache or max-age=0, Pragma: no-cache) """
+    directives = _directives(headers.get('cache-control', ''))
+    return 'no-cache' in directives or directives.get('max-age') == '0' or \
+        'no-cache' in headers.get('pragma', '').lower()
+
+
+class CachedResponse(object):
+    __slots__ = ('key', 'status', 'headers', 'body', 'expires', 'size', 'hits',
+                 '_nv')
+
+    def __init__(self, key, status, headers, body, expires):
+        self.key = key
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.expires = expires
+        self.hits = 0
+        self._nv = {}
+        self.size = len(body) + ENTRY_OVERHEAD + \
+                    sum(len(n) + len(v) for n, v in headers.items())
+
+    def __repr__(self):
+        return '<CachedResponse {0} {1} bytes>'.format(self.status,
+                                                       len(self.body))
+
+    def nv(self, version):
+        """ SYN_REPLY headers for `version`, serialized once """
+        nv = self._nv.get(version)
+        if nv is None:
+            nv = SerializedHeaders(response_headers(version, self.status,
+                                                    self.headers), version)
+            self._nv[version] = nv
+        return nv
+
+
+class ResponseCache(object):
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=None,
+                 default_ttl=0):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        # (host, path) -> request header names the response varies on, for
+        # the resources that have a Vary
+        self._vary = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _key(self, method, host, path, headers, vary):
+        # HEAD is answered from the GET entry, without the body
+        if method == 'HEAD':
+            method = 'GET'
+        return (host, path, method) + \
+            tuple(headers.get(name, '') for name in vary)
+
+    def get(self, method, host, path, headers):
+        """ Fresh CachedResponse for a request, or None """
+        if method not in ('GET', 'HEAD'):
+            return None
+        vary = self._vary.get((host, path), ())
+        entry = self._entries.get(self._key(method, host, path, headers,
+                                                vary))
+        if entry is not None and entry.expires <= _clock():
+            self._remove(entry)
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(entry.key)
+        entry.hits += 1
+        self.hits += 1
+        return entry
+
+    def put(self, method, host, path, request_headers, status, headers,
+            body=b''):
+        """ Stores a complete response if it is cacheable, returns the
+            CachedResponse or None """
+        if method != 'GET' or status not in CACHEABLE_STATUS or \
+                'authorization' in request_headers:
+            return None
+        headers = dict((name.lower(), value)
+                       for name, value in (headers or {}).items())
+        ttl = freshness(headers, self.default_ttl)
+        if not ttl:
+            return None
+        body = bytes(body)
+        vary = tuple(sorted(name.strip().lower() for name in
+                            headers.get('vary', '').split(',') if name.strip()))
+        if self._vary.get((host, path), ()) != vary:
+            # the variant set changed, the old entries can't be found anymore
+            self.invalidate(host, path)
+            if vary:
+                self._vary[(host, path)] = vary
+        key = self._key(method, host, path, request_headers, vary)
+        entry = CachedResponse(key, status, headers, body, _clock() + ttl)
+        if entry.size > self.max_bytes:
+            return None
+        old = self._entries.get(key)
+        if old is not None:
+            self._remove(old)
+        self._entries[key] = entry
+        self.size += entry.size
+        self.stores += 1
+        self._evict()
+        return entry
+
+    def _remove(self, entry):
+        del self._entries[entry.key]
+        self.size -= entry.size
+
+    def _evict(self):
+        entries = self._entries
+        while entries and (self.size > self.max_bytes or
+                           (self.max_entries and len(entries) > self.max_entries)):
+            _, entry = entries.popitem(last=False)
+            self.size -= entry.size
+            self.evictions += 1
+
+    def invalidate(self, host, path):
+        """ Drops every variant of a resource """
+        for entry in [e for k, e in self._entries.items()
+                      if k[:2] == (host, path)]:
+            self._remove(entry)
+        self._vary.pop((host, path), None)
+
+    def clear(self):
+        self._entries.clear()
+        self._vary.clear()
+        self.size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
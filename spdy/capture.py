@@ -0,0 +1,406 @@
+# coding: utf-8
+""" Session capture and replay
+
+        recorder = Recorder(open('session.spdycap', 'ab'))
+        ctx.capture = recorder          # or Server(..., capture=recorder)
+        ...
+        replay_parse('session.spdycap')             # parser benchmark
+        replay_socket('session.spdycap', ('127.0.0.1', 9599), speed=10)
+
+    With `ctx.capture` set, every chunk given to Context.incoming() and every
+    batch out of outgoing_chunks() is appended to the capture file, tagged
+    with a connection id and the time since the recorder started.
+
+    File format: an 8 byte magic and the start time (little endian double,
+    Unix time), then records of
+
+        kind (1 byte) | connection id (4) | time (double, seconds) |
+        length (4) | payload
+
+    OPEN records carry the side (0 client, 1 server) and SPDY version of the
+    connection, IN and OUT the raw bytes, CLOSE nothing. Records of all
+    connections are interleaved in time order. A new Recorder on the same
+    file appends a header of its own, see read_capture().
+
+        python -m spdy.capture info session.spdycap
+        python -m spdy.capture parse session.spdycap
+        python -m spdy.capture replay session.spdycap 127.0.0.1:9599 --speed 0
+"""
+import argparse
+import errno
+import itertools
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+import weakref
+from collections import namedtuple
+
+from spdy.context import Context, CLIENT, SERVER
+from spdy.stats import timer
+
+MAGIC = b'SPDYCAP1'
+_FILE_HEADER = struct.Struct('<8sd')
+_RECORD = struct.Struct('<BIdI')
+_OPEN = struct.Struct('<BB')
+
+OPEN = 0
+IN = 1
+OUT = 2
+CLOSE = 3
+KINDS = {OPEN: 'open', IN: 'in', OUT: 'out', CLOSE: 'close'}
+
+_SIDES = {CLIENT: 0, SERVER: 1}
+_SIDE_NAMES = {0: CLIENT, 1: SERVER}
+
+Record = namedtuple('Record', 'kind conn_id time data')
+
+
+class CaptureError(Exception):
+    pass
+
+
+class Recorder(object):
+    """ Appends the traffic of the Contexts it's set on (ctx.capture) to
+        `f`, a binary file opened for appending. Thread safe. """
+
+    def __init__(self, f):
+        self.f = f
+        self.started = timer()
+        self._lock = threading.Lock()
+        self._ids = weakref.WeakKeyDictionary()
+        self._next_id = itertools.count(1)
+        self.f.write(_FILE_HEADER.pack(MAGIC, time.time()))
+
+    def _write(self, kind, conn_id, data):
+        header = _RECORD.pack(kind, conn_id, timer() - self.started, len(data))
+        self.f.write(header)
+        if data:
+            self.f.write(data)
+
+    def _conn_id(self, ctx):
+        conn_id = self._ids.get(ctx)
+        if conn_id is None:
+            conn_id = self._ids[ctx] = next(self._next_id)
+            self._write(OPEN, conn_id, _OPEN.pack(_SIDES[ctx.side],
+                                                  ctx.version))
+        return conn_id
+
+    def incoming(self, ctx, chunk):
+        with self._lock:
+            self._write(IN, self._conn_id(ctx), chunk)
+
+    def outgoing(self, ctx, chunks):
+        with self._lock:
+            conn_id = self._conn_id(ctx)
+            self._write(OUT, conn_id, b''.join(chunks))
+
+    def closed(self, ctx):
+        """ Marks the end of `ctx`'s connection """
+        with self._lock:
+            conn_id = self._ids.pop(ctx, None)
+            if conn_id is not None:
+                self._write(CLOSE, conn_id, b'')
+
+    def flush(self):
+        with self._lock:
+            self.f.flush()
+
+    def close(self):
+        with self._lock:
+            self.f.close()
+
+
+def read_capture(f):
+    """ Yields the Records of a capture file. Captures appended to it are
+        read as one: their times go on from the first header and their
+        connection ids are renumbered after the ones before. """
+    head = f.read(_FILE_HEADER.size)
+    if len(head) < _FILE_HEADER.size or head[:len(MAGIC)] != MAGIC:
+        raise CaptureError('not a capture file')
+    first = _FILE_HEADER.unpack(head)[1]
+    offset = 0.0
+    base = last_id = 0
+    while True:
+        head = f.read(1)
+        if not head:
+            return
+        if head == MAGIC[:1]:
+            head += f.read(_FILE_HEADER.size - 1)
+            if len(head) < _FILE_HEADER.size or head[:len(MAGIC)] != MAGIC:
+                raise CaptureError('bad header')
+            offset = _FILE_HEADER.unpack(head)[1] - first
+            base = last_id
+            continue
+        head += f.read(_RECORD.size - 1)
+        if len(head) < _RECORD.size:
+            raise CaptureError('truncated record')
+        kind, conn_id, when, length = _RECORD.unpack(head)
+        data = f.read(length)
+        if len(data) < length:
+            raise CaptureError('truncated record')
+        conn_id += base
+        last_id = max(last_id, conn_id)
+        yield Record(kind, conn_id, when + offset, data)
+
+
+def scan(buf):
+    """ read_capture() over a buffer (bytes, mmap) without copying payloads:
+        yields (kind, conn_id, time, payload offset, payload length) """
+    if len(buf) < _FILE_HEADER.size or buf[:len(MAGIC)] != MAGIC:
+        raise CaptureError('not a capture file')
+    first = _FILE_HEADER.unpack_from(buf, 0)[1]
+    offset = 0.0
+    base = last_id = 0
+    pos = _FILE_HEADER.size
+    size = len(buf)
+    magic = MAGIC[0]
+    while pos < size:
+        if buf[pos] == magic:
+            if size - pos < _FILE_HEADER.size or \
+                    buf[pos:pos + len(MAGIC)] != MAGIC:
+                raise CaptureError('bad header')
+            offset = _FILE_HEADER.unpack_from(buf, pos)[1] - first
+            base = last_id
+            pos += _FILE_HEADER.size
+            continue
+        if size - pos < _RECORD.size:
+            raise CaptureError('truncated record')
+        kind, conn_id, when, length = _RECORD.unpack_from(buf, pos)
+        pos += _RECORD.size
+        if size - pos < length:
+            raise CaptureError('truncated record')
+        conn_id += base
+        last_id = max(last_id, conn_id)
+        yield kind, conn_id, when + offset, pos, length
+        pos += length
+
+
+def _records(path_or_file):
+    if hasattr(path_or_file, 'read'):
+        return read_capture(path_or_file)
+    def records():
+        with open(path_or_file, 'rb') as f:
+            for record in read_capture(f):
+                yield record
+    return records()
+
+
+def info(path_or_file):
+    """ Connections, bytes per direction and duration of a capture """
+    connections = set()
+    bytes_in = bytes_out = 0
+    last = 0.0
+    for record in _records(path_or_file):
+        connections.add(record.conn_id)
+        if record.kind == IN:
+            bytes_in += len(record.data)
+        elif record.kind == OUT:
+            bytes_out += len(record.data)
+        last = record.time
+    return {'connections': len(connections), 'bytes_in': bytes_in,
+            'bytes_out': bytes_out, 'duration': last}
+
+
+def replay_parse(path_or_file, decode=True):
+    """ Feeds every connection of a capture through fresh Contexts, one per
+        direction (IN to a Context of the recorded side, OUT to one of the
+        other side), and returns the frames parsed, bytes and CPU seconds.
+        With `decode` every frame is parsed, otherwise only what dispatch()
+        needs without handlers. The capture is read before timing starts. """
+    records = list(_records(path_or_file))
+    contexts = {}
+    frames = 0
+    nbytes = 0
+    started = time.process_time()
+    for record in records:
+        if record.kind == OPEN:
+            side, version = _OPEN.unpack(record.data)
+            side = _SIDE_NAMES[side]
+            peer = CLIENT if side == SERVER else SERVER
+            contexts[record.conn_id] = (Context(side, version),
+                                        Context(peer, version))
+            continue
+        pair = contexts.get(record.conn_id)
+        if pair is None:
+            continue
+        if record.kind == CLOSE:
+            del contexts[record.conn_id]
+            continue
+        ctx = pair[0] if record.kind == IN else pair[1]
+        ctx.incoming(record.data)
+        nbytes += len(record.data)
+        if decode:
+            while ctx.get_frame() is not None:
+                frames += 1
+        else:
+            frames += ctx.dispatch()
+    elapsed = time.process_time() - started
+    return {'frames': frames, 'bytes': nbytes, 'cpu_sec': elapsed,
+            'mb_per_sec': nbytes / elapsed / 1e6 if elapsed else None,
+            'ns_per_frame': elapsed / frames * 1e9 if frames else None}
+
+
+def _connect(address):
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.connect(address)
+    sock.setblocking(False)
+    return sock
+
+
+def replay_socket(path_or_file, address, speed=1.0, linger=1.0):
+    """ Sends the client to server bytes of every captured connection to
+        `address` over fresh plain TCP (or Unix socket) connections,
+        `speed` times as fast as recorded (0 for as fast as possible), and
+        reads whatever comes back. Connections open and close as in the
+        capture (at max speed they are all closed at the end, once nothing
+        came back for `linger` seconds); the server side of a capture is
+        what its clients sent. Returns the connections, bytes sent and
+        received, and elapsed time.
+        Captured streams are replayed as they are: the server has to take
+        the same stream ids and header compression state, which a fresh
+        connection does. """
+    records = list(_records(path_or_file))
+    # conn_id -> which kind of record holds the client's bytes
+    client_kind = {}
+    selector = selectors.DefaultSelector()
+    socks = {}
+    pending = {}
+    sent = received = 0
+    connections = 0
+    buf = bytearray(256 * 1024)
+
+    def pump(timeout):
+        nonlocal received
+        for key, events in selector.select(timeout):
+            sock, conn_id = key.fileobj, key.data
+            if events & selectors.EVENT_READ:
+                try:
+                    count = sock.recv_into(buf)
+                except (BlockingIOError, InterruptedError):
+                    count = None
+                except OSError:
+                    count = 0
+                if count == 0:
+                    _drop(conn_id)
+                    continue
+                received += count or 0
+            if events & selectors.EVENT_WRITE:
+                _send(conn_id)
+
+    def _send(conn_id):
+        nonlocal sent
+        sock, out = socks[conn_id], pending[conn_id]
+        while out:
+            try:
+                count = sock.send(out)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                _drop(conn_id)
+                return
+            sent += count
+            del out[:count]
+        selector.modify(sock, selectors.EVENT_READ |
+                        (selectors.EVENT_WRITE if out else 0), conn_id)
+
+    def _drop(conn_id):
+        sock = socks.pop(conn_id, None)
+        pending.pop(conn_id, None)
+        if sock is not None:
+            selector.unregister(sock)
+            sock.close()
+
+    started = timer()
+    try:
+        for record in records:
+            if speed:
+                due = started + record.time / speed
+                while True:
+                    wait = due - timer()
+                    if wait <= 0:
+                        break
+                    pump(wait)
+            pump(0)
+            if record.kind == OPEN:
+                side, _ = _OPEN.unpack(record.data)
+                client_kind[record.conn_id] = OUT if _SIDE_NAMES[side] == \
+                                                     CLIENT else IN
+                try:
+                    sock = _connect(address)
+                except OSError as exc:
+                    if exc.errno not in (errno.ECONNREFUSED, errno.ECONNRESET):
+                        raise
+                    continue
+                socks[record.conn_id] = sock
+                pending[record.conn_id] = bytearray()
+                selector.register(sock, selectors.EVENT_READ, record.conn_id)
+                connections += 1
+            elif record.kind == CLOSE:
+                # unsent bytes or no timing to go by: wait for the answers
+                if speed and not pending.get(record.conn_id):
+                    _drop(record.conn_id)
+            elif record.conn_id in socks and \
+                    record.kind == client_kind[record.conn_id]:
+                pending[record.conn_id].extend(record.data)
+                _send(record.conn_id)
+        # let the server answer what was sent last
+        while socks:
+            before = received
+            pump(linger)
+            if received == before and not any(pending.values()):
+                break
+    finally:
+        for conn_id in list(socks):
+            _drop(conn_id)
+        selector.close()
+    return {'connections': connections, 'bytes_sent': sent,
+            'bytes_received': received, 'elapsed': timer() - started}
+
+
+def _address(value):
+    if ':' not in value:
+        return value
+    host, port = value.rsplit(':', 1)
+    return host, int(port)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m spdy.capture',
+                                     description='SPDY session captures')
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser('info', help='what a capture holds')
+    command.add_argument('capture')
+    command = commands.add_parser('parse',
+                                  help='parse a capture with fresh Contexts')
+    command.add_argument('capture')
+    command.add_argument('--dispatch', action='store_true',
+                         help="only decode what dispatch() has to")
+    command = commands.add_parser('replay', help='replay a capture to a server')
+    command.add_argument('capture')
+    command.add_argument('address', help='host:port, or a Unix socket path')
+    command.add_argument('--speed', type=float, default=1.0,
+                         help='replay speed, 0 for as fast as possible')
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        result = info(args.capture)
+    elif args.command == 'parse':
+        result = replay_parse(args.capture, decode=not args.dispatch)
+    elif args.command == 'replay':
+        result = replay_socket(args.capture, _address(args.address),
+                               args.speed)
+    else:
+        parser.print_help()
+        return 2
+    for name, value in sorted(result.items()):
+        print('{0:<16} {1}'.format(name, value))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
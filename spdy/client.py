@@ -0,0 +1,162 @@
+# coding: utf-8
+""" Multiplexed asyncio HTTP client over a single SPDY session (Python 3.7+)
+
+        async with SpdyClient('localhost', 9599) as client:
+            responses = await asyncio.gather(*[client.request('GET', path)
+                                               for path in paths])
+            for response in responses:
+                body = await response.read()
+
+    Every request is a stream on the same connection, so fetching many
+    resources costs round trips for the slowest one, not one per resource.
+"""
+import asyncio
+
+from spdy.aio import SpdyClientProtocol
+from spdy.http import request_headers, parse_response
+from spdy.frames import DEFAULT_VERSION, MAX_CONCURRENT_STREAMS
+
+# Lowest priority value of each version (0 is the highest priority)
+LOWEST_PRIORITY = {2: 3, 3: 7}
+
+class Response(object):
+    """ Response headers are available once request() returns; the body is
+        streamed from the underlying SpdyStream. """
+
+    def __init__(self, stream, version):
+        self.stream = stream
+        self.stream_id = stream.stream_id
+        self.status, self.reason, self.headers = \
+            parse_response(version, stream.reply_headers)
+
+    def __repr__(self):
+        return '<Response id={0} {1} {2}>'.format(self.stream_id, self.status,
+                                                  self.reason)
+
+    async def read(self):
+        return await self.stream.readall()
+
+    async def text(self, encoding='utf-8'):
+        return (await self.read()).decode(encoding)
+
+    def __aiter__(self):
+        return self.stream.__aiter__()
+
+    def close(self):
+        """ Cancels the rest of the body """
+        if not self.stream.at_eof:
+            self.stream.reset()
+
+class SpdyClient(object):
+    """ Issues concurrent requests on one SPDY connection. Requests beyond the
+        server's MAX_CONCURRENT_STREAMS wait for a free stream. """
+
+    def __init__(self, host, port, version=DEFAULT_VERSION, ssl=None,
+                 scheme=None, default_priority=None, **protocol_kwargs):
+        self.host = host
+        self.port = port
+        self.version = version
+        self.ssl = ssl
+        self.scheme = scheme or ('https' if ssl else 'http')
+        if default_priority is None:
+            default_priority = LOWEST_PRIORITY[version] // 2
+        self.default_priority = default_priority
+        self.protocol_kwargs = protocol_kwargs
+        self.protocol = None
+        self.requests = 0
+        self._slot_waiters = []
+
+    async def connect(self):
+        loop = asyncio.get_event_loop()
+        _, self.protocol = await loop.create_connection(
+            lambda: SpdyClientProtocol(self.version, **self.protocol_kwargs),
+            self.host, self.port, ssl=self.ssl)
+        self.protocol.on_stream_closed = self._stream_closed
+        self.protocol.on_connection_lost = self._connection_lost
+        return self
+
+    async def __aenter__(self):
+        if self.protocol is None:
+            await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def open_streams(self):
+        return len(self.protocol.streams) if self.protocol else 0
+
+    @property
+    def max_streams(self):
+        if self.protocol is None:
+            return None
+        return self.protocol.ctx.peer_settings.get(MAX_CONCURRENT_STREAMS)
+
+    @property
+    def closed(self):
+        return self.protocol is None or self.protocol.transport.is_closing()
+
+    def _stream_closed(self, stream):
+        while self._slot_waiters:
+            waiter = self._slot_waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def _connection_lost(self, exc):
+        waiters, self._slot_waiters = self._slot_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_exception(exc or
+                                     ConnectionResetError('connection closed'))
+
+    async def _wait_slot(self):
+        while True:
+            limit = self.max_streams
+            if limit is None or self.open_streams < limit:
+                return
+            waiter = self.protocol._loop.create_future()
+            self._slot_waiters.append(waiter)
+            await waiter
+
+    async def request(self, method, path, headers=None, body=None,
+                      priority=None, host=None):
+        """ Sends a request and returns its Response as soon as the reply
+            headers arrive. `body` may be bytes or an async iterable; `host`
+            overrides the host sent in the n/v block. Raises
+            ConnectionResetError if the connection is or gets lost. """
+        if self.protocol is None:
+            await self.connect()
+        if self.closed:
+            raise ConnectionResetError('connection closed')
+        await self._wait_slot()
+        if priority is None:
+            priority = self.default_priority
+        nv = request_headers(self.version, method, path, host or self.host,
+                             self.scheme, headers)
+        stream = self.protocol.open_stream(nv, priority=priority,
+                                           fin=body is None)
+        self.requests += 1
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            stream.write(body, fin=True)
+        elif body is not None:
+            try:
+                async for chunk in body:
+                    stream.write(chunk)
+                    await stream.drain()
+            except BaseException:
+                stream.reset()
+                raise
+            stream.close()
+        await stream.response()
+        return Response(stream, self.version)
+
+    async def get(self, path, headers=None, priority=None):
+        return await self.request('GET', path, headers, priority=priority)
+
+    async def close(self):
+        if self.protocol is not None:
+            self.protocol.shutdown()
+            self.protocol.close()
+            await self.protocol.wait_closed()
@@ -1,8 +1,22 @@
 # coding: utf-8
+import threading
+from collections import deque, namedtuple
 from sys import version_info
 from bitarray import bitarray
-from spdy.c_zlib import Inflater, Deflater, ZLIB_DICT_V2, ZLIB_DICT_V3
-from spdy.frames import Frame, DataFrame, DEFAULT_VERSION, VERSIONS, FRAME_TYPES
+from spdy.c_zlib import Inflater, Deflater, ZlibError, ZLIB_DICT_V2, \
+                         ZLIB_DICT_V3
+from spdy.frames import Frame, DataFrame, SynStream, SynReply, RstStream, \
+                        Settings, Ping, Goaway, WindowUpdate, DEFAULT_VERSION, \
+                        VERSIONS, FRAME_TYPES, FLAG_FIN, FLAG_UNID, \
+                        REFUSED_STREAM, INITIAL_WINDOW_SIZE, \
+                        GOAWAY_OK, DATA, SYN_STREAM, SYN_REPLY, RST_STREAM, \
+                        SETTINGS, PING, GOAWAY, HEADERS, WINDOW_UPDATE
+from spdy.stats import ContextStats, timer
+
+try:
+    from time import monotonic as _clock
+except ImportError: # Python < 3.3
+    from time import time as _clock
 
 SERVER = 'SERVER'
 CLIENT = 'CLIENT'
@@ -15,6 +29,9 @@ def _bitmask(length, split, mask=0):
     b = str(mask)*split + str(invert)*(length-split)
     return int(b, 2)
 
+# Rough encoded size of a queued control frame, for queued_bytes
+_CONTROL_FRAME_ESTIMATE = 64
+
 _first_bit = _bitmask(8, 1, 1)
 _last_15_bits = _bitmask(16, 1, 0)
 _last_31_bits = _bitmask(32, 1, 0)
@@ -62,69 +79,818 @@ else:
         return int_value.to_bytes(length, byte_order)
 
 
+def serialize_headers(headers, version):
+    """ Uncompressed n/v block of a header dict """
+    chunk = bytearray()
+    length_size = 2 if version == 2 else 4
+
+    #first two bytes: number of pairs
+    chunk.extend(get_stream_from_int(len(headers), length_size, 'big'))
+
+    #after that...
+    for name, value in headers.items():
+        name = bytes(name.encode('utf-8'))
+        value = bytes(value.encode('utf-8'))
+
+        #two bytes: length of name
+        chunk.extend(get_stream_from_int(len(name), length_size, 'big'))
+
+        #next name_length bytes: name
+        chunk.extend(name)
+
+        #two bytes: length of value
+        chunk.extend(get_stream_from_int(len(value), length_size, 'big'))
+
+        #next value_length bytes: value
+        chunk.extend(value)
+
+    return bytes(chunk)
+
+class SerializedHeaders(dict):
+    """ A header dict carrying its n/v block, serialized once: frames built
+        with it only go through compression when encoded. Don't modify it
+        after creation. """
+
+    def __init__(self, headers, version):
+        super(SerializedHeaders, self).__init__(headers)
+        self.version = version
+        self.block = serialize_headers(self, version)
+
+# DATA frames at least this big are handed out by outgoing_chunks() as their
+# own buffer instead of being copied after the frame header
+_ZERO_COPY_DATA_SIZE = 2048
+# Pushed bodies are sent in DATA frames of at most this size
+MAX_DATA_FRAME_SIZE = 16 * 1024
+# SPDY/3 flow control window of every stream until SETTINGS says otherwise
+DEFAULT_WINDOW_SIZE = 64 * 1024
+
+# Handler names accepted by Context.set_handlers()
+HANDLER_NAMES = {
+    'on_data': DATA,
+    'on_syn_stream': SYN_STREAM,
+    'on_syn_reply': SYN_REPLY,
+    'on_rst_stream': RST_STREAM,
+    'on_settings': SETTINGS,
+    'on_ping': PING,
+    'on_goaway': GOAWAY,
+    'on_headers': HEADERS,
+    'on_window_update': WINDOW_UPDATE,
+}
+
+# What peek_frame() reads off the 8 byte frame header. frame_type is DATA
+# for data frames; stream_id is 0 for control frames not about a stream
+FrameHeader = namedtuple('FrameHeader',
+                         'control frame_type stream_id flags length')
+
+# Control frames starting with a stream id
+_STREAM_CONTROL_FRAMES = frozenset([SYN_STREAM, SYN_REPLY, RST_STREAM, HEADERS,
+                                    WINDOW_UPDATE])
+
+# Frames that have to be decoded even without a handler: header blocks must
+# go through the inflater to keep it in sync, the rest update stream state
+_ALWAYS_DECODED = frozenset([SYN_STREAM, SYN_REPLY, HEADERS, RST_STREAM, GOAWAY])
+
+class Stream(object):
+    """ Bookkeeping of an open stream, as seen from one side """
+    __slots__ = ('stream_id', 'priority', 'assoc_stream_id', 'local_closed',
+                 'remote_closed')
+
+    def __init__(self, stream_id, priority=0, assoc_stream_id=0):
+        self.stream_id = stream_id
+        self.priority = priority
+        self.assoc_stream_id = assoc_stream_id
+        self.local_closed = False
+        self.remote_closed = False
+
+    def __repr__(self):
+        return 'Stream id={0} local_closed={1} remote_closed={2}'.format(
+                    self.stream_id, self.local_closed, self.remote_closed)
+
+
 class Context(object):
-    def __init__(self, side, version=DEFAULT_VERSION):
+    def __init__(self, side, version=DEFAULT_VERSION, dictionary=None):
         if side not in (SERVER, CLIENT):
             raise TypeError("side must be SERVER or CLIENT")
 
         if not version in VERSIONS:
             raise NotImplementedError()
+        self.side = side
         self.version = version
         self.frame_queue = []
         self.input_buffer = bytearray()
-        self.inflater = Inflater(version)
-        self.deflater = Deflater(version)
+        # A header compression dictionary other than the standard one (see
+        # spdy.dictionary) only works when the peer was given the same
+        self.dictionary = dictionary
+        self.inflater = Inflater(version, dictionary)
+        self.deflater = Deflater(version, dictionary)
 
         if side == SERVER:
             self._stream_id = 2
-            # TODO: Add stream_id_peer auto-updating in the _parse_frame() method
-            self._stream_id_peer = 1
             self._ping_id = 2
         else:
             self._stream_id = 1
-            # TODO: Add stream_id_peer auto-updating in the _parse_frame() method
-            self._stream_id_peer = 0
             self._ping_id = 1
-        
+        # Last stream id received from the peer (updated by get_frame())
+        self._stream_id_peer = 0
+
         self._last_stream_id = self._stream_id
-        
-        
+
+        # Open streams: stream_id -> Stream
+        self.streams = {}
+        # GOAWAY state: the last good stream id we announced / we were told
+        self.shutting_down = False
+        self._goaway_stream_id = None
+        self.goaway_received = None
+        # Called once when a shutdown has no streams left, see begin_shutdown()
+        self.on_drained = None
+        # Bodies of pushed streams waiting for the peer's SPDY/3 flow control
+        # window: stream_id -> [deque of memoryviews, window], see push()
+        self._push_bodies = {}
+        self._initial_window = DEFAULT_WINDOW_SIZE if version >= 3 else None
+
+        # Guards frame_queue and queued_bytes for put_frame_threadsafe().
+        # Everything else (stream state, callbacks, tracer, encoding) stays
+        # on the I/O thread: frames from other threads are accounted for
+        # when outgoing_chunks() takes them
+        self.lock = threading.RLock()
+        self._threadsafe_frames = []
+        # Called from the producer thread after put_frame_threadsafe(), to
+        # wake the I/O thread up
+        self.on_frames_queued = None
+
+        # Frame handlers used by dispatch(), indexed by frame type (DATA = 0)
+        self._handlers = [None] * (max(FRAME_TYPES) + 1)
+        # Built-in handling: echo peer PINGs, record peer SETTINGS
+        self.auto_ping = False
+        self.auto_settings = False
+        self.peer_settings = {}
+
+        # Backpressure, see set_watermarks(). queued_bytes estimates what
+        # frame_queue will encode to; unsent_bytes is reported by the I/O layer
+        self.queued_bytes = 0
+        self.unsent_bytes = 0
+        self.input_high_water = None
+        self.input_low_water = None
+        self.output_high_water = None
+        self.output_low_water = None
+        self.budget = None
+        self._watermarks = False
+        self.reading_paused = False
+        self.on_pause_reading = None
+        self.on_resume_reading = None
+
+        # Outstanding pings sent by us: ping_id -> send time
+        self._pings = {}
+        # Smoothed RTT and RTT variance (seconds), as in RFC 6298
+        self.srtt = None
+        self.rttvar = None
+        self.last_rtt = None
+        # Keepalive policy, disabled by default (see set_keepalive())
+        self.keepalive_interval = None
+        self.keepalive_timeout = None
+        self._last_received = _clock()
+
+        # Always-on performance counters, see spdy.stats and stats()
+        self.counters = ContextStats()
+        # Per-stream timelines, off unless set to a spdy.trace.Tracer
+        self.tracer = None
+        # Raw traffic recording, off unless set to a spdy.capture.Recorder
+        self.capture = None
+
     @property
     def next_stream_id(self):
+        if self._stream_id > _last_31_bits:
+            raise SpdyProtocolError("stream ids exhausted")
         self._last_stream_id = self._stream_id
         self._stream_id += 2
         return self._last_stream_id
 
+    @property
+    def stream_ids_left(self):
+        """ How many more streams we can open on this connection """
+        return max(0, (_last_31_bits - self._stream_id) // 2 + 1)
+
     @property
     def next_ping_id(self):
         pid = self._ping_id
         self._ping_id += 2
         return pid
 
+    def send_ping(self):
+        """ Queues a PING frame and starts timing it, returns the ping id.
+            The RTT sample is taken when get_frame() parses the echo. """
+        pid = self.next_ping_id
+        self.put_frame(Ping(pid, version=self.version))
+        self._pings[pid] = _clock()
+        return pid
+
+    @property
+    def outstanding_pings(self):
+        return len(self._pings)
+
+    def _ping_received(self, ping_id):
+        sent = self._pings.pop(ping_id, None)
+        if sent is None:
+            return
+        rtt = _clock() - sent
+        self.last_rtt = rtt
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    def set_keepalive(self, interval, timeout):
+        """ Enables the idle-keepalive policy: after `interval` seconds without
+            receiving anything a PING is sent, and the peer is declared dead if
+            a PING stays unanswered for `timeout` seconds. """
+        self.keepalive_interval = interval
+        self.keepalive_timeout = timeout
+
+    def keepalive(self, now=None):
+        """ Drives the keepalive policy from the host event loop. Sends a PING
+            when the connection is idle and returns False once the peer is
+            considered dead, True otherwise. """
+        if self.keepalive_interval is None:
+            return True
+        if now is None:
+            now = _clock()
+        if self._pings:
+            oldest = min(self._pings.values())
+            return now - oldest < self.keepalive_timeout
+        if now - self._last_received >= self.keepalive_interval:
+            self.send_ping()
+        return True
+
+    def next_keepalive_timeout(self, now=None):
+        """ Seconds until keepalive() has something to do, None if disabled.
+            Meant to be used as the host event loop timer. """
+        if self.keepalive_interval is None:
+            return None
+        if now is None:
+            now = _clock()
+        if self._pings:
+            deadline = min(self._pings.values()) + self.keepalive_timeout
+        else:
+            deadline = self._last_received + self.keepalive_interval
+        return max(0, deadline - now)
+
+    def push(self, parent_stream_id, headers, body=None, priority=None):
+        """ Server push: opens a unidirectional stream associated to
+            `parent_stream_id` and queues its SYN_STREAM ahead of the parent's
+            final frame, so the client learns about the resource before it
+            considers the parent complete. `headers` must carry the resource
+            URL (v2: absolute 'url'; v3: ':scheme', ':host', ':path').
+            Pushed streams default to one priority level below the parent.
+            `body` goes out in DATA frames of at most MAX_DATA_FRAME_SIZE
+            bytes; on SPDY/3 they are held back until the client's window
+            for the stream allows them (see on WINDOW_UPDATE frames).
+            Returns the new (even) stream id. """
+        if self.side != SERVER:
+            raise SpdyProtocolError("only servers can push streams")
+
+        # The queue is scanned and spliced, keep producer threads out
+        with self.lock:
+            # Is the parent's FIN still waiting in the queue?
+            fin_index = None
+            for i, frame in enumerate(self.frame_queue):
+                if isinstance(frame, (DataFrame, SynReply)) and \
+                        frame.stream_id == parent_stream_id and frame.flags & FLAG_FIN:
+                    fin_index = i
+                    break
+            parent = self.streams.get(parent_stream_id)
+            if fin_index is None and (parent is None or parent.local_closed):
+                raise SpdyProtocolError("can't push on closed stream {0}"
+                                        .format(parent_stream_id))
+
+            if priority is None:
+                lowest = 3 if self.version == 2 else 7
+                parent_priority = parent.priority if parent is not None else 0
+                priority = min(parent_priority + 1, lowest)
+
+            flags = FLAG_UNID if body else FLAG_UNID | FLAG_FIN
+            syn = SynStream(self.next_stream_id, headers, priority=priority,
+                            assoc_stream_id=parent_stream_id, flags=flags,
+                            version=self.version)
+            if fin_index is None:
+                self.put_frame(syn)
+            else:
+                self.frame_queue.insert(fin_index, syn)
+                self._queued(syn)
+                self._frame_sent(syn)
+            if body:
+                self._push_bodies[syn.stream_id] = [
+                    deque([memoryview(body)]), self._initial_window]
+                self._send_push_body(syn.stream_id)
+            return syn.stream_id
+
+    def _send_push_body(self, stream_id):
+        """ Queues as much of a pushed body as the stream's window allows """
+        pending, window = self._push_bodies[stream_id]
+        while pending:
+            if window is not None and window <= 0:
+                break
+            data = pending.popleft()
+            size = MAX_DATA_FRAME_SIZE if window is None else \
+                   min(MAX_DATA_FRAME_SIZE, window)
+            if len(data) > size:
+                pending.appendleft(data[size:])
+                data = data[:size]
+            if window is not None:
+                window -= len(data)
+            if not pending:
+                del self._push_bodies[stream_id]
+            self.put_frame(DataFrame(stream_id, data,
+                                     0 if pending else FLAG_FIN))
+        if pending:
+            self._push_bodies[stream_id][1] = window
+
+    def begin_shutdown(self, status_code=GOAWAY_OK):
+        """ Starts a graceful shutdown: queues a GOAWAY with the last stream id
+            received from the peer and refuses any later SYN_STREAM with
+            RST_STREAM(REFUSED_STREAM). Streams already open keep running;
+            once all of them are closed `drained` becomes True and the
+            on_drained callback (if any) is called. """
+        if self.shutting_down:
+            return
+        self.shutting_down = True
+        self._goaway_stream_id = self._stream_id_peer
+        self.put_frame(Goaway(self._goaway_stream_id, status_code=status_code,
+                              version=self.version))
+        self._check_drained()
+
+    @property
+    def drained(self):
+        return self.shutting_down and not self.streams
+
+    def _check_drained(self):
+        if self.drained and self.on_drained is not None:
+            on_drained, self.on_drained = self.on_drained, None
+            on_drained(self)
+
+    def _close_stream(self, stream_id):
+        self._push_bodies.pop(stream_id, None)
+        if self.streams.pop(stream_id, None) is None:
+            return
+        if self.tracer is not None:
+            self.tracer.closed(self, stream_id)
+        if self.shutting_down:
+            self._check_drained()
+
+    def _half_close(self, stream_id, local):
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            return
+        if local:
+            stream.local_closed = True
+        else:
+            stream.remote_closed = True
+        if stream.local_closed and stream.remote_closed:
+            self._close_stream(stream_id)
+
+    def stats(self):
+        """ Snapshot of the counters (see spdy.stats) plus the current
+            buffer and queue depths, as a dict for spdy.stats.aggregate() """
+        out = self.counters.snapshot()
+        out['frame_queue_peak'] = max(out['frame_queue_peak'],
+                                      len(self.frame_queue))
+        out['queued_bytes_peak'] = max(out['queued_bytes_peak'],
+                                       self.queued_bytes)
+        out['input_buffer'] = len(self.input_buffer)
+        out['frame_queue'] = len(self.frame_queue)
+        out['queued_bytes'] = self.queued_bytes
+        out['unsent_bytes'] = self.unsent_bytes
+        out['streams'] = len(self.streams)
+        return out
+
+    def _stream_opened(self, stream):
+        self.streams[stream.stream_id] = stream
+        if len(self.streams) > self.counters.streams_peak:
+            self.counters.streams_peak = len(self.streams)
+
+    def _frame_sent(self, frame):
+        if self.tracer is not None:
+            self.tracer.queued(self, frame)
+        if not frame.is_control:
+            if frame.flags & FLAG_FIN:
+                self._half_close(frame.stream_id, True)
+        elif isinstance(frame, SynStream):
+            stream = Stream(frame.stream_id, frame.priority,
+                            frame.assoc_stream_id)
+            # the peer can't talk on unidirectional streams
+            stream.remote_closed = frame.unidirectional
+            self._stream_opened(stream)
+            if frame.fin:
+                self._half_close(frame.stream_id, True)
+        elif isinstance(frame, SynReply):
+            if frame.fin:
+                self._half_close(frame.stream_id, True)
+        elif isinstance(frame, RstStream):
+            rst_out = self.counters.rst_out
+            rst_out[frame.error_code] = rst_out.get(frame.error_code, 0) + 1
+            self._close_stream(frame.stream_id)
+        elif isinstance(frame, Goaway):
+            status = frame.status_code or GOAWAY_OK
+            goaway_out = self.counters.goaway_out
+            goaway_out[status] = goaway_out.get(status, 0) + 1
+
+    def _data_received(self, stream_id, flags):
+        if stream_id not in self.streams and self.shutting_down \
+                and stream_id > self._goaway_stream_id:
+            return False # data of a refused stream, already in flight
+        if self.tracer is not None:
+            self.tracer.data_received(self, stream_id, flags)
+        if flags & FLAG_FIN:
+            self._half_close(stream_id, False)
+        return True
+
+    def _frame_received(self, frame):
+        """ Updates the connection state with a parsed frame. Returns False
+            when the frame was fully handled here and must not reach the
+            application. """
+        if not frame.is_control:
+            return self._data_received(frame.stream_id, frame.flags)
+        if self.tracer is not None:
+            self.tracer.received(self, frame)
+        if isinstance(frame, SynStream):
+            if self.shutting_down and frame.stream_id > self._goaway_stream_id:
+                self.put_frame(RstStream(frame.stream_id, REFUSED_STREAM,
+                                         version=self.version))
+                if self.tracer is not None:
+                    self.tracer.closed(self, frame.stream_id)
+                return False
+            self._stream_id_peer = max(self._stream_id_peer, frame.stream_id)
+            stream = Stream(frame.stream_id, frame.priority,
+                            frame.assoc_stream_id)
+            stream.local_closed = frame.unidirectional
+            self._stream_opened(stream)
+            if frame.fin:
+                self._half_close(frame.stream_id, False)
+        elif isinstance(frame, SynReply):
+            if frame.fin:
+                self._half_close(frame.stream_id, False)
+        elif isinstance(frame, RstStream):
+            rst_in = self.counters.rst_in
+            rst_in[frame.error_code] = rst_in.get(frame.error_code, 0) + 1
+            self._close_stream(frame.stream_id)
+        elif isinstance(frame, Ping):
+            if frame.uniq_id in self._pings:
+                self._ping_received(frame.uniq_id)
+            elif self.auto_ping and frame.uniq_id % 2 != self._ping_id % 2:
+                self.put_frame(Ping(frame.uniq_id, version=self.version))
+        elif isinstance(frame, Settings):
+            if self.auto_settings:
+                if frame.clear_persisted:
+                    self.peer_settings.clear()
+                for id, (id_flag, value) in frame.id_value_pairs.items():
+                    self.peer_settings[id] = value
+            window = frame.id_value_pairs.get(INITIAL_WINDOW_SIZE)
+            if window is not None and self._initial_window is not None:
+                delta = window[1] - self._initial_window
+                self._initial_window = window[1]
+                for stream_id in list(self._push_bodies):
+                    self._push_bodies[stream_id][1] += delta
+                    self._send_push_body(stream_id)
+        elif isinstance(frame, WindowUpdate):
+            if frame.stream_id in self._push_bodies:
+                self._push_bodies[frame.stream_id][1] += \
+                    frame.delta_window_size
+                self._send_push_body(frame.stream_id)
+        elif isinstance(frame, Goaway):
+            status = frame.status_code or GOAWAY_OK
+            goaway_in = self.counters.goaway_in
+            goaway_in[status] = goaway_in.get(status, 0) + 1
+            self.goaway_received = frame.last_stream_id
+            # Our streams above last_stream_id were never seen by the peer
+            for stream_id in list(self.streams):
+                if stream_id % 2 == self._stream_id % 2 and \
+                        stream_id > frame.last_stream_id:
+                    self._close_stream(stream_id)
+        return True
+
+    def set_watermarks(self, input_high=None, input_low=None, output_high=None,
+                       output_low=None):
+        """ Buffered input (input_buffer) and pending output (queued_bytes +
+            unsent_bytes) limits, in bytes. Going over a high watermark sets
+            reading_paused and calls on_pause_reading(ctx); once everything is
+            back under the low watermarks on_resume_reading(ctx) is called.
+            Low watermarks default to a quarter of the high ones. """
+        self.input_high_water = input_high
+        self.input_low_water = input_low if input_low is not None else \
+                               (input_high // 4 if input_high else None)
+        self.output_high_water = output_high
+        self.output_low_water = output_low if output_low is not None else \
+                                (output_high // 4 if output_high else None)
+        self._watermarks = bool(input_high or output_high or self.budget)
+        self._check_watermarks()
+
+    def set_unsent_bytes(self, nbytes):
+        """ Lets the I/O layer report output it accepted but couldn't write
+            yet, so it counts against the output watermark """
+        self.unsent_bytes = nbytes
+        if nbytes > self.counters.unsent_bytes_peak:
+            self.counters.unsent_bytes_peak = nbytes
+        if self._watermarks:
+            self._check_watermarks()
+
+    def _limits(self):
+        if self.budget is not None:
+            half = self.budget.share // 2
+            return (half, half // 4, half, half // 4)
+        return (self.input_high_water, self.input_low_water,
+                self.output_high_water, self.output_low_water)
+
+    def _complete_frame_buffered(self):
+        buf = self.input_buffer
+        return len(buf) >= 8 and \
+               len(buf) >= 8 + get_int_from_stream(buf[5:8], 'big')
+
+    def _check_watermarks(self):
+        input_high, input_low, output_high, output_low = self._limits()
+        buffered = len(self.input_buffer)
+        pending = self.queued_bytes + self.unsent_bytes
+        if not self.reading_paused:
+            # A lone partial frame can only shrink by reading more
+            if (input_high and buffered >= input_high and
+                    self._complete_frame_buffered()) or \
+                    (output_high and pending >= output_high):
+                self.reading_paused = True
+                if self.on_pause_reading is not None:
+                    self.on_pause_reading(self)
+        elif (not input_high or buffered <= input_low or
+                not self._complete_frame_buffered()) and \
+                (not output_high or pending <= output_low):
+            self.reading_paused = False
+            if self.on_resume_reading is not None:
+                self.on_resume_reading(self)
+
     def incoming(self, chunk):
+        self._last_received = _clock()
+        if self.capture is not None:
+            self.capture.incoming(self, chunk)
         self.input_buffer.extend(chunk)
+        if len(self.input_buffer) > self.counters.input_buffer_peak:
+            self.counters.input_buffer_peak = len(self.input_buffer)
+        if self._watermarks:
+            self._check_watermarks()
+
+    def peek_frame(self):
+        """ FrameHeader of the next frame in input_buffer, without decoding
+            or consuming it; None until its 8 byte header is buffered.
+            Whether the whole frame is there: len(input_buffer) >= 8 + length """
+        buf = self.input_buffer
+        if len(buf) < 8:
+            return None
+        length = get_int_from_stream(buf[5:8], 'big')
+        if not buf[0] & _first_bit:
+            return FrameHeader(False, DATA,
+                               get_int_from_stream(buf[0:4], 'big'),
+                               buf[4], length)
+        frame_type = get_int_from_stream(buf[2:4], 'big')
+        stream_id = 0
+        if frame_type in _STREAM_CONTROL_FRAMES and length >= 4 and \
+                len(buf) >= 12:
+            stream_id = get_int_from_stream(buf[8:12], 'big') & _last_31_bits
+        return FrameHeader(True, frame_type, stream_id, buf[4], length)
+
+    def take_data(self):
+        """ Consumes the DATA frame at the head of input_buffer without
+            building a DataFrame: returns (stream_id, flags, payload), or None
+            if the next frame is not a complete DATA frame. The payload is
+            copied out of the buffer once. Stream state is updated as by
+            get_frame(); data of refused streams comes back as None too. """
+        buf = self.input_buffer
+        if len(buf) < 8 or buf[0] & _first_bit:
+            return None
+        end = 8 + get_int_from_stream(buf[5:8], 'big')
+        if len(buf) < end:
+            return None
+        stream_id = get_int_from_stream(buf[0:4], 'big')
+        flags = buf[4]
+        with memoryview(buf) as view:
+            payload = view[8:end].tobytes()
+        del buf[:end]
+        self.counters.frames_in[DATA] += 1
+        self.counters.bytes_in[DATA] += end
+        if self._watermarks:
+            self._check_watermarks()
+        if not self._data_received(stream_id, flags):
+            return None
+        return stream_id, flags, payload
 
     def get_frame(self):
-        frame, bytes_parsed = self._parse_frame(self.input_buffer)
-        if bytes_parsed:
-            self.input_buffer = self.input_buffer[bytes_parsed:]
-        return frame
+        counters = self.counters
+        while True:
+            buf = self.input_buffer
+            control = len(buf) >= 8 and buf[0] & _first_bit
+            if control:
+                started = timer()
+            frame, bytes_parsed = self._parse_frame(buf)
+            if bytes_parsed:
+                del buf[:bytes_parsed]
+                if control:
+                    counters.parse_time += timer() - started
+                    frame_type = frame.frame_type
+                else:
+                    frame_type = DATA
+                counters.frames_in[frame_type] += 1
+                counters.bytes_in[frame_type] += bytes_parsed
+                if self._watermarks:
+                    self._check_watermarks()
+            if not frame or self._frame_received(frame):
+                return frame
+
+    def on(self, frame_type, handler):
+        """ Registers handler(frame) for a frame type (DATA for data frames),
+            None unregisters it. Used by dispatch(). """
+        if frame_type != DATA and frame_type not in FRAME_TYPES:
+            raise ValueError("invalid frame type: {0}".format(frame_type))
+        self._handlers[frame_type] = handler
+
+    def set_handlers(self, **handlers):
+        """ Keyword version of on(): ctx.set_handlers(on_data=f, on_ping=g) """
+        for name, handler in handlers.items():
+            if name not in HANDLER_NAMES:
+                raise TypeError("unknown handler: {0}".format(name))
+            self.on(HANDLER_NAMES[name], handler)
+
+    def dispatch(self):
+        """ Parses every complete frame in the input buffer and calls the
+            registered handlers, returns the number of frames consumed.
+            Frames without a handler are skipped without being decoded,
+            unless the context itself needs them (header blocks, stream
+            state, pending pings and the auto_* options). """
+        buf = self.input_buffer
+        handlers = self._handlers
+        counters = self.counters
+        offset = 0
+        count = 0
+        # DATA totals are what's left once the control frames are counted
+        control_frames = 0
+        control_bytes = 0
+        try:
+            while len(buf) - offset >= 8:
+                end = offset + 8 + get_int_from_stream(buf[offset+5:offset+8],
+                                                       'big')
+                if len(buf) < end:
+                    break
+                if buf[offset] & _first_bit:
+                    frame_type = get_int_from_stream(buf[offset+2:offset+4],
+                                                     'big')
+                    if frame_type not in FRAME_TYPES:
+                        raise SpdyProtocolError("invalid frame type: {0}"
+                                                .format(frame_type))
+                else:
+                    frame_type = DATA
+                handler = handlers[frame_type]
+
+                if handler is None and not (frame_type in _ALWAYS_DECODED or
+                        (frame_type == PING and (self.auto_ping or self._pings))
+                        or (frame_type == SETTINGS and (self.auto_settings or
+                                                        self._initial_window))
+                        or (frame_type == WINDOW_UPDATE and self._push_bodies)):
+                    if frame_type == DATA:
+                        stream_id = get_int_from_stream(buf[offset:offset+4],
+                                                        'big') & _last_31_bits
+                        self._data_received(stream_id, buf[offset+4])
+                    frame = None
+                elif frame_type == DATA:
+                    frame, _ = self._parse_frame(buf[offset:end])
+                else:
+                    started = timer()
+                    frame, _ = self._parse_frame(buf[offset:end])
+                    counters.parse_time += timer() - started
+                if frame_type != DATA:
+                    counters.frames_in[frame_type] += 1
+                    counters.bytes_in[frame_type] += end - offset
+                    control_frames += 1
+                    control_bytes += end - offset
+                offset = end
+                count += 1
+                if frame is not None and self._frame_received(frame) and \
+                        handler is not None:
+                    handler(frame)
+        finally:
+            if count > control_frames:
+                counters.frames_in[DATA] += count - control_frames
+                counters.bytes_in[DATA] += offset - control_bytes
+            if offset:
+                del buf[:offset]
+            if self._watermarks:
+                self._check_watermarks()
+        return count
 
     def put_frame(self, frame):
         if not isinstance(frame, Frame):
             raise TypeError("frame must be a valid Frame object")
-        self.frame_queue.append(frame)
+        with self.lock:
+            self.frame_queue.append(frame)
+            self._queued(frame)
+        self._frame_sent(frame)
+
+    def put_frame_threadsafe(self, frame):
+        """ put_frame() for threads other than the one doing the I/O: the
+            frame is queued in order with everything else and
+            on_frames_queued(ctx) is called so the I/O thread flushes it.
+            Its effect on stream state, watermark callbacks and the tracer
+            are left to the I/O thread, in outgoing_chunks(). """
+        if not isinstance(frame, Frame):
+            raise TypeError("frame must be a valid Frame object")
+        with self.lock:
+            self.frame_queue.append(frame)
+            self._threadsafe_frames.append(frame)
+            self._queued(frame, check=False)
+        if self.on_frames_queued is not None:
+            self.on_frames_queued(self)
+
+    def write_threadsafe(self, stream_id, data, fin=False):
+        """ Queues body data for a stream from any thread, SPDY/2 only:
+            SPDY/3 send windows are kept on the I/O thread (spdy.server,
+            spdy.aio), hand the data over to it instead, e.g. with
+            Server.call_soon_threadsafe(). """
+        if self.version >= 3:
+            raise SpdyProtocolError("write_threadsafe() would bypass SPDY/3 "
+                                    "flow control")
+        self.put_frame_threadsafe(DataFrame(stream_id, data,
+                                            FLAG_FIN if fin else 0))
+
+    def _queued(self, frame, check=True):
+        if frame.is_control:
+            self.queued_bytes += _CONTROL_FRAME_ESTIMATE
+        else:
+            self.queued_bytes += 8 + len(frame.data)
+        if check and self._watermarks:
+            self._check_watermarks()
 
     def outgoing(self):
         out = bytearray()
-        while len(self.frame_queue) > 0:
-            frame = self.frame_queue.pop(0)
-            out.extend(self._encode_frame(frame))
+        for chunk in self.outgoing_chunks():
+            out.extend(chunk)
         return out
 
+    def outgoing_chunks(self):
+        """ Like outgoing(), but returns the encoded frames as a list, ready
+            for transport.writelines()/socket.sendmsg() without joining them.
+            Large DATA payloads come as their own buffer, not copied. """
+        with self.lock:
+            queue, self.frame_queue = self.frame_queue, []
+            queued_bytes, self.queued_bytes = self.queued_bytes, 0
+            if self._threadsafe_frames:
+                threadsafe_frames, self._threadsafe_frames = \
+                    self._threadsafe_frames, []
+            else:
+                threadsafe_frames = ()
+        for frame in threadsafe_frames:
+            self._frame_sent(frame)
+        chunks = []
+        if queue:
+            # the queue only grows between calls: its peak is now
+            counters = self.counters
+            if len(queue) > counters.frame_queue_peak:
+                counters.frame_queue_peak = len(queue)
+            if queued_bytes > counters.queued_bytes_peak:
+                counters.queued_bytes_peak = queued_bytes
+            frames_out = counters.frames_out
+            bytes_out = counters.bytes_out
+            # DATA totals come from queued_bytes, minus the control frames
+            control_frames = 0
+            started = timer()
+            for frame in queue:
+                if frame.is_control:
+                    chunk = self._encode_frame(frame)
+                    chunks.append(chunk)
+                    frames_out[frame.frame_type] += 1
+                    bytes_out[frame.frame_type] += len(chunk)
+                    control_frames += 1
+                elif len(frame.data) >= _ZERO_COPY_DATA_SIZE:
+                    chunks.append(self._encode_data_header(frame))
+                    chunks.append(frame.data)
+                else:
+                    chunks.append(self._encode_frame(frame))
+            counters.encode_time += timer() - started
+            frames_out[DATA] += len(queue) - control_frames
+            bytes_out[DATA] += queued_bytes - \
+                               control_frames * _CONTROL_FRAME_ESTIMATE
+            if self.tracer is not None:
+                self.tracer.sent(self, queue)
+            if self.capture is not None:
+                self.capture.outgoing(self, chunks)
+        if self._watermarks:
+            self._check_watermarks()
+        return chunks
+
     def _parse_header_chunk(self, compressed_data, version):
         # Zlib dictionary selection
-        chunk = self.inflater.decompress(compressed_data)
+        counters = self.counters
+        started = timer()
+        try:
+            chunk = self.inflater.decompress(compressed_data)
+        except ZlibError as exc:
+            raise SpdyProtocolError(str(exc))
+        counters.inflate_time += timer() - started
+        counters.headers_in_compressed += len(compressed_data)
+        counters.headers_in_raw += len(chunk)
         
         length_size = 2 if version == 2 else 4
         headers = {}
@@ -276,38 +1042,25 @@ class Context(object):
             length = get_int_from_stream(chunk[5:8], 'big')
             frame_length = 8 + length
             if len(chunk) < frame_length:
-                return (0, None)
+                return (None, 0)
 
             data = chunk[8:frame_length]
-            frame = DataFrame(stream_id, data)
+            frame = DataFrame(stream_id, data, flags)
 
         return (frame, frame_length)
 
     def _encode_header_chunk(self, headers, version):
-        chunk = bytearray()
-        length_size = 2 if version == 2 else 4
-        
-        #first two bytes: number of pairs
-        chunk.extend(get_stream_from_int(len(headers), length_size, 'big'))
-
-        #after that...
-        for name, value in headers.items():
-            name = bytes(name.encode('utf-8'))
-            value = bytes(value.encode('utf-8'))
-
-            #two bytes: length of name
-            chunk.extend(get_stream_from_int(len(name), length_size, 'big'))
-
-            #next name_length bytes: name
-            chunk.extend(name)
-
-            #two bytes: length of value
-            chunk.extend(get_stream_from_int(len(value), length_size, 'big'))
-
-            #next value_length bytes: value
-            chunk.extend(value)
-            
-        return self.deflater.compress(bytes(chunk))
+        if isinstance(headers, SerializedHeaders) and headers.version == version:
+            block = headers.block
+        else:
+            block = serialize_headers(headers, version)
+        counters = self.counters
+        started = timer()
+        compressed = self.deflater.compress(block)
+        counters.deflate_time += timer() - started
+        counters.headers_out_raw += len(block)
+        counters.headers_out_compressed += len(compressed)
+        return compressed
 
     def _encode_settings_id_values_v2(self, id_values_dict):
         chunk = bytearray()
@@ -384,18 +1137,20 @@ class Context(object):
             out.extend(data)
 
         else: #data frame
-
-            #first four bytes: stream_id
-            out.extend(get_stream_from_int(frame.stream_id, 4, 'big'))
-
-            #fifth: flags
-            out.append(frame.flags)
-
-            #sixth, seventh and eighth bytes: length
-            data_length = len(frame.data)
-            out.extend(get_stream_from_int(data_length, 3, 'big'))
+            out.extend(self._encode_data_header(frame))
 
             #rest is data
             out.extend(frame.data)
 
         return out
+
+    def _encode_data_header(self, frame):
+        #first four bytes: stream_id
+        header = bytearray(get_stream_from_int(frame.stream_id, 4, 'big'))
+
+        #fifth: flags
+        header.append(frame.flags)
+
+        #sixth, seventh and eighth bytes: length
+        header.extend(get_stream_from_int(len(frame.data), 3, 'big'))
+        return header
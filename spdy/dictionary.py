@@ -0,0 +1,248 @@
+# coding: utf-8
+""" Header compression dictionaries trained on your own traffic
+
+        corpus = load_corpus(['edge.spdycap', 'headers.jsonl'])
+        dictionary = train(corpus, version=3)
+        evaluate(corpus, dictionary, version=3)     # bytes and CPU saved
+
+        ctx = Context(CLIENT, 3, dictionary=dictionary)    # both ends
+
+    ZLIB_DICT_V2/V3 were built from 2012 browser traffic. Between services
+    of a private deployment the header vocabulary is a different one, and a
+    dictionary made of it saves most on the first requests of a connection,
+    before zlib's window has seen anything.
+
+    A corpus is a list of compression contexts (a connection's header blocks
+    in one direction), each a list of header dicts. Training serializes
+    every header as it goes on the wire and scores three candidates for it,
+    the name, the value and the whole pair (with their length prefixes), by
+    the bytes they would save: their length times the number of contexts
+    they occur in, since only a context's first occurrence is compressed
+    against the dictionary. The best go at the end of the dictionary, where
+    zlib finds them at the shortest distances; the standard dictionary fills
+    whatever room is left at the front.
+
+        python -m spdy.dictionary train edge.spdycap -o services.dict
+        python -m spdy.dictionary evaluate services.dict headers.jsonl
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from spdy.c_zlib import Deflater, Inflater, ZLIB_DICT_V2, ZLIB_DICT_V3
+from spdy.capture import read_capture, MAGIC, OPEN, IN, OUT, CLOSE, _OPEN, \
+                         _SIDE_NAMES
+from spdy.context import Context, CLIENT, SERVER, serialize_headers
+from spdy.frames import DEFAULT_VERSION, SYN_STREAM, SYN_REPLY, HEADERS
+
+# zlib only looks this far back, the start of a longer dictionary is unused
+MAX_SIZE = 32 * 1024
+# Longer values are ids, cookies and the like, not worth the room
+MAX_CANDIDATE = 512
+
+_HEADER_FRAMES = frozenset([SYN_STREAM, SYN_REPLY, HEADERS])
+
+
+def standard_dictionary(version):
+    return ZLIB_DICT_V3 if version == 3 else ZLIB_DICT_V2
+
+def _capture_contexts(f):
+    """ Header dicts of every connection and direction in a capture """
+    contexts = {}
+    decoders = {}
+    for record in read_capture(f):
+        if record.kind == OPEN:
+            side, version = _OPEN.unpack(record.data)
+            side = _SIDE_NAMES[side]
+            peer = CLIENT if side == SERVER else SERVER
+            decoders[record.conn_id, IN] = Context(side, version)
+            decoders[record.conn_id, OUT] = Context(peer, version)
+            continue
+        if record.kind == CLOSE:
+            decoders.pop((record.conn_id, IN), None)
+            decoders.pop((record.conn_id, OUT), None)
+            continue
+        ctx = decoders.get((record.conn_id, record.kind))
+        if ctx is None:
+            continue
+        ctx.incoming(record.data)
+        while True:
+            try:
+                frame = ctx.get_frame()
+            except Exception:
+                # undecodable from here on, keep what came before
+                del decoders[record.conn_id, record.kind]
+                break
+            if frame is None:
+                break
+            if frame.is_control and frame.frame_type in _HEADER_FRAMES and \
+                    frame.headers:
+                contexts.setdefault((record.conn_id, record.kind),
+                                    []).append(dict(frame.headers))
+    return [contexts[key] for key in sorted(contexts)]
+
+def load_corpus(paths, per_context=1):
+    """ Compression contexts from capture files (see spdy.capture) and JSON
+        lines files of header dicts, `per_context` lines to a context """
+    corpus = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) == MAGIC:
+                f.seek(0)
+                corpus.extend(_capture_contexts(f))
+                continue
+            f.seek(0)
+            blocks = [json.loads(line.decode('utf-8')) for line in f
+                      if line.strip()]
+        for i in range(0, len(blocks), per_context):
+            corpus.append(blocks[i:i + per_context])
+    return corpus
+
+
+def _candidates(headers, version):
+    """ The name, value and pair of every header, serialized with their
+        length prefixes as in an n/v block """
+    prefix = 2 if version == 2 else 4
+    for name, value in headers.items():
+        pair = serialize_headers({name: value}, version)[prefix:]
+        name_size = prefix + len(name.encode('utf-8'))
+        if len(pair) <= MAX_CANDIDATE:
+            yield pair
+        yield pair[:name_size]
+        if len(pair) - name_size <= MAX_CANDIDATE:
+            yield pair[name_size:]
+
+def train(corpus, version=DEFAULT_VERSION, size=8 * 1024, min_contexts=2,
+          keep_standard=True):
+    """ A dictionary of at most `size` bytes for `corpus` (a list of
+        contexts, see load_corpus()). Strings seen in fewer than
+        `min_contexts` contexts are left out; with `keep_standard` the
+        standard dictionary's tail fills the room left. """
+    size = min(size, MAX_SIZE)
+    seen = {}
+    for context in corpus:
+        strings = set()
+        for headers in context:
+            strings.update(_candidates(headers, version))
+        for string in strings:
+            seen[string] = seen.get(string, 0) + 1
+    # a back reference costs about 3 bytes
+    scored = sorted(((count * (len(string) - 3), string)
+                     for string, count in seen.items()
+                     if count >= min_contexts and len(string) > 3),
+                    reverse=True)
+    chosen = []
+    used = 0
+    for score, string in scored:
+        if used + len(string) > size:
+            continue
+        if any(string in other for other in chosen):
+            continue
+        # a pair makes its name redundant
+        for other in [other for other in chosen if other in string]:
+            chosen.remove(other)
+            used -= len(other)
+        chosen.append(string)
+        used += len(string)
+    # best last: closest to what's being compressed
+    dictionary = b''.join(reversed(chosen))
+    if keep_standard and len(dictionary) < size:
+        standard = standard_dictionary(version)
+        dictionary = standard[-(size - len(dictionary)):] + dictionary
+    return dictionary
+
+
+def _blocks(corpus, version):
+    return [[serialize_headers(headers, version) for headers in context]
+            for context in corpus]
+
+def _measure(blocks, version, dictionary):
+    compressed = 0
+    deflate_time = inflate_time = 0.0
+    for context in blocks:
+        deflater = Deflater(version, dictionary)
+        inflater = Inflater(version, dictionary)
+        for block in context:
+            started = time.process_time()
+            data = deflater.compress(block)
+            deflate_time += time.process_time() - started
+            compressed += len(data)
+            started = time.process_time()
+            inflater.decompress(data)
+            inflate_time += time.process_time() - started
+    return compressed, deflate_time, inflate_time
+
+def evaluate(corpus, dictionary, version=DEFAULT_VERSION, repeat=3):
+    """ Header bytes and zlib CPU over `corpus` with `dictionary` against
+        the standard one, each context through a fresh deflater and
+        inflater as on a new connection; CPU is the best of `repeat` runs """
+    blocks = _blocks(corpus, version)
+    raw = sum(len(block) for context in blocks for block in context)
+    result = {'contexts': len(blocks),
+              'header_blocks': sum(len(context) for context in blocks),
+              'raw_bytes': raw, 'dictionary_bytes': len(dictionary)}
+    for name, candidate in (('standard', None), ('custom', dictionary)):
+        runs = [_measure(blocks, version, candidate) for _ in range(repeat)]
+        result[name + '_bytes'] = runs[0][0]
+        result[name + '_cpu_sec'] = min(deflate + inflate
+                                        for _, deflate, inflate in runs)
+    result['bytes_saved'] = result['standard_bytes'] - result['custom_bytes']
+    result['bytes_saved_ratio'] = float(result['bytes_saved']) / \
+                                  result['standard_bytes'] \
+                                  if result['standard_bytes'] else None
+    result['cpu_saved_sec'] = result['standard_cpu_sec'] - \
+                              result['custom_cpu_sec']
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m spdy.dictionary',
+                                     description='header compression '
+                                                 'dictionaries')
+    commands = parser.add_subparsers(dest='command')
+    for name in ('train', 'evaluate'):
+        command = commands.add_parser(name)
+        if name == 'evaluate':
+            command.add_argument('dictionary')
+        command.add_argument('corpus', nargs='+',
+                             help='capture files or JSON lines of headers')
+        command.add_argument('--version', type=int, default=DEFAULT_VERSION)
+        command.add_argument('--per-context', type=int, default=1,
+                             help='JSON lines per compression context')
+        if name == 'train':
+            command.add_argument('-o', '--output', required=True)
+            command.add_argument('--size', type=int, default=8 * 1024)
+            command.add_argument('--min-contexts', type=int, default=2)
+            command.add_argument('--no-standard', action='store_true',
+                                 help="don't pad with the standard dictionary")
+            command.add_argument('--holdout', type=float, default=0.2,
+                                 help='share of the corpus kept out of '
+                                      'training to evaluate on')
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+
+    corpus = load_corpus(args.corpus, args.per_context)
+    if args.command == 'train':
+        contexts = list(corpus)
+        random.Random(0).shuffle(contexts)
+        held = int(len(contexts) * args.holdout)
+        test, training = contexts[:held], contexts[held:]
+        dictionary = train(training, args.version, args.size,
+                           args.min_contexts, not args.no_standard)
+        with open(args.output, 'wb') as f:
+            f.write(dictionary)
+        corpus = test or training
+    else:
+        with open(args.dictionary, 'rb') as f:
+            dictionary = f.read()
+    result = evaluate(corpus, dictionary, args.version)
+    for name, value in sorted(result.items()):
+        print('{0:<20} {1}'.format(name, value))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,252 @@
+# coding: utf-8
+""" SPDY to SPDY forwarding between two Contexts, for proxies
+
+        front = Context(SERVER)     # facing the clients
+        back = Context(CLIENT)      # facing the origin
+        forwarder = Forwarder(front, back)
+
+        front.incoming(data_from_client)
+        forwarder.forward(front)    # frames move to back.frame_queue
+        sock_to_origin.sendmsg(back.outgoing_chunks())
+
+    DATA frames are spliced: their header is only peeked at and the payload
+    is taken out of the input buffer as a single copy, then queued on the
+    other leg under the remapped stream id (outgoing_chunks() hands large
+    payloads out without copying them again). feed() goes further for data
+    straight from sock.recv(): payloads are forwarded as slices of the
+    received bytes, never copied by Python. Header blocks are the only
+    thing decoded, and recompressed by the other leg's deflater; v2 and v3
+    legs can be mixed. PING and SETTINGS stay on their leg, GOAWAY starts a
+    graceful shutdown of the other leg, WINDOW_UPDATE and RST_STREAM follow
+    their stream so flow control runs end to end.
+"""
+from spdy.context import SpdyProtocolError, get_int_from_stream, _clock
+from spdy.frames import DataFrame, SynStream, SynReply, Headers, RstStream, \
+                        WindowUpdate, Goaway, DATA, FLAG_FIN, REFUSED_STREAM
+from spdy.http import parse_request, request_headers, parse_response, \
+                      response_headers
+
+def _translate_request(nv, src_version, dst_version):
+    if src_version == dst_version:
+        return nv
+    method, path, host, scheme, http_version, headers = \
+        parse_request(src_version, nv)
+    return request_headers(dst_version, method, path, host, scheme, headers,
+                           http_version)
+
+def _translate_response(nv, src_version, dst_version):
+    if src_version == dst_version:
+        return nv
+    status, reason, headers = parse_response(src_version, nv)
+    version_key = 'version' if src_version == 2 else ':version'
+    return response_headers(dst_version, '{0} {1}'.format(status, reason),
+                            headers, nv.get(version_key, 'HTTP/1.1'))
+
+def _translate_priority(priority, src_version, dst_version):
+    if src_version == dst_version:
+        return priority
+    return priority >> 1 if dst_version == 2 else priority << 1
+
+
+class Forwarder(object):
+
+    def __init__(self, downstream, upstream):
+        """ `downstream` is the SERVER Context facing clients, `upstream`
+            the CLIENT Context facing the origin. Both get auto_ping and
+            auto_settings turned on. """
+        self.downstream = downstream
+        self.upstream = upstream
+        # PING and SETTINGS are never forwarded, each leg handles its own
+        for ctx in (downstream, upstream):
+            ctx.auto_ping = True
+            ctx.auto_settings = True
+        self._other = {downstream: upstream, upstream: downstream}
+        # leg -> {stream id on that leg: stream id on the other leg}
+        self._ids = {downstream: {}, upstream: {}}
+        self.frames = 0
+        self.data_frames = 0
+        self.data_bytes = 0
+        self.dropped = 0
+
+    def __repr__(self):
+        return '<Forwarder streams={0} frames={1}>'.format(
+            len(self._ids[self.downstream]), self.frames)
+
+    @property
+    def streams(self):
+        return len(self._ids[self.downstream])
+
+    def forward(self, src):
+        """ Moves every complete frame buffered in `src` to the other leg's
+            queue, returns the number of frames read """
+        dst = self._other[src]
+        ids = self._ids[src]
+        buf = src.input_buffer
+        count = 0
+        while True:
+            header = src.peek_frame()
+            if header is None or len(buf) < 8 + header.length:
+                break
+            count += 1
+            if header.control:
+                frame = src.get_frame()
+                if frame is None:
+                    break
+                self.forward_frame(src, frame)
+                continue
+            data = src.take_data()
+            if data is None:
+                continue
+            stream_id, flags, payload = data
+            dst_id = ids.get(stream_id)
+            if dst_id is None:
+                self.dropped += 1
+                continue
+            dst.put_frame(DataFrame(dst_id, payload, flags))
+            self.data_frames += 1
+            self.data_bytes += len(payload)
+            if flags & FLAG_FIN:
+                self._maybe_forget(src, stream_id)
+        self.frames += count
+        return count
+
+    def feed(self, src, data):
+        """ src.incoming(data) + forward(src), for an immutable chunk the
+            caller is done with (bytes from sock.recv()): DATA frames lying
+            whole in `data` are forwarded as memoryview slices of it. Returns
+            the number of frames read. """
+        if src.input_buffer or src.capture is not None:
+            # finish the partial frame first, order matters; a capture
+            # records what goes through incoming()
+            src.incoming(data)
+            return self.forward(src)
+        src._last_received = _clock()
+        dst = self._other[src]
+        ids = self._ids[src]
+        view = memoryview(data)
+        size = len(data)
+        counters = src.counters
+        # what incoming() would have buffered
+        if size > counters.input_buffer_peak:
+            counters.input_buffer_peak = size
+        offset = 0
+        count = 0
+        control = 0
+        data_bytes = 0
+        while size - offset >= 8:
+            end = offset + 8 + get_int_from_stream(view[offset + 5:offset + 8],
+                                                   'big')
+            if end > size:
+                break
+            if view[offset] & 0x80:
+                # control frame: through the Context, it has to be decoded
+                src.input_buffer.extend(view[offset:end])
+                control += self.forward(src)
+                offset = end
+                continue
+            count += 1
+            data_bytes += end - offset
+            stream_id = get_int_from_stream(view[offset:offset + 4], 'big')
+            flags = view[offset + 4]
+            payload = view[offset + 8:end]
+            offset = end
+            if not src._data_received(stream_id, flags):
+                continue
+            dst_id = ids.get(stream_id)
+            if dst_id is None:
+                self.dropped += 1
+                continue
+            dst.put_frame(DataFrame(dst_id, payload, flags))
+            self.data_frames += 1
+            self.data_bytes += len(payload)
+            if flags & FLAG_FIN:
+                self._maybe_forget(src, stream_id)
+        # counted once per call, as dispatch() does
+        if count:
+            counters.frames_in[DATA] += count
+            counters.bytes_in[DATA] += data_bytes
+        if offset < size:
+            src.incoming(view[offset:])
+        self.frames += count
+        return count + control
+
+    def _map(self, src, stream_id):
+        dst_id = self._ids[src].get(stream_id)
+        if dst_id is None:
+            self.dropped += 1
+        return dst_id
+
+    def _forget(self, src, stream_id):
+        dst_id = self._ids[src].pop(stream_id, None)
+        if dst_id is not None:
+            self._ids[self._other[src]].pop(dst_id, None)
+
+    def _maybe_forget(self, src, stream_id):
+        """ Drops the mapping once the stream is closed on both legs """
+        dst_id = self._ids[src].get(stream_id)
+        if stream_id not in src.streams and (dst_id is None or
+                dst_id not in self._other[src].streams):
+            self._forget(src, stream_id)
+
+    def forward_frame(self, src, frame):
+        """ Forwards one frame decoded from `src` (by get_frame()) """
+        dst = self._other[src]
+        if not frame.is_control:
+            dst_id = self._map(src, frame.stream_id)
+            if dst_id is not None:
+                dst.put_frame(DataFrame(dst_id, frame.data, frame.flags))
+                if frame.fin:
+                    self._maybe_forget(src, frame.stream_id)
+            return
+        if isinstance(frame, SynStream):
+            assoc_id = 0
+            if frame.assoc_stream_id:
+                assoc_id = self._map(src, frame.assoc_stream_id)
+                if assoc_id is None:
+                    src.put_frame(RstStream(frame.stream_id, REFUSED_STREAM,
+                                            version=src.version))
+                    return
+            try:
+                dst_id = dst.next_stream_id
+            except SpdyProtocolError:
+                src.put_frame(RstStream(frame.stream_id, REFUSED_STREAM,
+                                        version=src.version))
+                return
+            self._ids[src][frame.stream_id] = dst_id
+            self._ids[dst][dst_id] = frame.stream_id
+            dst.put_frame(SynStream(dst_id,
+                _translate_request(frame.headers, src.version, dst.version),
+                priority=_translate_priority(frame.priority, src.version,
+                                             dst.version),
+                assoc_stream_id=assoc_id, flags=frame.flags,
+                version=dst.version))
+        elif isinstance(frame, SynReply):
+            dst_id = self._map(src, frame.stream_id)
+            if dst_id is not None:
+                dst.put_frame(SynReply(dst_id,
+                    _translate_response(frame.headers, src.version, dst.version),
+                    flags=frame.flags, version=dst.version))
+                if frame.fin:
+                    self._maybe_forget(src, frame.stream_id)
+        elif isinstance(frame, Headers):
+            dst_id = self._map(src, frame.stream_id)
+            if dst_id is not None:
+                dst.put_frame(Headers(dst_id, frame.headers, flags=frame.flags,
+                                      version=dst.version))
+                if frame.flags & FLAG_FIN:
+                    self._maybe_forget(src, frame.stream_id)
+        elif isinstance(frame, RstStream):
+            dst_id = self._map(src, frame.stream_id)
+            if dst_id is not None:
+                dst.put_frame(RstStream(dst_id, frame.error_code,
+                                        version=dst.version))
+                self._forget(src, frame.stream_id)
+        elif isinstance(frame, WindowUpdate):
+            dst_id = self._ids[src].get(frame.stream_id)
+            if dst_id is not None and dst.version >= 3:
+                dst.put_frame(WindowUpdate(dst_id, frame.delta_window_size,
+                                           version=dst.version))
+        elif isinstance(frame, Goaway):
+            if not dst.shutting_down:
+                dst.begin_shutdown()
+        # PING and SETTINGS are answered / applied per leg by the Contexts
@@ -4,6 +4,7 @@ DEFAULT_VERSION = 3
 VERSIONS = [2, 3]
 
 # Frame IDs
+DATA = 0  # Not a real control frame type, used to index DATA frames
 SYN_STREAM = 1
 SYN_REPLY = 2
 RST_STREAM = 3
@@ -55,6 +56,19 @@ GOAWAY_PROTOCOL_ERROR = 1
 GOAWAY_INTERNAL_ERROR = 11
 
 # Dicts for Debug printing
+FRAME_NAMES = {
+    0: 'DATA',
+    1: 'SYN_STREAM',
+    2: 'SYN_REPLY',
+    3: 'RST_STREAM',
+    4: 'SETTINGS',
+    5: 'NOOP',
+    6: 'PING',
+    7: 'GOAWAY',
+    8: 'HEADERS',
+    9: 'WINDOW_UPDATE',
+}
+
 ERROR_CODES = {
     1: 'PROTOCOL_ERROR',
     2: 'INVALID_STREAM',
@@ -63,6 +77,10 @@ ERROR_CODES = {
     5: 'CANCEL',
     6: 'INTERNAL_ERROR',
     7: 'FLOW_CONTROL_ERROR',
+    8: 'STREAM_IN_USE',
+    9: 'STREAM_ALREADY_CLOSED',
+    10: 'INVALID_CREDENTIALS',
+    11: 'FRAME_TOO_LARGE',
 }
 
 SETTINGS_ID_VALUES = {
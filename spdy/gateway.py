@@ -0,0 +1,269 @@
+# coding: utf-8
+""" Serves existing Python web apps over SPDY.
+
+    WSGI apps run on a bounded thread pool behind spdy.server.Server:
+
+        Server(WSGIGateway(app, max_workers=16), port=9599).serve_forever()
+
+    ASGI (3.0, 'http' scope) apps run on the event loop behind spdy.aio:
+
+        await spdy.aio.start_server(ASGIGateway(app), '', 9599)
+
+    Both map the SYN_STREAM n/v block (v2 'method'/'url'/'version', v3
+    ':method'/':path'/':version'...) to the environ / scope, and stream the
+    response back as a SYN_REPLY plus DATA frames. Header values SPDY joins
+    with NUL bytes become separate ASGI headers and comma separated WSGI ones.
+"""
+import io
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from spdy.frames import INTERNAL_ERROR
+from spdy.http import parse_request, response_headers
+
+log = logging.getLogger(__name__)
+
+_DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+def _split_host(host, scheme):
+    """ (name, port) out of a Host value, IPv6 literals included """
+    host = host or ''
+    if host.startswith('['):
+        name, _, rest = host[1:].partition(']')
+        port = rest[1:] if rest.startswith(':') else ''
+    else:
+        name, _, port = host.partition(':')
+    return name, port or _DEFAULT_PORTS.get(scheme, '80')
+
+def _nv_from_pairs(pairs):
+    """ SPDY n/v dict from (name, value) pairs, repeated names NUL joined """
+    nv = {}
+    for name, value in pairs:
+        name = name.lower()
+        if name in nv:
+            nv[name] = nv[name] + '\0' + value
+        else:
+            nv[name] = value
+    return nv
+
+def wsgi_environ(request):
+    """ PEP 3333 environ for a spdy.server.Request """
+    path, _, query = request.path.partition('?')
+    server_name, server_port = _split_host(request.host, request.scheme)
+    body = bytes(request.body)
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': unquote(path, 'latin-1'),
+        'QUERY_STRING': query,
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': server_port,
+        'SERVER_PROTOCOL': request.http_version,
+        'REMOTE_ADDR': request.conn.address[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': request.scheme,
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'spdy.version': request.conn.ctx.version,
+        'spdy.stream_id': request.stream_id,
+        'spdy.priority': request.priority,
+    }
+    for name, value in request.headers.items():
+        value = value.replace('\0', '; ' if name == 'cookie' else ', ')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'content-length':
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+    if request.host:
+        environ['HTTP_HOST'] = request.host
+    return environ
+
+
+class WSGIGateway(object):
+    """ spdy.server.Server handler running a WSGI app on `max_workers`
+        threads. Response chunks are handed to the server thread as the app
+        yields them (and buffered there until the client's window allows). """
+
+    def __init__(self, app, max_workers=16):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers,
+                                           thread_name_prefix='spdy-wsgi')
+
+    def __call__(self, request):
+        self.executor.submit(self._run, request)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def _run(self, request):
+        call = request.conn.server.call_soon_threadsafe
+        state = {'status': None, 'headers': None, 'sent': False}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None:
+                try:
+                    if state['sent']:
+                        raise exc_info[1].with_traceback(exc_info[2])
+                finally:
+                    exc_info = None
+            elif state['status'] is not None:
+                raise AssertionError('start_response() called twice')
+            state['status'] = status
+            state['headers'] = headers
+            return write
+
+        def send_headers():
+            if state['status'] is None:
+                raise AssertionError('write() before start_response()')
+            state['sent'] = True
+            call(request.respond_start, state['status'],
+                 _nv_from_pairs(state['headers']))
+
+        def write(data):
+            if request.reset_by_peer:
+                return
+            if not state['sent']:
+                send_headers()
+            if data:
+                call(request.write, data)
+
+        try:
+            result = self.app(wsgi_environ(request), start_response)
+            try:
+                for data in result:
+                    if request.reset_by_peer:
+                        break
+                    if data:
+                        write(data)
+                if request.reset_by_peer:
+                    return
+                if not state['sent']:
+                    send_headers()
+                call(request.finish)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except Exception:
+            log.exception('error in WSGI app for %r', request)
+            if request.reset_by_peer:
+                return
+            if state['sent']:
+                call(request.reset, INTERNAL_ERROR)
+            else:
+                call(request.respond, 500, {'content-type': 'text/plain'},
+                     b'Internal Server Error')
+
+
+class ASGIGateway(object):
+    """ spdy.aio handler running an ASGI 3.0 app, one task per stream """
+
+    def __init__(self, app, root_path=''):
+        self.app = app
+        self.root_path = root_path
+
+    def scope(self, stream):
+        """ ASGI 'http' scope for a SpdyStream """
+        protocol = stream._protocol
+        method, path, host, scheme, http_version, headers = \
+            parse_request(protocol.version, stream.headers)
+        path, _, query = path.partition('?')
+        pairs = []
+        if host:
+            pairs.append((b'host', host.encode('latin-1')))
+        for name, value in headers.items():
+            for part in value.split('\0'):
+                pairs.append((name.encode('latin-1'), part.encode('latin-1')))
+        transport = protocol.transport
+        return {
+            'type': 'http',
+            'asgi': {'version': '3.0', 'spec_version': '2.3'},
+            'http_version': http_version.partition('/')[2] or '1.1',
+            'method': method,
+            'scheme': scheme,
+            'path': unquote(path),
+            'raw_path': path.encode('latin-1'),
+            'query_string': query.encode('latin-1'),
+            'root_path': self.root_path,
+            'headers': pairs,
+            'server': transport.get_extra_info('sockname'),
+            'client': transport.get_extra_info('peername'),
+            'extensions': {'spdy': {'version': protocol.version,
+                                    'stream_id': stream.stream_id,
+                                    'priority': stream.priority}},
+        }
+
+    async def __call__(self, stream):
+        version = stream._protocol.version
+        done = stream._protocol._loop.create_future()
+        state = {'body_done': False, 'start': None, 'replied': False}
+
+        async def receive():
+            if not state['body_done']:
+                try:
+                    data = await stream.read()
+                except Exception:
+                    return {'type': 'http.disconnect'}
+                state['body_done'] = stream.at_eof
+                return {'type': 'http.request', 'body': data,
+                        'more_body': not state['body_done']}
+            await done
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            kind = message['type']
+            if kind == 'http.response.start':
+                if state['start'] is not None:
+                    raise RuntimeError('response already started')
+                state['start'] = message
+            elif kind == 'http.response.body':
+                if state['start'] is None:
+                    raise RuntimeError('response body before start')
+                if stream._error is not None and not done.done():
+                    # reset by the client: the response goes nowhere
+                    done.set_result(None)
+                if done.done():
+                    return
+                body = message.get('body', b'')
+                more = message.get('more_body', False)
+                if not state['replied']:
+                    start = state['start']
+                    nv = _nv_from_pairs(
+                        (name.decode('latin-1'), value.decode('latin-1'))
+                        for name, value in start.get('headers', ()))
+                    state['replied'] = True
+                    stream.reply(response_headers(version, start['status'], nv),
+                                 fin=not body and not more)
+                    if not body and not more:
+                        done.set_result(None)
+                        return
+                stream.write(body, fin=not more)
+                if not more:
+                    done.set_result(None)
+                await stream.drain()
+
+        try:
+            await self.app(self.scope(stream), receive, send)
+        except Exception:
+            log.exception('error in ASGI app for stream %i', stream.stream_id)
+            # reset() does nothing on a stream the client already reset
+            if not state['replied'] and stream._error is None:
+                state['replied'] = True
+                stream.reply(response_headers(version, 500,
+                             {'content-type': 'text/plain'}))
+                stream.write(b'Internal Server Error', fin=True)
+            elif not done.done():
+                stream.reset(INTERNAL_ERROR)
+        else:
+            if not state['replied'] and stream._error is None:
+                stream.reply(response_headers(version, 500), fin=True)
+            elif not done.done():
+                stream.reset(INTERNAL_ERROR)
+        finally:
+            if not done.done():
+                done.set_result(None)
@@ -0,0 +1,78 @@
+# coding: utf-8
+""" Mapping between HTTP semantics and SPDY n/v header blocks.
+
+    SPDY/2 uses 'method', 'url', 'version', 'status' (plus plain 'host' and
+    'scheme') while SPDY/3 uses the ':method', ':path', ':version', ':host',
+    ':scheme' and ':status' special headers. """
+try:
+    from http.client import responses as _REASONS
+except ImportError: # Python 2
+    from httplib import responses as _REASONS
+
+# Hop-by-hop headers, forbidden in SPDY n/v blocks
+HOP_BY_HOP = frozenset(['connection', 'keep-alive', 'proxy-connection',
+                        'transfer-encoding', 'upgrade', 'te', 'trailer'])
+
+_REQUEST_KEYS = {
+    2: ('method', 'url', 'version', 'host', 'scheme'),
+    3: (':method', ':path', ':version', ':host', ':scheme'),
+}
+
+def request_headers(version, method, path, host, scheme='https',
+                    headers=None, http_version='HTTP/1.1'):
+    """ n/v block of a request; `headers` are extra HTTP headers """
+    nv = {}
+    if headers:
+        for name, value in headers.items():
+            name = name.lower()
+            if name not in HOP_BY_HOP and name != 'host':
+                nv[name] = value
+    k_method, k_path, k_version, k_host, k_scheme = _REQUEST_KEYS[version]
+    nv[k_method] = method
+    nv[k_path] = path
+    nv[k_version] = http_version
+    nv[k_host] = host
+    nv[k_scheme] = scheme
+    return nv
+
+def parse_request(version, nv):
+    """ Splits a request n/v block into (method, path, host, scheme,
+        http_version, headers), headers holding the regular HTTP ones """
+    keys = _REQUEST_KEYS[version]
+    headers = dict((name, value) for name, value in nv.items()
+                   if name not in keys)
+    k_method, k_path, k_version, k_host, k_scheme = keys
+    return (nv.get(k_method, 'GET'), nv.get(k_path, '/'), nv.get(k_host),
+            nv.get(k_scheme, 'https'), nv.get(k_version, 'HTTP/1.1'), headers)
+
+def response_headers(version, status, headers=None, http_version='HTTP/1.1'):
+    """ n/v block of a response; `status` is an int or a '200 OK' string """
+    nv = {}
+    if headers:
+        for name, value in headers.items():
+            name = name.lower()
+            if name not in HOP_BY_HOP:
+                nv[name] = value
+    if not isinstance(status, str):
+        status = '{0} {1}'.format(status, _REASONS.get(status, ''))
+    if version == 2:
+        nv['status'] = status
+        nv['version'] = http_version
+    else:
+        nv[':status'] = status
+        nv[':version'] = http_version
+    return nv
+
+def parse_response(version, nv):
+    """ Splits a response n/v block into (status, reason, headers) """
+    k_status, k_version = ('status', 'version') if version == 2 else \
+                          (':status', ':version')
+    status_line = nv.get(k_status, '')
+    code, _, reason = status_line.partition(' ')
+    try:
+        status = int(code)
+    except ValueError:
+        status = 0
+    headers = dict((name, value) for name, value in nv.items()
+                   if name not in (k_status, k_version))
+    return status, reason, headers
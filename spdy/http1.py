@@ -0,0 +1,306 @@
+# coding: utf-8
+""" HTTP/1.1 front end multiplexing client requests onto a few long-lived
+    SPDY sessions to a backend (Python 3.7+)
+
+        gateway = HTTP1Gateway('backend.local', 9599, max_connections=2)
+        server = await gateway.start('', 8080)
+
+    Every HTTP/1.1 request becomes a stream on a spdy.pool.ConnectionPool
+    session; request and response bodies are streamed in both directions
+    (Content-Length or chunked on the HTTP/1.1 side). Hop-by-hop headers are
+    dropped both ways, repeated headers map to NUL separated SPDY values.
+    Stream priorities come from `policy`, see PriorityPolicy.
+"""
+import asyncio
+import logging
+import re
+
+from spdy.frames import DEFAULT_VERSION
+from spdy.http import HOP_BY_HOP
+from spdy.pool import ConnectionPool
+
+log = logging.getLogger(__name__)
+
+# Request line plus headers
+MAX_HEADER_SIZE = 64 * 1024
+BODY_CHUNK_SIZE = 64 * 1024
+
+class HTTPError(Exception):
+    """ Malformed HTTP/1.1 request, answered with `status` """
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+
+
+class PriorityPolicy(object):
+    """ Picks the SPDY priority of a request, on the SPDY/3 scale (0 highest,
+        7 lowest; halved for SPDY/2). `rules` are (regex, priority) pairs
+        matched against the path in order, then the path extension is looked
+        up in `extensions`, then `default` applies. Any callable taking
+        (method, path, headers) can be used as a policy instead. """
+
+    EXTENSIONS = {
+        '': 1, 'html': 1, 'htm': 1,
+        'css': 2, 'js': 3,
+        'json': 3, 'xml': 3,
+        'woff': 4, 'woff2': 4, 'ttf': 4,
+        'png': 5, 'jpg': 5, 'jpeg': 5, 'gif': 5, 'svg': 5, 'webp': 5,
+        'ico': 6, 'mp4': 6, 'webm': 6,
+        'zip': 7, 'gz': 7, 'tar': 7,
+    }
+
+    def __init__(self, rules=(), extensions=None, default=4):
+        self.rules = [(re.compile(pattern), priority)
+                      for pattern, priority in rules]
+        self.extensions = self.EXTENSIONS if extensions is None else extensions
+        self.default = default
+
+    def __call__(self, method, path, headers):
+        path = path.partition('?')[0]
+        for pattern, priority in self.rules:
+            if pattern.search(path):
+                return priority
+        name = path.rsplit('/', 1)[-1]
+        extension = name.rsplit('.', 1)[1].lower() if '.' in name else ''
+        return self.extensions.get(extension, self.default)
+
+
+def _connection_tokens(headers):
+    tokens = set()
+    for name, value in headers:
+        if name == 'connection':
+            tokens.update(t.strip().lower() for t in value.split(','))
+    return tokens
+
+async def _read_head(reader):
+    """ (method, target, http_version, [(name, value)]) or None at EOF """
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as exc:
+        if exc.partial.strip():
+            raise HTTPError(400, 'truncated request')
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431, 'request header too large')
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, http_version = lines[0].split(' ')
+    except ValueError:
+        raise HTTPError(400, 'bad request line')
+    if not http_version.startswith('HTTP/1.'):
+        raise HTTPError(505, 'unsupported HTTP version')
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(':')
+        if not sep or not name or name != name.strip():
+            raise HTTPError(400, 'bad header line')
+        headers.append((name.lower(), value.strip()))
+    return method, target, http_version, headers
+
+async def _fixed_body(reader, length):
+    while length:
+        chunk = await reader.read(min(length, BODY_CHUNK_SIZE))
+        if not chunk:
+            raise HTTPError(400, 'truncated body')
+        length -= len(chunk)
+        yield chunk
+
+async def _chunked_body(reader):
+    while True:
+        line = await reader.readline()
+        try:
+            size = int(line.split(b';', 1)[0].strip(), 16)
+        except ValueError:
+            raise HTTPError(400, 'bad chunk size')
+        if size == 0:
+            # trailers are dropped
+            while (await reader.readline()).strip():
+                pass
+            return
+        while size:
+            chunk = await reader.read(min(size, BODY_CHUNK_SIZE))
+            if not chunk:
+                raise HTTPError(400, 'truncated chunk')
+            size -= len(chunk)
+            yield chunk
+        await reader.readexactly(2)
+
+
+class HTTP1Gateway(object):
+
+    def __init__(self, backend_host, backend_port, version=DEFAULT_VERSION,
+                 max_connections=2, policy=None, ssl=None, forwarded_for=True,
+                 **pool_kwargs):
+        """ At most `max_connections` SPDY sessions to the backend; extra
+            kwargs go to the ConnectionPool (and on to every SpdyClient). """
+        self.backend_host = backend_host
+        self.backend_port = backend_port
+        self.version = version
+        self.policy = policy if policy is not None else PriorityPolicy()
+        self.forwarded_for = forwarded_for
+        self.pool = ConnectionPool(max_connections=max_connections, ssl=ssl,
+                                   **pool_kwargs)
+        self.server = None
+        self.client_connections = 0
+        self.requests = 0
+        self.errors = 0
+
+    async def start(self, host=None, port=8080, **kwargs):
+        """ Listens for HTTP/1.1 clients, extra kwargs go to
+            asyncio.start_server() """
+        self.server = await asyncio.start_server(self.handle_client, host, port,
+                                                 limit=MAX_HEADER_SIZE, **kwargs)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.pool.close()
+
+    def stats(self):
+        return {'client_connections': self.client_connections,
+                'requests': self.requests, 'errors': self.errors,
+                'backend': self.pool.stats()}
+
+    def _priority(self, method, path, headers):
+        priority = self.policy(method, path, headers)
+        return priority >> 1 if self.version == 2 else priority
+
+    async def handle_client(self, reader, writer):
+        self.client_connections += 1
+        peer = writer.get_extra_info('peername')
+        try:
+            while True:
+                try:
+                    request = await _read_head(reader)
+                    if request is None:
+                        break
+                    keep_alive = await self._forward(request, reader, writer,
+                                                     peer)
+                except HTTPError as exc:
+                    self.errors += 1
+                    self._simple_response(writer, exc.status, str(exc))
+                    keep_alive = False
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            log.exception('error serving %r', peer)
+        finally:
+            self.client_connections -= 1
+            writer.close()
+
+    def _simple_response(self, writer, status, message):
+        body = message.encode('latin-1') + b'\r\n'
+        writer.write('HTTP/1.1 {0} {1}\r\nContent-Type: text/plain\r\n'
+                     'Content-Length: {2}\r\nConnection: close\r\n\r\n'
+                     .format(status, message, len(body)).encode('latin-1') + body)
+
+    async def _forward(self, request, reader, writer, peer):
+        """ One request/response exchange, returns whether the client
+            connection can be reused """
+        method, target, http_version, headers = request
+        self.requests += 1
+        tokens = _connection_tokens(headers)
+        keep_alive = 'close' not in tokens if http_version == 'HTTP/1.1' \
+                     else 'keep-alive' in tokens
+
+        host = None
+        nv = {}
+        length = None
+        chunked = False
+        for name, value in headers:
+            if name == 'host':
+                host = value
+            elif name == 'content-length':
+                try:
+                    length = int(value)
+                except ValueError:
+                    raise HTTPError(400, 'bad content-length')
+            elif name == 'transfer-encoding':
+                chunked = value.lower().endswith('chunked')
+            elif name in HOP_BY_HOP or name in tokens or name == 'expect':
+                continue
+            elif name in nv:
+                nv[name] = nv[name] + ('; ' if name == 'cookie' else '\0') + value
+            else:
+                nv[name] = value
+        if target.startswith('http://') or target.startswith('https://'):
+            # absolute-form, as sent to proxies
+            host, _, target = target.partition('://')[2].partition('/')
+            target = '/' + target
+        if self.forwarded_for and peer:
+            forwarded = nv.get('x-forwarded-for')
+            nv['x-forwarded-for'] = peer[0] if forwarded is None else \
+                                    forwarded + ', ' + peer[0]
+
+        if chunked:
+            body = _chunked_body(reader)
+        elif length:
+            body = _fixed_body(reader, length)
+        else:
+            body = None
+        if body is not None and ('expect', '100-continue') in headers:
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+
+        try:
+            response = await self.pool.request(
+                self.backend_host, self.backend_port, method, target, nv, body,
+                self._priority(method, target, nv), self.version,
+                host or self.backend_host)
+        except HTTPError:
+            raise
+        except Exception as exc:
+            log.warning('backend request %s %s failed: %r', method, target, exc)
+            self.errors += 1
+            self._simple_response(writer, 502, 'Bad Gateway')
+            return False
+
+        no_body = method == 'HEAD' or response.status in (204, 304) or \
+                  100 <= response.status < 200
+        lines = ['HTTP/1.1 {0} {1}'.format(response.status, response.reason)]
+        framed = no_body
+        for name, value in response.headers.items():
+            if name in HOP_BY_HOP:
+                continue
+            if name == 'content-length':
+                framed = True
+            for part in value.split('\0'):
+                lines.append('{0}: {1}'.format(name, part))
+        use_chunked = not framed and http_version == 'HTTP/1.1'
+        if use_chunked:
+            lines.append('Transfer-Encoding: chunked')
+        elif not framed:
+            keep_alive = False # close delimited
+        if not keep_alive:
+            lines.append('Connection: close')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+        try:
+            if no_body:
+                response.close()
+            else:
+                async for chunk in response:
+                    if use_chunked:
+                        writer.write(b'%x\r\n' % len(chunk))
+                        writer.write(chunk)
+                        writer.write(b'\r\n')
+                    else:
+                        writer.write(chunk)
+                    await writer.drain()
+                if use_chunked:
+                    writer.write(b'0\r\n\r\n')
+        except (ConnectionError, asyncio.CancelledError):
+            response.close()
+            raise
+        except Exception as exc:
+            # headers are out already, all we can do is cut the connection
+            log.warning('backend response %s %s failed: %r', method, target, exc)
+            self.errors += 1
+            return False
+        return keep_alive
@@ -0,0 +1,360 @@
+# coding: utf-8
+""" Closed-loop SPDY load generator: many client Contexts on one selector,
+    each connection keeping `streams` requests in flight for `duration`
+    seconds. Used by the benchmarks; run_parallel() spreads connections over
+    several processes so the client side isn't the bottleneck.
+
+    `address` is a (host, port) pair, or a path for a Unix socket. With an
+    `ssl` SSLContext the connections are TLS, handshaken before the load
+    starts; ssl=True is TLS without certificate checks, for self-signed
+    test servers (and picklable, for run_parallel()). """
+import errno
+import multiprocessing
+import resource
+import selectors
+import socket
+import ssl as _ssl
+import time
+from collections import deque
+
+from spdy.context import Context, CLIENT, SpdyProtocolError
+from spdy.frames import SynStream, WindowUpdate, DEFAULT_VERSION, FLAG_FIN
+from spdy.http import request_headers
+
+READ_SIZE = 256 * 1024
+# Loopback connections per source address, below the ephemeral port range
+CONNECTIONS_PER_SOURCE = 20000
+
+def raise_nofile_limit():
+    """ Raises RLIMIT_NOFILE to the hard limit, returns the new soft limit """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = int(round(p / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+def summarize(latencies, elapsed, requests, errors, bytes_in, cpu=None):
+    """ Result dict with throughput and latency percentiles (milliseconds) """
+    latencies = sorted(latencies)
+    result = {
+        'requests': requests,
+        'errors': errors,
+        'elapsed': elapsed,
+        'req_per_sec': requests / elapsed if elapsed else 0.0,
+        'mb_per_sec': bytes_in / elapsed / 1e6 if elapsed else 0.0,
+    }
+    for name, p in (('p50', 50), ('p90', 90), ('p99', 99), ('p999', 99.9)):
+        value = percentile(latencies, p)
+        result[name + '_ms'] = value * 1000 if value is not None else None
+    if cpu is not None:
+        result['cpu_sec'] = cpu
+        result['cpu_us_per_req'] = cpu / requests * 1e6 if requests else None
+    return result
+
+
+class _Conn(object):
+    def __init__(self, gen, sock):
+        self.gen = gen
+        self.sock = sock
+        self.ctx = Context(CLIENT, gen.version)
+        self.ctx.auto_ping = True
+        self.ctx.set_handlers(on_syn_reply=self._on_syn_reply,
+                              on_data=self._on_data,
+                              on_rst_stream=self._on_rst_stream)
+        self.inflight = {}
+        self.out = deque()
+        self.events = selectors.EVENT_WRITE
+        self.connected = False
+        self.handshaking = False
+
+    def start_request(self):
+        gen = self.gen
+        stream_id = self.ctx.next_stream_id
+        self.ctx.put_frame(SynStream(stream_id, gen.headers, flags=FLAG_FIN,
+                                     version=gen.version))
+        self.inflight[stream_id] = time.perf_counter()
+
+    def _done(self, stream_id, error=False):
+        started = self.inflight.pop(stream_id, None)
+        if started is None:
+            return
+        gen = self.gen
+        if error:
+            gen.errors += 1
+        elif gen.measuring:
+            gen.latencies.append(time.perf_counter() - started)
+            gen.requests += 1
+        if gen.running:
+            self.start_request()
+
+    def _on_syn_reply(self, frame):
+        if frame.fin:
+            self._done(frame.stream_id)
+
+    def _on_data(self, frame):
+        if self.gen.measuring:
+            self.gen.bytes_in += len(frame.data)
+        if self.gen.version >= 3 and frame.data and not frame.fin:
+            self.ctx.put_frame(WindowUpdate(frame.stream_id, len(frame.data),
+                                            version=self.gen.version))
+        if frame.fin:
+            self._done(frame.stream_id)
+
+    def _on_rst_stream(self, frame):
+        self._done(frame.stream_id, error=True)
+
+
+class LoadGenerator(object):
+
+    def __init__(self, address, connections, streams=1, duration=10.0,
+                 warmup=1.0, version=DEFAULT_VERSION, method='GET', path='/',
+                 host='localhost', source_offset=0, ssl=None):
+        self.address = address
+        if ssl is True:
+            ssl = _ssl.create_default_context()
+            ssl.check_hostname = False
+            ssl.verify_mode = _ssl.CERT_NONE
+        self.ssl = ssl
+        self.source_offset = source_offset
+        self.connections = connections
+        self.streams = streams
+        self.duration = duration
+        self.warmup = warmup
+        self.version = version
+        self.host = host
+        self.headers = request_headers(version, method, path, host,
+                                       'https' if ssl else 'http')
+        self.selector = selectors.DefaultSelector()
+        self.conns = []
+        self.running = False
+        self.measuring = False
+        self.latencies = []
+        self.requests = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self._buffer = bytearray(READ_SIZE)
+        self._view = memoryview(self._buffer)
+
+    def _connect_all(self):
+        unix = isinstance(self.address, str)
+        loopback = not unix and (self.address[0].startswith('127.') or
+                                 self.address[0] == 'localhost')
+        for i in range(self.connections):
+            if unix:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.setblocking(False)
+            else:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if loopback:
+                # spread over source addresses to get past the ~28k ephemeral
+                # ports available per (source, destination) pair
+                sock.bind(('127.0.{0}.{1}'.format(1 + self.source_offset,
+                                                  1 + i // CONNECTIONS_PER_SOURCE),
+                           0))
+            err = sock.connect_ex(self.address)
+            if err not in (0, errno.EINPROGRESS, errno.EAGAIN):
+                sock.close()
+                self.errors += 1
+                continue
+            conn = _Conn(self, sock)
+            self.conns.append(conn)
+            self.selector.register(sock, selectors.EVENT_WRITE, conn)
+            if i % 512 == 511: # don't overflow the server's accept backlog
+                self._poll(0)
+
+    def _flush(self, conn):
+        chunks = conn.ctx.outgoing_chunks()
+        if chunks:
+            conn.out.extend(chunks)
+        out = conn.out
+        while out:
+            try:
+                if self.ssl is None:
+                    sent = conn.sock.sendmsg(list(out)[:512])
+                else:
+                    # no sendmsg() on SSLSocket
+                    sent = conn.sock.send(b''.join(list(out)[:512]))
+            except (BlockingIOError, InterruptedError, _ssl.SSLWantReadError,
+                    _ssl.SSLWantWriteError):
+                break
+            except OSError:
+                self._drop(conn)
+                return
+            while sent:
+                if len(out[0]) <= sent:
+                    sent -= len(out.popleft())
+                else:
+                    out[0] = memoryview(out[0])[sent:]
+                    sent = 0
+        events = selectors.EVENT_READ
+        if out:
+            events |= selectors.EVENT_WRITE
+        if events != conn.events:
+            conn.events = events
+            self.selector.modify(conn.sock, events, conn)
+
+    def _drop(self, conn):
+        self.errors += len(conn.inflight) or 1
+        conn.inflight.clear()
+        try:
+            self.selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
+        self.conns.remove(conn)
+
+    def _start_tls(self, conn):
+        self.selector.unregister(conn.sock)
+        conn.sock = self.ssl.wrap_socket(conn.sock, server_hostname=self.host,
+                                         do_handshake_on_connect=False)
+        conn.handshaking = True
+        conn.events = selectors.EVENT_READ | selectors.EVENT_WRITE
+        self.selector.register(conn.sock, conn.events, conn)
+
+    def _handshake(self, conn):
+        """ Advances the TLS handshake, True once it is done """
+        try:
+            conn.sock.do_handshake()
+        except _ssl.SSLWantReadError:
+            events = selectors.EVENT_READ
+        except _ssl.SSLWantWriteError:
+            events = selectors.EVENT_WRITE
+        except OSError:
+            self._drop(conn)
+            return False
+        else:
+            conn.handshaking = False
+            return True
+        if events != conn.events:
+            conn.events = events
+            self.selector.modify(conn.sock, events, conn)
+        return False
+
+    def _connected(self, conn):
+        conn.connected = True
+        if self.running:
+            for _ in range(self.streams):
+                conn.start_request()
+        self._flush(conn)
+
+    def _read(self, conn):
+        """ Reads and dispatches, False if the connection was dropped """
+        sock = conn.sock
+        while True:
+            try:
+                nbytes = sock.recv_into(self._buffer)
+            except (BlockingIOError, InterruptedError, _ssl.SSLWantReadError,
+                    _ssl.SSLWantWriteError):
+                return True
+            except OSError:
+                nbytes = 0
+            if nbytes == 0:
+                self._drop(conn)
+                return False
+            conn.ctx.incoming(self._view[:nbytes])
+            try:
+                conn.ctx.dispatch()
+            except SpdyProtocolError:
+                self._drop(conn)
+                return False
+            # TLS hands out one record per call, the selector won't see the
+            # rest of what OpenSSL already decrypted
+            if self.ssl is None or not sock.pending():
+                return True
+
+    def _poll(self, timeout):
+        for key, mask in self.selector.select(timeout):
+            conn = key.data
+            if conn.handshaking:
+                if self._handshake(conn):
+                    self._connected(conn)
+                continue
+            if not conn.connected:
+                if conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+                    self._drop(conn)
+                    continue
+                if self.ssl is not None:
+                    self._start_tls(conn)
+                    if self._handshake(conn):
+                        self._connected(conn)
+                    continue
+                self._connected(conn)
+                continue
+            if mask & selectors.EVENT_READ and not self._read(conn):
+                continue
+            self._flush(conn)
+
+    def run(self):
+        """ Connects, runs the load and returns summarize()'s dict """
+        self.running = True
+        # requests start as each connection completes, see _poll()
+        self._connect_all()
+
+        start = time.perf_counter()
+        measure_start = start + self.warmup
+        end = measure_start + self.duration
+        cpu_start = None
+        while True:
+            now = time.perf_counter()
+            if not self.measuring and now >= measure_start:
+                self.measuring = True
+                cpu_start = time.process_time()
+            if now >= end:
+                break
+            self._poll(0.05)
+        self.running = False
+        self.measuring = False
+        cpu = time.process_time() - cpu_start if cpu_start is not None else None
+        for conn in list(self.conns):
+            conn.sock.close()
+        self.selector.close()
+        result = summarize(self.latencies, self.duration, self.requests,
+                           self.errors, self.bytes_in, cpu)
+        result['connections'] = len(self.conns)
+        result['latencies'] = self.latencies
+        return result
+
+
+def _worker(queue, args, kwargs):
+    queue.put(LoadGenerator(*args, **kwargs).run())
+
+def _strip(result):
+    del result['latencies']
+    return result
+
+def run_parallel(address, connections, workers=1, **kwargs):
+    """ Runs `workers` LoadGenerator processes sharing `connections` and
+        merges their results """
+    if workers <= 1:
+        return _strip(LoadGenerator(address, connections, **kwargs).run())
+    queue = multiprocessing.Queue()
+    procs = []
+    for i in range(workers):
+        share = connections // workers + (1 if i < connections % workers else 0)
+        worker_kwargs = dict(kwargs, source_offset=i)
+        proc = multiprocessing.Process(target=_worker,
+                                       args=(queue, (address, share),
+                                             worker_kwargs))
+        proc.start()
+        procs.append(proc)
+    results = [queue.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    latencies = []
+    for result in results:
+        latencies.extend(result['latencies'])
+    duration = results[0]['elapsed']
+    merged = summarize(latencies, duration,
+                       sum(r['requests'] for r in results),
+                       sum(r['errors'] for r in results),
+                       sum(r['mb_per_sec'] for r in results) * duration * 1e6,
+                       sum(r.get('cpu_sec') or 0 for r in results))
+    merged['connections'] = sum(r['connections'] for r in results)
+    return merged
@@ -0,0 +1,66 @@
+# coding: utf-8
+""" Process-wide memory budget for connection buffers.
+
+        budget = MemoryBudget(256 * 1024 * 1024)
+        budget.register(ctx, name='10.0.0.1:53211')
+
+    Every registered Context gets an equal share of the budget, split between
+    buffered input and pending output (see Context.set_watermarks()); shares
+    shrink as connections come in, so one client can't take the memory the
+    others need. Contexts are held through weak references. """
+import weakref
+
+class MemoryBudget(object):
+
+    def __init__(self, limit, min_share=64 * 1024):
+        """ `limit` bytes in total; no Context gets less than `min_share` """
+        self.limit = limit
+        self.min_share = min_share
+        self._contexts = weakref.WeakKeyDictionary()
+
+    def __len__(self):
+        return len(self._contexts)
+
+    @property
+    def share(self):
+        """ Bytes each live Context may hold """
+        return max(self.min_share, self.limit // max(1, len(self._contexts)))
+
+    def register(self, ctx, name=None):
+        self._contexts[ctx] = name if name is not None else repr(ctx)
+        ctx.budget = self
+        ctx._watermarks = True
+        ctx._check_watermarks()
+
+    def unregister(self, ctx):
+        self._contexts.pop(ctx, None)
+        if ctx.budget is self:
+            ctx.budget = None
+            ctx.set_watermarks(ctx.input_high_water, ctx.input_low_water,
+                               ctx.output_high_water, ctx.output_low_water)
+
+    def usage(self):
+        """ [(name, input bytes, output bytes, reading_paused)] by usage """
+        rows = []
+        for ctx, name in list(self._contexts.items()):
+            rows.append((name, len(ctx.input_buffer),
+                         ctx.queued_bytes + ctx.unsent_bytes,
+                         ctx.reading_paused))
+        rows.sort(key=lambda row: row[1] + row[2], reverse=True)
+        return rows
+
+    def report(self, top=10):
+        """ Summary dict: totals plus the `top` biggest holders """
+        rows = self.usage()
+        used = sum(row[1] + row[2] for row in rows)
+        return {
+            'limit': self.limit,
+            'contexts': len(rows),
+            'share': self.share,
+            'used': used,
+            'input': sum(row[1] for row in rows),
+            'output': sum(row[2] for row in rows),
+            'paused': sum(1 for row in rows if row[3]),
+            'top': [{'name': name, 'input': inp, 'output': out, 'paused': paused}
+                    for name, inp, out, paused in rows[:top]],
+        }
@@ -0,0 +1,354 @@
+# coding: utf-8
+""" Prometheus-style metrics
+
+        registry = Registry()
+        watch(server.stats, registry)           # connections, frames, RSTs...
+        server = Server(handler, tracer=Tracer(LatencySink(registry)))
+        start_http_server(registry, 9598)       # GET /metrics
+
+    Counters, gauges and histograms live in a Registry; render() writes them
+    in the Prometheus text format. Histogram buckets are allocated when a
+    label set is first used, observe() only bumps a slot. Collectors
+    (add_collector()) produce metrics at scrape time instead, which is how
+    watch() exports spdy.stats counters: nothing extra on the hot path. """
+import bisect
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError: # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from spdy.trace import INTERVALS
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from a local round trip to a slow page
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n') \
+                     .replace('"', r'\"')
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def _format_labels(names, values, extra=None):
+    pairs = ['{0}="{1}"'.format(name, _escape(value))
+             for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append('{0}="{1}"'.format(*extra))
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _CounterValue(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class _HistogramValue(object):
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # one slot per bound, plus +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Metric(object):
+    """ A metric family: one value per label set, see labels() """
+    kind = None
+
+    def __init__(self, name, help='', labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # label values -> value
+        self._values = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def __repr__(self):
+        return '<{0} {1}>'.format(type(self).__name__, self.name)
+
+    def _new_value(self):
+        raise NotImplementedError()
+
+    def labels(self, *values, **kwargs):
+        """ The value for one label set, created on first use: keep it
+            around rather than looking it up for every update """
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        if len(values) != len(self.labelnames):
+            raise ValueError('{0} takes labels {1}'.format(self.name,
+                                                           self.labelnames))
+        value = self._values.get(values)
+        if value is None:
+            with self._lock:
+                value = self._values.setdefault(values, self._new_value())
+        return value
+
+    def _samples(self, labels, value):
+        yield '', None, value.value
+
+    def render(self):
+        lines = []
+        if self.help:
+            lines.append('# HELP {0} {1}'.format(
+                self.name, self.help.replace('\\', r'\\').replace('\n', r'\n')))
+        lines.append('# TYPE {0} {1}'.format(self.name, self.kind))
+        for values, value in sorted(list(self._values.items())):
+            for suffix, extra, number in self._samples(values, value):
+                lines.append('{0}{1}{2} {3}'.format(
+                    self.name, suffix,
+                    _format_labels(self.labelnames, values, extra),
+                    _format_value(number)))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_value(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self._default.value += amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def _new_value(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        self._default.value = value
+
+    def inc(self, amount=1):
+        self._default.value += amount
+
+    def dec(self, amount=1):
+        self._default.value -= amount
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help='', labelnames=(), buckets=LATENCY_BUCKETS):
+        self.bounds = sorted(float(bound) for bound in buckets
+                             if bound != float('inf'))
+        super(Histogram, self).__init__(name, help, labelnames)
+
+    def _new_value(self):
+        return _HistogramValue(self.bounds)
+
+    def _samples(self, labels, value):
+        cumulative = 0
+        for bound, count in zip(self.bounds + [float('inf')], value.counts):
+            cumulative += count
+            yield '_bucket', ('le', _format_value(bound)), cumulative
+        yield '_sum', None, value.sum
+        yield '_count', None, cumulative
+
+    def observe(self, value):
+        self._default.observe(value)
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError('duplicate metric: {0}'.format(metric.name))
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help='', labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help='', labelnames=()):
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help='', labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def add_collector(self, collector):
+        """ `collector()` returns Metrics built fresh at every render() """
+        self._collectors.append(collector)
+
+    def collect(self):
+        metrics = list(self._metrics.values())
+        for collector in self._collectors:
+            metrics.extend(collector())
+        return metrics
+
+    def render(self):
+        """ Everything in the Prometheus text exposition format """
+        return ''.join(metric.render() for metric in
+                       sorted(self.collect(), key=lambda metric: metric.name))
+
+
+def _stats_metrics(stats, prefix):
+    def counter(name, help, labelnames=()):
+        return Counter(prefix + name, help, labelnames)
+    def gauge(name, help, labelnames=()):
+        return Gauge(prefix + name, help, labelnames)
+    metrics = []
+
+    if 'accepted' in stats:
+        metric = counter('_connections_accepted_total', 'Connections accepted')
+        metric.inc(stats['accepted'])
+        metrics.append(metric)
+    if 'requests' in stats:
+        metric = counter('_requests_total', 'Requests handled')
+        metric.inc(stats['requests'])
+        metrics.append(metric)
+    metric = gauge('_connections', 'Open connections')
+    metric.set(stats.get('connections', 0))
+    metrics.append(metric)
+    metric = gauge('_streams', 'Open streams')
+    metric.set(stats.get('streams', 0))
+    metrics.append(metric)
+
+    frames = counter('_frames_total', 'Frames by direction and type',
+                     ('direction', 'type'))
+    frame_bytes = counter('_frame_bytes_total',
+                          'Frame bytes (headers included) by direction and type',
+                          ('direction', 'type'))
+    rst = counter('_rst_stream_total', 'RST_STREAM frames by reason',
+                  ('direction', 'reason'))
+    goaway = counter('_goaway_total', 'GOAWAY frames by status',
+                     ('direction', 'status'))
+    headers = counter('_header_bytes_total',
+                      'Header block bytes before and after compression',
+                      ('direction', 'stage'))
+    ratio = gauge('_header_compression_ratio',
+                  'Compressed / raw header block bytes', ('direction',))
+    for direction in ('in', 'out'):
+        for name, count in stats.get('frames_' + direction, {}).items():
+            frames.labels(direction, name).inc(count)
+        for name, count in stats.get('bytes_' + direction, {}).items():
+            frame_bytes.labels(direction, name).inc(count)
+        for name, count in stats.get('rst_' + direction, {}).items():
+            rst.labels(direction, name).inc(count)
+        for name, count in stats.get('goaway_' + direction, {}).items():
+            goaway.labels(direction, name).inc(count)
+        raw = stats.get('headers_{0}_raw'.format(direction), 0)
+        compressed = stats.get('headers_{0}_compressed'.format(direction), 0)
+        headers.labels(direction, 'raw').inc(raw)
+        headers.labels(direction, 'compressed').inc(compressed)
+        if raw:
+            ratio.labels(direction).set(float(compressed) / raw)
+    metrics.extend([frames, frame_bytes, rst, goaway, headers, ratio])
+
+    codec = counter('_codec_seconds_total', 'Time spent in the frame codec',
+                    ('operation',))
+    for operation in ('parse', 'encode', 'inflate', 'deflate'):
+        codec.labels(operation).inc(stats.get(operation + '_time', 0.0))
+    metrics.append(codec)
+
+    buffers = gauge('_buffered_bytes', 'Bytes waiting in connection buffers',
+                    ('buffer',))
+    peaks = gauge('_buffered_bytes_peak', 'High-water mark of the buffers',
+                  ('buffer',))
+    for name in ('input_buffer', 'queued_bytes', 'unsent_bytes'):
+        buffers.labels(name).set(stats.get(name, 0))
+        peaks.labels(name).set(stats.get(name + '_peak', 0))
+    metrics.extend([buffers, peaks])
+    return metrics
+
+def watch(stats, registry, prefix='spdy'):
+    """ Exports `stats()` (Server.stats(), Context.stats() or an
+        aggregate() of several) on every scrape: connections, streams,
+        frames and bytes by type, RST_STREAM reasons and GOAWAY statuses,
+        header compression, codec time and buffer depths """
+    registry.add_collector(lambda: _stats_metrics(stats(), prefix))
+
+
+class LatencySink(object):
+    """ spdy.trace sink feeding a `<prefix>_stream_seconds` histogram,
+        labelled by interval (see spdy.trace.INTERVALS) """
+
+    def __init__(self, registry, prefix='spdy', buckets=LATENCY_BUCKETS):
+        self.histogram = registry.histogram(prefix + '_stream_seconds',
+                                            'Stream latency by interval',
+                                            ('interval',), buckets)
+        # every label set up front, recording never allocates a bucket
+        self._intervals = dict((name, self.histogram.labels(name))
+                               for name, _, _ in INTERVALS)
+
+    def record(self, trace, ctx=None):
+        intervals = self._intervals
+        for name, seconds in trace.intervals().items():
+            intervals[name].observe(seconds)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, registry, address):
+        HTTPServer.__init__(self, address, _Handler)
+        self.registry = registry
+
+
+def start_http_server(registry, port=9598, host='127.0.0.1'):
+    """ Serves `registry` at http://host:port/metrics from a daemon thread,
+        returns the MetricsServer (shutdown() stops it) """
+    server = MetricsServer(registry, (host, port))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,555 @@
+# coding: utf-8
+""" Deterministic network simulation: two Contexts over a simulated link
+
+        sim = Simulator(seed=1)
+        client, server = connect(sim, Context(CLIENT), Context(SERVER),
+                                 PROFILES['3g'])
+        ...
+        sim.run()
+
+        page_load('3g')             # {'load_time_ms': ..., 'html_ms': ...}
+        bulk_download('transatlantic', size=10 * 1024 * 1024)
+
+    Everything runs on a virtual clock (Simulator.now): events sit in a
+    heap and run in time order, so a page load over a 300 ms link takes
+    milliseconds of CPU and the same seed gives the same result on any
+    machine. Frame processing is instantaneous in virtual time.
+
+    A Link is one direction of the connection. Bytes go out in `mss`
+    segments, one after the other at `bandwidth` bytes per second, and
+    arrive `delay` (half the round trip) plus up to `jitter` later. Lost
+    segments are retransmitted: a lost segment costs the time of one more
+    round trip and of sending it again, and everything behind it waits,
+    as on a TCP connection, so the byte stream is never reordered.
+
+    An Endpoint drains its Context into the link while less than
+    `send_buffer` bytes are waiting there (the socket buffer), then calls
+    `on_writable()` as the link drains; SimServer uses it to pick the next
+    DATA frame by stream priority, which is where prioritization shows.
+
+        python -m spdy.netsim page_load --profile 3g
+        python -m spdy.netsim bulk_download --profile transatlantic --window 1048576
+
+    For CI, the same scenarios run as `python -m spdy.bench netsim`.
+"""
+import argparse
+import heapq
+import itertools
+import json
+import random
+import sys
+from collections import namedtuple
+
+from spdy.context import Context, CLIENT, SERVER
+from spdy.frames import SynStream, SynReply, DataFrame, WindowUpdate, \
+                        Settings, DEFAULT_VERSION, FLAG_FIN, PERSIST_NONE, \
+                        INITIAL_WINDOW_SIZE
+from spdy.http import request_headers, response_headers, parse_request
+from spdy.trace import Tracer
+
+DEFAULT_WINDOW_SIZE = 64 * 1024
+DEFAULT_MSS = 1460
+DEFAULT_SEND_BUFFER = 64 * 1024
+
+def mbps(megabits):
+    """ Megabits per second in bytes per second """
+    return megabits * 1e6 / 8
+
+# rtt and jitter in seconds, downlink (server to client) and uplink in bytes
+# per second, loss as the chance of a segment being lost
+Profile = namedtuple('Profile', 'name rtt downlink uplink jitter loss')
+
+PROFILES = dict((profile.name, profile) for profile in (
+    Profile('loopback', 0.0001, mbps(10000), mbps(10000), 0.0, 0.0),
+    Profile('lan', 0.001, mbps(1000), mbps(1000), 0.0, 0.0),
+    Profile('cable', 0.02, mbps(50), mbps(10), 0.002, 0.0),
+    Profile('lte', 0.07, mbps(12), mbps(6), 0.01, 0.001),
+    Profile('3g', 0.3, mbps(1.6), mbps(0.768), 0.03, 0.005),
+    Profile('transatlantic', 0.2, mbps(10), mbps(10), 0.005, 0.0),
+    Profile('lossy_wifi', 0.04, mbps(20), mbps(20), 0.01, 0.02),
+    Profile('satellite', 0.6, mbps(10), mbps(2), 0.02, 0.001),
+))
+
+
+class Simulator(object):
+    """ Virtual clock and event queue; `random` is the only source of
+        randomness the simulation uses """
+
+    def __init__(self, seed=0):
+        self.now = 0.0
+        self.random = random.Random(seed)
+        self.events = 0
+        self._queue = []
+        # breaks ties between events at the same time, first come first
+        self._order = itertools.count()
+
+    def __repr__(self):
+        return '<Simulator now={0:.6f} pending={1}>'.format(self.now,
+                                                            len(self._queue))
+
+    def clock(self):
+        """ The virtual time, for Tracer(sink, clock=sim.clock) """
+        return self.now
+
+    def at(self, when, callback, *args):
+        heapq.heappush(self._queue, (max(when, self.now), next(self._order),
+                                     callback, args))
+
+    def later(self, delay, callback, *args):
+        self.at(self.now + delay, callback, *args)
+
+    def run(self, until=None):
+        """ Runs events in time order until none are left (returns True) or
+            the next one is later than `until` (returns False) """
+        queue = self._queue
+        while queue:
+            if until is not None and queue[0][0] > until:
+                self.now = until
+                return False
+            when, _, callback, args = heapq.heappop(queue)
+            self.now = when
+            self.events += 1
+            callback(*args)
+        return True
+
+
+class Link(object):
+    """ One direction of a connection, see the module docstring. `deliver`
+        gets the bytes in order, `on_drain` is called as segments leave. """
+
+    def __init__(self, sim, bandwidth, delay, jitter=0.0, loss=0.0,
+                 mss=DEFAULT_MSS):
+        self.sim = sim
+        self.bandwidth = float(bandwidth)
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        self.mss = mss
+        self.deliver = None
+        self.on_drain = None
+        # bytes handed to send() that haven't left yet
+        self.backlog = 0
+        self.bytes_sent = 0
+        self.segments = 0
+        self.lost = 0
+        self._busy_until = 0.0
+        self._last_arrival = 0.0
+
+    def __repr__(self):
+        return '<Link backlog={0} sent={1} lost={2}>'.format(
+            self.backlog, self.bytes_sent, self.lost)
+
+    def send(self, data):
+        sim = self.sim
+        rand = sim.random.random
+        data = bytes(data)
+        for offset in range(0, len(data), self.mss):
+            segment = data[offset:offset + self.mss]
+            size = len(segment)
+            transmit = size / self.bandwidth
+            start = max(self._busy_until, sim.now)
+            self._busy_until = start + transmit
+            arrival = self._busy_until + self.delay
+            if self.jitter:
+                arrival += rand() * self.jitter
+            if self.loss and rand() < self.loss:
+                # noticed a round trip later, then sent again
+                self.lost += 1
+                arrival += 2 * self.delay + transmit
+                self._busy_until += transmit
+            # in order: nothing overtakes a segment still being recovered
+            arrival = max(arrival, self._last_arrival)
+            self._last_arrival = arrival
+            self.backlog += size
+            self.bytes_sent += size
+            self.segments += 1
+            sim.at(self._busy_until, self._left, size)
+            sim.at(arrival, self._arrived, segment)
+
+    def _left(self, size):
+        self.backlog -= size
+        if self.on_drain is not None:
+            self.on_drain()
+
+    def _arrived(self, segment):
+        if self.deliver is not None:
+            self.deliver(segment)
+
+
+class Endpoint(object):
+    """ A Context on one end of a simulated connection: feeds it what
+        arrives, dispatches, and writes its frames to `link` """
+
+    def __init__(self, sim, ctx, link, send_buffer=DEFAULT_SEND_BUFFER):
+        self.sim = sim
+        self.ctx = ctx
+        self.link = link
+        self.send_buffer = send_buffer
+        # called when the link has room and the context nothing queued,
+        # returns True if it queued frames
+        self.on_writable = None
+        self.connected = False
+        link.on_drain = self.flush
+
+    def __repr__(self):
+        return '<Endpoint {0} {1!r}>'.format(self.ctx.side, self.link)
+
+    def received(self, data):
+        self.ctx.incoming(data)
+        self.ctx.dispatch()
+        self.flush()
+
+    def flush(self):
+        if not self.connected:
+            return
+        link = self.link
+        while link.backlog < self.send_buffer:
+            data = self.ctx.outgoing()
+            if data:
+                link.send(data)
+            elif self.on_writable is None or not self.on_writable():
+                break
+
+    def _connected(self):
+        self.connected = True
+        self.flush()
+
+
+def connect(sim, client_ctx, server_ctx, profile, mss=DEFAULT_MSS,
+            send_buffer=DEFAULT_SEND_BUFFER, setup_rtts=1):
+    """ (client Endpoint, server Endpoint) joined by two Links shaped after
+        `profile`. Nothing is sent for `setup_rtts` round trips (1 for the
+        TCP handshake, add 2 for TLS 1.2); frames queued before then wait. """
+    delay = profile.rtt / 2.0
+    down = Link(sim, profile.downlink, delay, profile.jitter, profile.loss,
+                mss)
+    up = Link(sim, profile.uplink, delay, profile.jitter, profile.loss, mss)
+    client = Endpoint(sim, client_ctx, up, send_buffer)
+    server = Endpoint(sim, server_ctx, down, send_buffer)
+    up.deliver = server.received
+    down.deliver = client.received
+    # the client can send with its last handshake packet, the server once
+    # that has arrived
+    sim.later(profile.rtt * setup_rtts, client._connected)
+    sim.later(profile.rtt * setup_rtts + delay, server._connected)
+    return client, server
+
+
+def _body_size(path):
+    try:
+        return int(path.strip('/').split('?')[0])
+    except ValueError:
+        return 0
+
+class _Response(object):
+    __slots__ = ('stream_id', 'priority', 'remaining', 'window')
+
+    def __init__(self, stream_id, priority, remaining, window):
+        self.stream_id = stream_id
+        self.priority = priority
+        self.remaining = remaining
+        self.window = window
+
+
+class SimServer(object):
+    """ Answers GET /<size> with <size> bytes in DATA frames of at most
+        `frame_size`, within the stream's SPDY/3 flow control window. With
+        `prioritize`, each frame goes to the most urgent stream that can
+        send; without it streams are served in the order they came. """
+
+    def __init__(self, endpoint, frame_size=4096, prioritize=True):
+        self.endpoint = endpoint
+        self.ctx = endpoint.ctx
+        self.frame_size = frame_size
+        self.prioritize = prioritize
+        self.initial_window = DEFAULT_WINDOW_SIZE if self.ctx.version >= 3 \
+                              else None
+        # stream_id -> _Response with body left to send
+        self.responses = {}
+        self.requests = 0
+        self.ctx.auto_settings = True
+        self._headers = response_headers(self.ctx.version, 200,
+                                         {'content-type':
+                                          'application/octet-stream'})
+        self.ctx.set_handlers(on_syn_stream=self._on_syn_stream,
+                              on_window_update=self._on_window_update,
+                              on_settings=self._on_settings)
+        endpoint.on_writable = self._writable
+
+    def _on_syn_stream(self, frame):
+        ctx = self.ctx
+        self.requests += 1
+        path = parse_request(ctx.version, frame.headers)[1]
+        size = _body_size(path)
+        ctx.put_frame(SynReply(frame.stream_id, self._headers,
+                               0 if size else FLAG_FIN, version=ctx.version))
+        if size:
+            self.responses[frame.stream_id] = _Response(
+                frame.stream_id, frame.priority, size, self.initial_window)
+
+    def _on_window_update(self, frame):
+        response = self.responses.get(frame.stream_id)
+        if response is not None and response.window is not None:
+            response.window += frame.delta_window_size
+            self.endpoint.flush()
+
+    def _on_settings(self, frame):
+        window = self.ctx.peer_settings.get(INITIAL_WINDOW_SIZE)
+        if window is None or self.initial_window is None:
+            return
+        delta = window - self.initial_window
+        self.initial_window = window
+        for response in self.responses.values():
+            response.window += delta
+        self.endpoint.flush()
+
+    def _writable(self):
+        best = None
+        for response in self.responses.values():
+            if response.window is not None and response.window <= 0:
+                continue
+            key = (response.priority, response.stream_id) if self.prioritize \
+                  else response.stream_id
+            if best is None or key < best[0]:
+                best = (key, response)
+        if best is None:
+            return False
+        response = best[1]
+        size = min(self.frame_size, response.remaining)
+        if response.window is not None:
+            size = min(size, response.window)
+            response.window -= size
+        response.remaining -= size
+        fin = not response.remaining
+        if fin:
+            del self.responses[response.stream_id]
+        self.ctx.put_frame(DataFrame(response.stream_id, b'x' * size,
+                                     FLAG_FIN if fin else 0))
+        return True
+
+
+class Fetch(object):
+    """ One request of a SimClient; times are virtual seconds """
+    __slots__ = ('stream_id', 'path', 'priority', 'on_done', 'started',
+                 'first_byte', 'finished', 'received', 'unacked')
+
+    def __init__(self, stream_id, path, priority, on_done, started):
+        self.stream_id = stream_id
+        self.path = path
+        self.priority = priority
+        self.on_done = on_done
+        self.started = started
+        self.first_byte = None
+        self.finished = None
+        self.received = 0
+        # bytes consumed but not yet given back in a WINDOW_UPDATE
+        self.unacked = 0
+
+    def __repr__(self):
+        return '<Fetch {0} {1}>'.format(self.stream_id, self.path)
+
+
+class SimClient(object):
+    """ Sends GETs and reads the responses, giving the window back in
+        WINDOW_UPDATEs once half of it is used. `window` other than the
+        SPDY/3 default is announced in a SETTINGS frame. """
+
+    def __init__(self, endpoint, window=None, host='sim.example'):
+        self.endpoint = endpoint
+        self.ctx = endpoint.ctx
+        self.sim = endpoint.sim
+        self.host = host
+        self.window = None
+        if self.ctx.version >= 3:
+            self.window = window or DEFAULT_WINDOW_SIZE
+        self.fetches = {}
+        self.done = []
+        self.ctx.set_handlers(on_syn_reply=self._on_syn_reply,
+                              on_data=self._on_data)
+        if self.window is not None and self.window != DEFAULT_WINDOW_SIZE:
+            pairs = {INITIAL_WINDOW_SIZE: (PERSIST_NONE, self.window)}
+            self.ctx.put_frame(Settings(len(pairs), pairs,
+                                        version=self.ctx.version))
+
+    def get(self, path, priority=0, on_done=None):
+        """ Requests `path` now; `on_done(fetch)` runs when it's complete """
+        ctx = self.ctx
+        stream_id = ctx.next_stream_id
+        fetch = self.fetches[stream_id] = Fetch(stream_id, path, priority,
+                                                on_done, self.sim.now)
+        headers = request_headers(ctx.version, 'GET', path, self.host)
+        ctx.put_frame(SynStream(stream_id, headers, priority,
+                                version=ctx.version))
+        self.endpoint.flush()
+        return fetch
+
+    def _on_syn_reply(self, frame):
+        fetch = self.fetches.get(frame.stream_id)
+        if fetch is not None and frame.fin:
+            self._finish(fetch)
+
+    def _on_data(self, frame):
+        fetch = self.fetches.get(frame.stream_id)
+        if fetch is None:
+            return
+        if fetch.first_byte is None:
+            fetch.first_byte = self.sim.now
+        fetch.received += len(frame.data)
+        if frame.fin:
+            self._finish(fetch)
+        elif self.window is not None:
+            fetch.unacked += len(frame.data)
+            if fetch.unacked >= self.window // 2:
+                self.ctx.put_frame(WindowUpdate(frame.stream_id,
+                                                fetch.unacked,
+                                                version=self.ctx.version))
+                fetch.unacked = 0
+
+    def _finish(self, fetch):
+        fetch.finished = self.sim.now
+        del self.fetches[fetch.stream_id]
+        self.done.append(fetch)
+        if fetch.on_done is not None:
+            fetch.on_done(fetch)
+
+
+def _link_stats(client, server):
+    return {
+        'bytes_up': client.link.bytes_sent,
+        'bytes_down': server.link.bytes_sent,
+        'segments_lost': client.link.lost + server.link.lost,
+    }
+
+def _tracer(sim, sink, *contexts):
+    if sink is None:
+        return None
+    tracer = Tracer(sink, sim.clock)
+    for ctx in contexts:
+        ctx.tracer = tracer
+    return tracer
+
+def _profile(profile):
+    return PROFILES[profile] if not isinstance(profile, Profile) else profile
+
+def page_load(profile='3g', version=DEFAULT_VERSION, seed=0, html_size=30000,
+              critical=8, images=24, frame_size=4096, window=None,
+              prioritize=True, send_buffer=DEFAULT_SEND_BUFFER, setup_rtts=1,
+              sink=None):
+    """ A page over one connection: the HTML, then once it's in, `critical`
+        stylesheets and scripts (priority 1) and `images` images (lowest
+        priority) all at once, in a random order. Sizes are drawn from the seed. Returns
+        virtual milliseconds to the HTML, the critical resources and the
+        last image, plus bytes on the wire and segments lost. A trace
+        `sink` (see spdy.trace) gets both sides' streams in virtual time. """
+    profile = _profile(profile)
+    sim = Simulator(seed)
+    client_ctx, server_ctx = Context(CLIENT, version), Context(SERVER, version)
+    tracer = _tracer(sim, sink, client_ctx, server_ctx)
+    client, server = connect(sim, client_ctx, server_ctx, profile,
+                             send_buffer=send_buffer, setup_rtts=setup_rtts)
+    SimServer(server, frame_size, prioritize)
+    browser = SimClient(client, window)
+    lowest = 7 if version >= 3 else 3
+    sizes = [('/{0}'.format(sim.random.randint(5000, 60000)), 1)
+             for _ in range(critical)]
+    sizes += [('/{0}'.format(sim.random.randint(2000, 120000)), lowest)
+              for _ in range(images)]
+    # in document order, scripts and images mixed
+    sim.random.shuffle(sizes)
+    times = {}
+
+    def critical_done(fetch):
+        times['critical'] = max(times.get('critical', 0.0), fetch.finished)
+
+    def html_done(fetch):
+        times['html'] = fetch.finished
+        for path, priority in sizes:
+            browser.get(path, priority,
+                        critical_done if priority == 1 else None)
+
+    sim.at(0.0, browser.get, '/{0}'.format(html_size), 0, html_done)
+    sim.run()
+    if tracer is not None:
+        tracer.flush()
+    result = {
+        'load_time_ms': max(fetch.finished for fetch in browser.done) * 1e3,
+        'html_ms': times['html'] * 1e3,
+        'critical_ms': times.get('critical', times['html']) * 1e3,
+        'requests': len(browser.done),
+        'events': sim.events,
+    }
+    result.update(_link_stats(client, server))
+    return result
+
+def bulk_download(profile='transatlantic', size=10 * 1024 * 1024,
+                  version=DEFAULT_VERSION, seed=0, frame_size=16384,
+                  window=None, send_buffer=256 * 1024, setup_rtts=1,
+                  sink=None):
+    """ One `size` byte response. With SPDY/3 the stream window caps the
+        throughput at window / RTT, see `window`. Returns virtual
+        milliseconds to the first byte and the last, and the goodput. """
+    profile = _profile(profile)
+    sim = Simulator(seed)
+    client_ctx, server_ctx = Context(CLIENT, version), Context(SERVER, version)
+    tracer = _tracer(sim, sink, client_ctx, server_ctx)
+    client, server = connect(sim, client_ctx, server_ctx, profile,
+                             send_buffer=send_buffer, setup_rtts=setup_rtts)
+    SimServer(server, frame_size)
+    downloader = SimClient(client, window)
+    sim.at(0.0, downloader.get, '/{0}'.format(size))
+    sim.run()
+    if tracer is not None:
+        tracer.flush()
+    fetch = downloader.done[0]
+    # an empty body ends with the SYN_REPLY, no first byte
+    first_byte = fetch.first_byte
+    result = {
+        'load_time_ms': fetch.finished * 1e3,
+        'first_byte_ms': first_byte * 1e3 if first_byte is not None else None,
+        'mbps': fetch.received * 8 / 1e6 / (fetch.finished - first_byte)
+                if first_byte is not None and fetch.finished > first_byte
+                else None,
+        'events': sim.events,
+    }
+    result.update(_link_stats(client, server))
+    return result
+
+SCENARIOS = {
+    'page_load': page_load,
+    'bulk_download': bulk_download,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m spdy.netsim',
+                                     description='simulated network runs')
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--profile', choices=sorted(PROFILES))
+    parser.add_argument('--version', type=int, default=DEFAULT_VERSION)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--frame-size', type=int)
+    parser.add_argument('--window', type=int,
+                        help='SPDY/3 stream window the client announces')
+    parser.add_argument('--setup-rtts', type=int, default=1,
+                        help='round trips before the first frame (3 for TLS)')
+    parser.add_argument('--size', type=int,
+                        help='response size (bulk_download)')
+    parser.add_argument('--no-priority', action='store_true',
+                        help='serve streams in arrival order (page_load)')
+    args = parser.parse_args(argv)
+
+    kwargs = {'version': args.version, 'seed': args.seed,
+              'window': args.window, 'setup_rtts': args.setup_rtts}
+    for name in ('profile', 'frame_size', 'size'):
+        if getattr(args, name) is not None:
+            kwargs[name] = getattr(args, name)
+    if args.scenario == 'page_load':
+        kwargs.pop('size', None)
+        kwargs['prioritize'] = not args.no_priority
+    result = SCENARIOS[args.scenario](**kwargs)
+    json.dump(result, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+# coding: utf-8
+""" Per-origin pool of SPDY client sessions (Python 3.7+)
+
+        pool = ConnectionPool()
+        response = await pool.request('localhost', 9599, 'GET', '/')
+        body = await response.read()
+
+    Connections are keyed by (host, port, version). A request goes to the
+    connection with the lowest open streams / MAX_CONCURRENT_STREAMS ratio
+    (lowest smoothed RTT breaks ties); a new connection is only opened when all
+    of them are saturated. Connections that received a GOAWAY, ran out of
+    stream ids or lost their transport are retired.
+"""
+import asyncio
+
+from spdy.client import SpdyClient
+from spdy.frames import DEFAULT_VERSION
+
+class _Origin(object):
+    def __init__(self):
+        self.clients = []
+        self.connecting = 0
+        self.connect_waiters = []
+        self.opened = 0
+        self.retired = 0
+        self.requests = 0
+        self.saturated = 0
+
+class ConnectionPool(object):
+
+    def __init__(self, max_connections=4, default_max_streams=100, ssl=None,
+                 **client_kwargs):
+        """ `max_connections` per origin; `default_max_streams` is assumed
+            until the server announces MAX_CONCURRENT_STREAMS. Extra kwargs
+            go to every SpdyClient (keepalive, settings...). """
+        self.max_connections = max_connections
+        self.default_max_streams = default_max_streams
+        self.ssl = ssl
+        self.client_kwargs = client_kwargs
+        self._origins = {}
+
+    def _usable(self, client):
+        ctx = client.protocol.ctx
+        return not client.closed and ctx.goaway_received is None and \
+               not ctx.shutting_down and ctx.stream_ids_left > 0
+
+    def _capacity(self, client):
+        limit = client.max_streams
+        if limit is None:
+            limit = self.default_max_streams
+        return limit
+
+    def _retire(self, origin):
+        for client in list(origin.clients):
+            if self._usable(client):
+                continue
+            origin.clients.remove(client)
+            origin.retired += 1
+            if not client.closed:
+                # let in-flight streams finish, the transport closes when drained
+                client.protocol.shutdown()
+
+    def _load(self, client):
+        """ Open streams / capacity, full (1.0 or more) when the server
+            allows no stream at all """
+        capacity = self._capacity(client)
+        if capacity <= 0:
+            return float('inf')
+        return float(client.open_streams) / capacity
+
+    def _pick(self, origin):
+        best = None
+        best_key = None
+        for client in origin.clients:
+            load = self._load(client)
+            if load >= 1.0:
+                continue
+            srtt = client.protocol.ctx.srtt
+            key = (load, srtt if srtt is not None else 0)
+            if best is None or key < best_key:
+                best, best_key = client, key
+        return best
+
+    async def acquire(self, host, port, version=DEFAULT_VERSION):
+        """ Returns the SpdyClient a request to this origin should use """
+        key = (host, port, version)
+        origin = self._origins.get(key)
+        if origin is None:
+            origin = self._origins[key] = _Origin()
+        while True:
+            self._retire(origin)
+            client = self._pick(origin)
+            if client is not None:
+                return client
+            # wait for a connection on its way if it will have room for this
+            # request, or if there's no connection to queue on yet
+            if origin.connecting and (not origin.clients or
+                    len(origin.connect_waiters) <
+                    origin.connecting * self.default_max_streams):
+                waiter = asyncio.get_event_loop().create_future()
+                origin.connect_waiters.append(waiter)
+                await waiter
+                continue
+            break
+        if len(origin.clients) + origin.connecting < self.max_connections:
+            origin.connecting += 1
+            try:
+                client = SpdyClient(host, port, version, ssl=self.ssl,
+                                    **self.client_kwargs)
+                await client.connect()
+                client.protocol.ping() # first RTT sample, for _pick()
+                origin.clients.append(client)
+                origin.opened += 1
+            finally:
+                origin.connecting -= 1
+                waiters, origin.connect_waiters = origin.connect_waiters, []
+                for waiter in waiters:
+                    waiter.set_result(None)
+            return client
+        if not origin.clients:
+            raise ValueError('max_connections must be at least 1')
+        # Everything saturated and no room for more connections: queue on the
+        # least loaded one, its SpdyClient waits for a free stream
+        origin.saturated += 1
+        return min(origin.clients, key=self._load)
+
+    async def request(self, host, port, method, path, headers=None, body=None,
+                      priority=None, version=DEFAULT_VERSION,
+                      authority=None):
+        """ `authority` is the host sent in the request, `host` by default """
+        client = await self.acquire(host, port, version)
+        self._origins[(host, port, version)].requests += 1
+        return await client.request(method, path, headers, body, priority,
+                                    authority)
+
+    def stats(self):
+        """ Pool metrics, per origin 'host:port/spdyN' """
+        out = {}
+        for (host, port, version), origin in self._origins.items():
+            self._retire(origin)
+            out['{0}:{1}/spdy{2}'.format(host, port, version)] = {
+                'connections': len(origin.clients),
+                'connecting': origin.connecting,
+                'open_streams': sum(c.open_streams for c in origin.clients),
+                'max_streams': sum(self._capacity(c) for c in origin.clients),
+                'opened': origin.opened,
+                'retired': origin.retired,
+                'requests': origin.requests,
+                'saturated': origin.saturated,
+                'srtt': [c.protocol.ctx.srtt for c in origin.clients],
+            }
+        return out
+
+    async def close(self):
+        clients = [c for origin in self._origins.values() for c in origin.clients]
+        self._origins.clear()
+        await asyncio.gather(*[c.close() for c in clients])
@@ -0,0 +1,263 @@
+# coding: utf-8
+""" Pre-fork mode for spdy.server: N worker processes, each running its own
+    Server loop on a SO_REUSEPORT socket so the kernel spreads connections
+    across them (Linux 3.9+, BSD).
+
+        PreforkServer(handler, port=9599, workers=4).serve_forever()
+
+    Supervisor signals:
+        SIGHUP           rolling restart: a new worker is started, then the
+                         old one drains its streams behind a GOAWAY and exits
+        SIGTERM, SIGINT  graceful stop of every worker
+
+    Workers report their counters every `stats_interval` seconds over a pipe;
+    stats() aggregates the latest report of each one.
+
+    A worker that dies unexpectedly is replaced. Workers dying within
+    `min_uptime` of their start (bind errors, import errors...) are
+    replaced after a delay that doubles at each such crash, up to
+    `max_respawn_delay`.
+"""
+import errno
+import json
+import logging
+import os
+import select
+import signal
+import time
+
+from spdy.server import Server
+
+log = logging.getLogger(__name__)
+
+# First delay before replacing a worker that crashed soon after starting
+RESPAWN_DELAY = 0.1
+
+class PreforkServer(object):
+
+    def __init__(self, handler, host='', port=9599, workers=None,
+                 stats_interval=1.0, graceful_timeout=30.0, on_stats=None,
+                 min_uptime=5.0, max_respawn_delay=30.0, **server_kwargs):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.stats_interval = stats_interval
+        self.graceful_timeout = graceful_timeout
+        self.on_stats = on_stats
+        self.min_uptime = min_uptime
+        self.max_respawn_delay = max_respawn_delay
+        self.server_kwargs = server_kwargs
+        self.children = {}   # pid -> generation
+        self.started = {}    # pid -> start time
+        self.retiring = {}   # pid -> SIGTERM time
+        self.worker_stats = {}
+        self.generation = 0
+        self.restarts = 0
+        self.crashes = 0
+        # times at which to replace crashed workers, and the current delay
+        self._respawns = []
+        self._respawn_delay = 0.0
+        self._signals = []
+        self._stats_r = self._stats_w = None
+        self._wake_r = self._wake_w = None
+        self._partial = b''
+
+    # Worker side
+
+    def _worker_main(self):
+        for sig in (signal.SIGHUP, signal.SIGINT):
+            signal.signal(sig, signal.SIG_IGN)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.set_wakeup_fd(-1)
+        os.close(self._stats_r)
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+        server = Server(self.handler, self.host, self.port, reuse_port=True,
+                        **self.server_kwargs)
+        started = time.time()
+
+        def report():
+            streams = sum(len(c.ctx.streams) for c in server.connections.values())
+            line = json.dumps({'pid': os.getpid(), 'uptime': time.time() - started,
+                               'connections': len(server.connections),
+                               'streams': streams, 'accepted': server.accepted,
+                               'requests': server.requests,
+                               'draining': server._shutting_down})
+            try:
+                os.write(self._stats_w, line.encode('ascii') + b'\n')
+            except OSError:
+                pass
+
+        # shutdown() touches the selector, it runs from the loop rather
+        # than from the signal handler
+        terminated = []
+        def terminate(signum, frame):
+            terminated.append(signum)
+            server.wakeup()
+        signal.signal(signal.SIGTERM, terminate)
+
+        server.add_timer(self.stats_interval, report)
+        try:
+            while not (server._shutting_down and not server.connections):
+                if terminated and not server._shutting_down:
+                    server.shutdown()
+                server.run_once(server._timeout())
+            report()
+        finally:
+            server.close()
+
+    # Supervisor side
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self._worker_main()
+                status = 0
+            except BaseException:
+                log.exception('worker %i crashed', os.getpid())
+            finally:
+                os._exit(status)
+        self.children[pid] = self.generation
+        self.started[pid] = time.time()
+        log.info('started worker %i (generation %i)', pid, self.generation)
+        return pid
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def _read_stats(self):
+        try:
+            data = os.read(self._stats_r, 65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        for line in lines:
+            report = json.loads(line.decode('ascii'))
+            self.worker_stats[report['pid']] = report
+        if self.on_stats is not None:
+            self.on_stats(self.stats())
+
+    def _reap(self, stopping):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.children.pop(pid, None)
+            self.worker_stats.pop(pid, None)
+            started = self.started.pop(pid, None)
+            if self.retiring.pop(pid, None) is None and not stopping:
+                self._respawn(pid, status, started)
+
+    def _respawn(self, pid, status, started):
+        now = time.time()
+        if started is not None and now - started >= self.min_uptime:
+            self._respawn_delay = 0.0
+        else:
+            self.crashes += 1
+            self._respawn_delay = min(self.max_respawn_delay,
+                                      self._respawn_delay * 2 or RESPAWN_DELAY)
+        log.warning('worker %i died (status %i), respawning in %.1fs', pid,
+                    status, self._respawn_delay)
+        self._respawns.append(now + self._respawn_delay)
+        self._spawn_due()
+
+    def _spawn_due(self):
+        now = time.time()
+        due = [when for when in self._respawns if when <= now]
+        self._respawns = [when for when in self._respawns if when > now]
+        for _ in due:
+            self._spawn()
+
+    def _kill_stale(self):
+        now = time.time()
+        for pid, since in list(self.retiring.items()):
+            if now - since > self.graceful_timeout:
+                log.warning('worker %i did not drain in time, killing it', pid)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+    def _retire(self, pid):
+        self.retiring[pid] = time.time()
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError as exc:
+            if exc.errno != errno.ESRCH:
+                raise
+
+    def restart(self):
+        """ Rolling restart: every old worker is replaced by a fresh one that
+            is already accepting before the old one starts draining """
+        self.generation += 1
+        self.restarts += 1
+        for pid in [p for p, gen in self.children.items()
+                    if gen < self.generation and p not in self.retiring]:
+            self._spawn()
+            self._retire(pid)
+
+    def stats(self):
+        """ Totals over the last report of every live worker """
+        reports = list(self.worker_stats.values())
+        total = {'workers': len(self.children), 'retiring': len(self.retiring),
+                 'restarts': self.restarts, 'crashes': self.crashes}
+        for key in ('connections', 'streams', 'accepted', 'requests'):
+            total[key] = sum(r[key] for r in reports)
+        total['per_worker'] = dict((r['pid'], r) for r in reports)
+        return total
+
+    def serve_forever(self):
+        self._stats_r, self._stats_w = os.pipe()
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in (self._stats_r, self._wake_r, self._wake_w):
+            os.set_blocking(fd, False)
+        signal.set_wakeup_fd(self._wake_w)
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT,
+                    signal.SIGCHLD):
+            signal.signal(sig, self._on_signal)
+
+        for _ in range(self.workers):
+            self._spawn()
+
+        stopping = False
+        try:
+            while self.children or self._respawns:
+                timeout = 1.0
+                if self._respawns:
+                    timeout = max(0.0, min(timeout, min(self._respawns) -
+                                                    time.time()))
+                ready, _, _ = select.select([self._stats_r, self._wake_r],
+                                            [], [], timeout)
+                if self._wake_r in ready:
+                    try:
+                        os.read(self._wake_r, 4096)
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                if self._stats_r in ready:
+                    self._read_stats()
+                signals, self._signals = self._signals, []
+                for signum in signals:
+                    if signum == signal.SIGHUP and not stopping:
+                        self.restart()
+                    elif signum in (signal.SIGTERM, signal.SIGINT) and \
+                            not stopping:
+                        stopping = True
+                        self._respawns = []
+                        for pid in list(self.children):
+                            self._retire(pid)
+                self._reap(stopping)
+                if self._respawns and not stopping:
+                    self._spawn_due()
+                self._kill_stale()
+        finally:
+            signal.set_wakeup_fd(-1)
+            for fd in (self._stats_r, self._stats_w, self._wake_r, self._wake_w):
+                os.close(fd)
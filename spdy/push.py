@@ -0,0 +1,124 @@
+# coding: utf-8
+""" Client side cache of server pushed streams (SYN_STREAM with FLAG_UNID) """
+from spdy.frames import SynStream, Headers, RstStream, DataFrame, \
+                        DEFAULT_VERSION, FLAG_FIN, REFUSED_STREAM
+
+def resource_url(version, headers):
+    """ Absolute URL of a request or pushed resource, from its n/v headers.
+        Returns None if the headers don't identify a resource. """
+    if version == 2:
+        url = headers.get('url')
+        if url is None:
+            return None
+        if '://' in url: # pushed streams carry absolute urls in v2
+            return url
+        host = headers.get('host')
+        if host is None:
+            return None
+        return '{0}://{1}{2}'.format(headers.get('scheme', 'https'), host, url)
+    else:
+        path = headers.get(':path')
+        host = headers.get(':host')
+        if path is None or host is None:
+            return None
+        return '{0}://{1}{2}'.format(headers.get(':scheme', 'https'), host, path)
+
+class PushedResource(object):
+    def __init__(self, stream_id, assoc_stream_id, headers):
+        self.stream_id = stream_id
+        self.assoc_stream_id = assoc_stream_id
+        self.headers = dict(headers)
+        self.data = bytearray()
+        self.complete = False
+
+    def __repr__(self):
+        return 'PUSHED id={0} assoc={1} ({2}{3})'.format(self.stream_id,
+                    self.assoc_stream_id, len(self.data),
+                    '' if self.complete else '+')
+
+class PushCache(object):
+    """ Collects pushed streams so later requests can be answered locally.
+
+        Feed every received frame to handle_frame(); frames belonging to
+        pushed streams are consumed. Before sending a request, lookup() its
+        headers: a hit means the server already pushed (or is pushing) it.
+
+        Pushes that can't be kept (cache full, no URL) are dropped: their
+        frames are still consumed, and with `ctx` set they are refused with
+        RST_STREAM(REFUSED_STREAM) on it so the server stops sending them. """
+
+    def __init__(self, version=DEFAULT_VERSION, max_entries=256, ctx=None):
+        self.version = version
+        self.max_entries = max_entries
+        self.ctx = ctx
+        self._by_url = {}
+        self._by_stream = {}
+        # stream ids of dropped pushes whose frames may still come, oldest
+        # first (a refused stream may never send its FIN)
+        self._dropped = {}
+        self.dropped = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._by_url)
+
+    def handle_frame(self, frame):
+        """ Returns True if the frame belonged to a pushed stream """
+        if isinstance(frame, SynStream):
+            if not frame.unidirectional or not frame.assoc_stream_id:
+                return False
+            url = resource_url(self.version, frame.headers)
+            if url is None or len(self._by_url) >= self.max_entries:
+                self._drop(frame)
+                return True
+            resource = PushedResource(frame.stream_id, frame.assoc_stream_id,
+                                      frame.headers)
+            resource.complete = frame.fin
+            self._by_url[url] = resource
+            if not frame.fin:
+                self._by_stream[frame.stream_id] = resource
+            return True
+
+        stream_id = getattr(frame, 'stream_id', None)
+        if stream_id in self._dropped:
+            if isinstance(frame, RstStream) or frame.flags & FLAG_FIN:
+                del self._dropped[stream_id]
+            return True
+        resource = self._by_stream.get(stream_id)
+        if resource is None:
+            return False
+        if isinstance(frame, DataFrame):
+            resource.data.extend(frame.data)
+            if frame.fin:
+                resource.complete = True
+                del self._by_stream[frame.stream_id]
+        elif isinstance(frame, Headers):
+            resource.headers.update(frame.headers)
+        elif isinstance(frame, RstStream):
+            del self._by_stream[frame.stream_id]
+            for url, res in list(self._by_url.items()):
+                if res is resource:
+                    del self._by_url[url]
+        return True
+
+    def _drop(self, frame):
+        self.dropped += 1
+        if frame.fin:
+            return
+        self._dropped[frame.stream_id] = True
+        if len(self._dropped) > self.max_entries:
+            del self._dropped[next(iter(self._dropped))]
+        if self.ctx is not None:
+            self.ctx.put_frame(RstStream(frame.stream_id, REFUSED_STREAM,
+                                         version=self.version))
+
+    def lookup(self, headers):
+        """ Pops the PushedResource matching these request headers, if any.
+            It may still be incomplete; further DATA keeps filling it. """
+        resource = self._by_url.pop(resource_url(self.version, headers), None)
+        if resource is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return resource
@@ -0,0 +1,588 @@
+# coding: utf-8
+""" Non-blocking SPDY server engine: many Contexts per thread on top of the
+    selectors module (epoll on Linux, kqueue on BSD).
+
+        def handler(request):
+            request.respond(200, {'content-type': 'text/plain'}, b'hello')
+
+        Server(handler, port=9599).serve_forever()
+
+    `handler(request)` runs on the server thread once the request body is
+    complete (the client sent FIN); it must not block. A request may also be
+    answered later with respond_start()/write()/finish(), from the server
+    thread. Handlers that hand the work to a thread pool answer from there
+    with server.call_soon_threadsafe(request.respond, status, headers, body);
+    Contexts also take frames from any thread (Context.put_frame_threadsafe).
+"""
+import errno
+import logging
+import selectors
+import socket
+from collections import deque
+
+from spdy.cache import revalidate
+from spdy.context import Context, SERVER, SpdyProtocolError, _clock
+from spdy.frames import SynReply, RstStream, Settings, DataFrame, \
+                        WindowUpdate, DEFAULT_VERSION, FLAG_FIN, INTERNAL_ERROR, \
+                        PERSIST_NONE, INITIAL_WINDOW_SIZE
+from spdy.http import parse_request, response_headers
+from spdy.stats import aggregate
+from spdy.waker import Waker
+
+log = logging.getLogger(__name__)
+
+READ_SIZE = 256 * 1024
+# recv() calls per readiness event before giving other connections a turn
+READS_PER_EVENT = 4
+# sendmsg() buffers per call, below IOV_MAX
+MAX_IOV = 512
+MAX_DATA_FRAME_SIZE = 16 * 1024
+# SPDY/3 flow control window of every stream until SETTINGS says otherwise
+DEFAULT_WINDOW_SIZE = 64 * 1024
+
+class Request(object):
+    """ A request received on a stream """
+
+    def __init__(self, conn, frame):
+        self.conn = conn
+        self.stream_id = frame.stream_id
+        self.priority = frame.priority
+        self.nv = frame.headers
+        self.method, self.path, self.host, self.scheme, self.http_version, \
+            self.headers = parse_request(conn.ctx.version, frame.headers)
+        self.body = bytearray()
+        self.received = _clock()
+        self.started = False
+        self.finished = False
+        self.reset_by_peer = False
+        # Body data waiting for the SPDY/3 flow control window
+        self._pending = deque()
+        self._pending_fin = False
+        self._window = conn.initial_window
+
+    def __repr__(self):
+        return '<Request id={0} {1} {2}>'.format(self.stream_id, self.method,
+                                                 self.path)
+
+    def respond_start(self, status, headers=None):
+        if self.reset_by_peer:
+            return
+        ctx = self.conn.ctx
+        ctx.put_frame(SynReply(self.stream_id,
+                               response_headers(ctx.version, status, headers),
+                               version=ctx.version))
+        self.started = True
+
+    def write(self, data, fin=False):
+        """ Queues body data; it is framed and sent as the client's flow
+            control window allows """
+        if self.finished:
+            return
+        if len(data):
+            self._pending.append(memoryview(data))
+        if fin:
+            self.finished = True
+            self._pending_fin = True
+        self.conn._send(self)
+
+    def finish(self):
+        self.write(b'', fin=True)
+
+    def respond(self, status, headers=None, body=b''):
+        """ Sends a whole response: SYN_REPLY plus the body in DATA frames.
+            With a Server cache, cacheable responses are stored on the way. """
+        cache = self.conn.server.cache
+        if cache is not None and not self.started:
+            entry = cache.put(self.method, self.host, self.path, self.headers,
+                              status, headers, body)
+            if entry is not None:
+                self.respond_cached(entry)
+                return
+        self.respond_start(status, headers)
+        self.write(body, fin=True)
+
+    def respond_cached(self, entry):
+        """ Sends a spdy.cache.CachedResponse """
+        if self.reset_by_peer:
+            return
+        ctx = self.conn.ctx
+        ctx.put_frame(SynReply(self.stream_id, entry.nv(ctx.version),
+                               version=ctx.version))
+        self.started = True
+        self.write(entry.body if self.method != 'HEAD' else b'', fin=True)
+
+    def reset(self, error_code=INTERNAL_ERROR):
+        if self.reset_by_peer or self.conn.requests.get(self.stream_id) is not self:
+            return
+        ctx = self.conn.ctx
+        ctx.put_frame(RstStream(self.stream_id, error_code, version=ctx.version))
+        self.finished = True
+        self._pending.clear()
+        self.conn.requests.pop(self.stream_id, None)
+        self.conn.server._want_flush(self.conn)
+
+
+class Connection(object):
+    """ One client connection: socket, Context and pending output """
+
+    def __init__(self, server, sock, address):
+        self.server = server
+        self.sock = sock
+        self.fileno = sock.fileno()
+        self.address = address
+        self.ctx = Context(SERVER, server.version, server.dictionary)
+        self.ctx.auto_ping = True
+        self.ctx.auto_settings = True
+        self.ctx.set_handlers(on_syn_stream=self._on_syn_stream,
+                              on_data=self._on_data,
+                              on_rst_stream=self._on_rst_stream,
+                              on_window_update=self._on_window_update,
+                              on_settings=self._on_settings)
+        self.initial_window = DEFAULT_WINDOW_SIZE if server.version >= 3 \
+                              else None
+        self.requests = {}
+        self.out = deque()
+        self.out_bytes = 0
+        self.events = selectors.EVENT_READ
+        self.closed = False
+
+    def __repr__(self):
+        return '<Connection {0} streams={1} out={2}>'.format(self.address,
+                    len(self.ctx.streams), self.out_bytes)
+
+    def _on_syn_stream(self, frame):
+        request = Request(self, frame)
+        self.requests[frame.stream_id] = request
+        if frame.fin:
+            self.server._handle(request)
+
+    def _on_data(self, frame):
+        request = self.requests.get(frame.stream_id)
+        if request is None:
+            return
+        request.body.extend(frame.data)
+        if self.initial_window is not None and frame.data and not frame.fin:
+            self.ctx.put_frame(WindowUpdate(frame.stream_id, len(frame.data),
+                                            version=self.ctx.version))
+        if not frame.fin:
+            return
+        if not request.finished:
+            self.server._handle(request)
+        elif not request._pending:
+            # answered before the upload was over
+            self.requests.pop(frame.stream_id, None)
+
+    def _on_rst_stream(self, frame):
+        request = self.requests.pop(frame.stream_id, None)
+        if request is not None:
+            request.finished = True
+            request.reset_by_peer = True
+            request._pending.clear()
+
+    def _on_window_update(self, frame):
+        request = self.requests.get(frame.stream_id)
+        if request is not None and request._window is not None:
+            request._window += frame.delta_window_size
+            self._send(request)
+
+    def _on_settings(self, frame):
+        window = self.ctx.peer_settings.get(INITIAL_WINDOW_SIZE)
+        if window is None or self.initial_window is None:
+            return
+        delta = window - self.initial_window
+        self.initial_window = window
+        for request in list(self.requests.values()):
+            request._window += delta
+            self._send(request)
+
+    def _send(self, request):
+        """ Moves a request's pending body into the context """
+        put_frame = self.ctx.put_frame
+        stream_id = request.stream_id
+        pending = request._pending
+        while pending:
+            window = request._window
+            if window is not None and window <= 0:
+                break
+            data = pending.popleft()
+            size = MAX_DATA_FRAME_SIZE if window is None else \
+                   min(MAX_DATA_FRAME_SIZE, window)
+            if len(data) > size:
+                pending.appendleft(data[size:])
+                data = data[:size]
+            if window is not None:
+                request._window -= len(data)
+            fin = request._pending_fin and not pending
+            put_frame(DataFrame(stream_id, data, FLAG_FIN if fin else 0))
+            if fin:
+                request._pending_fin = False
+        if request._pending_fin and not pending:
+            request._pending_fin = False
+            put_frame(DataFrame(stream_id, b'', FLAG_FIN))
+        # kept until the upload is over too, its DATA still needs
+        # WINDOW_UPDATEs
+        if request.finished and not pending and \
+                stream_id not in self.ctx.streams:
+            self.requests.pop(stream_id, None)
+        self.server._want_flush(self)
+
+
+class Server(object):
+    """ Accepts SPDY connections (plain TCP, put TLS in front of it) and calls
+        `handler(request)` for every complete request. """
+
+    def __init__(self, handler, host='', port=9599, version=DEFAULT_VERSION,
+                 sock=None, backlog=1024, settings=None, keepalive=None,
+                 write_high_water=1024 * 1024, reuse_port=False,
+                 memory_budget=None, cache=None, tracer=None, capture=None,
+                 dictionary=None):
+        """ A connection stops being read while its pending output is over
+            `write_high_water`, or over its share of `memory_budget` (a
+            spdy.memory.MemoryBudget) if one is given. `cache` is an optional
+            spdy.cache.ResponseCache answering requests before `handler`.
+            `tracer` (a spdy.trace.Tracer) records every stream's timeline,
+            `capture` (a spdy.capture.Recorder) the raw traffic.
+            `dictionary` is a header compression dictionary shared with the
+            clients, see spdy.dictionary. """
+        self.handler = handler
+        self.version = version
+        self.settings = settings
+        self.keepalive = keepalive
+        self.write_high_water = write_high_water
+        self.memory_budget = memory_budget
+        self.cache = cache
+        self.tracer = tracer
+        self.capture = capture
+        self.dictionary = dictionary
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((host, port))
+            sock.listen(backlog)
+        sock.setblocking(False)
+        self.sock = sock
+        self.address = sock.getsockname()
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(sock, selectors.EVENT_READ, None)
+        # wakeup() interrupts select() (signals, other threads)
+        self._waker = Waker()
+        self.selector.register(self._waker, selectors.EVENT_READ, self)
+        # Filled by other threads: callbacks to run and connections to flush
+        self._callbacks = deque()
+        self._threadsafe_flush = deque()
+        self._timers = []
+        self.connections = {}
+        self._flush = set()
+        self._buffer = bytearray(READ_SIZE)
+        self._view = memoryview(self._buffer)
+        self._running = False
+        self._shutting_down = False
+        self._next_keepalive = None
+        self.accepted = 0
+        self.requests = 0
+        # Counters of the connections already closed, see stats()
+        self._closed_stats = None
+
+    # Main loop
+
+    def serve_forever(self):
+        self._running = True
+        try:
+            while self._running:
+                self.run_once(self._timeout())
+        finally:
+            self.close()
+
+    def run_once(self, timeout=None):
+        for key, mask in self.selector.select(timeout):
+            conn = key.data
+            if conn is None:
+                self._accept()
+                continue
+            if conn is self:
+                self._waker.drain()
+                self._run_callbacks()
+                continue
+            if mask & selectors.EVENT_WRITE:
+                self._write(conn)
+            if mask & selectors.EVENT_READ and not conn.closed:
+                self._read(conn)
+        if self.keepalive:
+            self._check_keepalive()
+        if self._timers:
+            self._run_timers()
+        self._flush_pending()
+        if self._shutting_down and not self.connections:
+            self._running = False
+
+    def _timeout(self):
+        deadlines = [timer[0] for timer in self._timers]
+        if self.keepalive:
+            if self._next_keepalive is None:
+                deadlines.append(_clock() + self.keepalive[0])
+            else:
+                deadlines.append(self._next_keepalive)
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - _clock())
+
+    def add_timer(self, interval, callback):
+        """ Calls callback() every `interval` seconds from the server loop """
+        self._timers.append([_clock() + interval, interval, callback])
+
+    def _run_timers(self):
+        now = _clock()
+        for timer in self._timers:
+            if timer[0] <= now:
+                timer[0] = now + timer[1]
+                timer[2]()
+
+    def wakeup(self):
+        """ Interrupts a blocking select(), safe from signal handlers and
+            other threads """
+        self._waker.wake()
+
+    def call_soon_threadsafe(self, callback, *args):
+        """ Runs callback(*args) on the server thread, e.g. to answer a
+            Request from a worker thread """
+        self._callbacks.append((callback, args))
+        self._waker.wake()
+
+    def _frames_queued(self, conn):
+        # Context.on_frames_queued, called from producer threads
+        self._threadsafe_flush.append(conn)
+        self._waker.wake()
+
+    def _run_callbacks(self):
+        callbacks, flush = self._callbacks, self._threadsafe_flush
+        while flush:
+            self._want_flush(flush.popleft())
+        while callbacks:
+            callback, args = callbacks.popleft()
+            try:
+                callback(*args)
+            except Exception:
+                log.exception('error in callback %r', callback)
+
+    def stop(self):
+        """ Makes serve_forever() return, connections are closed """
+        self._running = False
+
+    def shutdown(self):
+        """ Graceful stop: no new connections, GOAWAY on the open ones, and
+            serve_forever() returns when every connection has drained """
+        if self._shutting_down:
+            return
+        self._shutting_down = True
+        # take what's waiting in the backlog, closing the socket would reset
+        # those connections while they can still get a clean GOAWAY
+        self._accept()
+        self.selector.unregister(self.sock)
+        self.sock.close()
+        self.wakeup()
+        for conn in list(self.connections.values()):
+            conn.ctx.begin_shutdown()
+            self._want_flush(conn)
+
+    def stats(self):
+        """ Context counters (spdy.stats) summed over every connection so
+            far; queue depths are those of the open connections. Safe to call
+            from another thread, e.g. a metrics endpoint. """
+        snapshots = [conn.ctx.stats() for conn in
+                     list(self.connections.values())]
+        if self._closed_stats is not None:
+            snapshots.append(self._closed_stats)
+        total = aggregate(snapshots)
+        total['connections'] = len(self.connections)
+        total['accepted'] = self.accepted
+        total['requests'] = self.requests
+        return total
+
+    def close(self):
+        for conn in list(self.connections.values()):
+            self._close(conn)
+        if not self._shutting_down:
+            self.selector.unregister(self.sock)
+            self.sock.close()
+            self._shutting_down = True
+        self.selector.close()
+        self._waker.close()
+
+    # Connections
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self.sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                if exc.errno in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS,
+                                 errno.ENOMEM):
+                    log.warning('accept: %s', exc)
+                    return
+                raise
+            sock.setblocking(False)
+            if sock.family in (socket.AF_INET, socket.AF_INET6):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = Connection(self, sock, address)
+            conn.ctx.on_drained = lambda ctx, conn=conn: self._want_flush(conn)
+            conn.ctx.on_frames_queued = lambda ctx, conn=conn: \
+                                        self._frames_queued(conn)
+            conn.ctx.set_watermarks(output_high=self.write_high_water)
+            if self.memory_budget is not None:
+                self.memory_budget.register(conn.ctx, '{0}:{1}'.format(
+                                                        *address[:2]))
+            conn.ctx.tracer = self.tracer
+            conn.ctx.capture = self.capture
+            if self.keepalive:
+                conn.ctx.set_keepalive(*self.keepalive)
+                if self._next_keepalive is None:
+                    self._next_keepalive = _clock() + self.keepalive[0]
+            if self.settings:
+                pairs = dict((id, (PERSIST_NONE, value))
+                             for id, value in self.settings.items())
+                conn.ctx.put_frame(Settings(len(pairs), pairs,
+                                            version=self.version))
+                self._want_flush(conn)
+            self.connections[conn.fileno] = conn
+            self.selector.register(sock, selectors.EVENT_READ, conn)
+            self.accepted += 1
+
+    def _close(self, conn):
+        if conn.closed:
+            return
+        conn.closed = True
+        self.connections.pop(conn.fileno, None)
+        closed = [conn.ctx.counters.snapshot()]
+        if self._closed_stats is not None:
+            closed.append(self._closed_stats)
+        self._closed_stats = aggregate(closed)
+        if self.memory_budget is not None:
+            self.memory_budget.unregister(conn.ctx)
+        if self.tracer is not None:
+            self.tracer.flush(conn.ctx)
+        if self.capture is not None:
+            self.capture.closed(conn.ctx)
+        self._flush.discard(conn)
+        try:
+            self.selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
+
+    def _set_events(self, conn, events):
+        if events == conn.events:
+            return
+        # a paused connection with nothing to write isn't polled at all
+        if not events:
+            self.selector.unregister(conn.sock)
+        elif not conn.events:
+            self.selector.register(conn.sock, events, conn)
+        else:
+            self.selector.modify(conn.sock, events, conn)
+        conn.events = events
+
+    def _read(self, conn):
+        sock = conn.sock
+        view = self._view
+        got = False
+        for _ in range(READS_PER_EVENT):
+            try:
+                nbytes = sock.recv_into(self._buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self._close(conn)
+                return
+            if not nbytes:
+                self._close(conn)
+                return
+            conn.ctx.incoming(view[:nbytes])
+            got = True
+            if nbytes < READ_SIZE:
+                break
+        if got:
+            try:
+                conn.ctx.dispatch()
+            except SpdyProtocolError as exc:
+                log.warning('%r: %s', conn, exc)
+                self._close(conn)
+                return
+            self._want_flush(conn)
+
+    def _handle(self, request):
+        self.requests += 1
+        if self.cache is not None and not revalidate(request.headers):
+            entry = self.cache.get(request.method, request.host, request.path,
+                                   request.headers)
+            if entry is not None:
+                request.respond_cached(entry)
+                return
+        try:
+            self.handler(request)
+        except Exception:
+            log.exception('error handling %r', request)
+            if not request.finished:
+                request.reset(INTERNAL_ERROR)
+
+    # Output
+
+    def _want_flush(self, conn):
+        self._flush.add(conn)
+
+    def _flush_pending(self):
+        pending, self._flush = self._flush, set()
+        for conn in pending:
+            if conn.closed:
+                continue
+            chunks = conn.ctx.outgoing_chunks()
+            if chunks:
+                conn.out.extend(chunks)
+                conn.out_bytes += sum(len(c) for c in chunks)
+            self._write(conn)
+
+    def _write(self, conn):
+        out = conn.out
+        while out:
+            buffers = [out[i] for i in range(min(len(out), MAX_IOV))]
+            try:
+                sent = conn.sock.sendmsg(buffers)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self._close(conn)
+                return
+            conn.out_bytes -= sent
+            while sent:
+                head = out[0]
+                if len(head) <= sent:
+                    sent -= len(head)
+                    out.popleft()
+                else:
+                    out[0] = memoryview(head)[sent:]
+                    sent = 0
+
+        if not out and conn.ctx.drained and not conn.ctx.frame_queue:
+            self._close(conn)
+            return
+        # Backpressure: stop reading from clients that don't read our output
+        conn.ctx.set_unsent_bytes(conn.out_bytes)
+        events = 0 if conn.ctx.reading_paused else selectors.EVENT_READ
+        if out:
+            events |= selectors.EVENT_WRITE
+        self._set_events(conn, events)
+
+    def _check_keepalive(self):
+        now = _clock()
+        if self._next_keepalive is None or now < self._next_keepalive:
+            return
+        self._next_keepalive = now + min(self.keepalive)
+        for conn in list(self.connections.values()):
+            if not conn.ctx.keepalive(now):
+                log.info('%r: peer did not answer PING', conn)
+                self._close(conn)
+            elif conn.ctx.frame_queue:
+                self._want_flush(conn)
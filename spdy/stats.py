@@ -0,0 +1,105 @@
+# coding: utf-8
+""" Per-Context performance counters
+
+    Every Context keeps a ContextStats in `ctx.counters`, always on:
+
+        frames / bytes in and out by frame type
+        RST_STREAM reasons and GOAWAY statuses, both directions
+        header blocks before and after compression, both directions
+        seconds spent decoding (get_frame(), dispatch()), encoding
+        (outgoing_chunks()), inflating and deflating header blocks
+        high-water marks of the input buffer and the output queue
+
+    ctx.stats() returns them as a plain dict along with the current queue
+    depths; aggregate() sums such dicts over many connections (peaks are
+    maxed). Timing is per call for header blocks, per batch for encoding,
+    and only covers control frames when decoding: DATA frames are counted
+    but a clock read would cost more than parsing them. parse_time includes
+    inflate_time, encode_time includes deflate_time.
+"""
+from spdy.frames import FRAME_NAMES, ERROR_CODES, GOAWAY_STATUS
+
+try:
+    from time import perf_counter as timer
+except ImportError: # Python < 3.3
+    from time import time as timer
+
+# Counters indexed by frame type, DATA = 0
+BY_TYPE = ('frames_in', 'bytes_in', 'frames_out', 'bytes_out')
+# Counters by status code: {code: count}
+BY_CODE = ('rst_in', 'rst_out', 'goaway_in', 'goaway_out')
+TOTALS = ('headers_in_raw', 'headers_in_compressed', 'headers_out_raw',
+          'headers_out_compressed', 'parse_time', 'encode_time',
+          'inflate_time', 'deflate_time')
+PEAKS = ('input_buffer_peak', 'frame_queue_peak', 'queued_bytes_peak',
+         'unsent_bytes_peak', 'streams_peak')
+
+
+class ContextStats(object):
+    __slots__ = BY_TYPE + BY_CODE + TOTALS + PEAKS
+
+    def __init__(self):
+        # spelled out, a setattr() loop makes every Context slower to create
+        size = max(FRAME_NAMES) + 1
+        self.frames_in = [0] * size
+        self.bytes_in = [0] * size
+        self.frames_out = [0] * size
+        self.bytes_out = [0] * size
+        self.rst_in = {}
+        self.rst_out = {}
+        self.goaway_in = {}
+        self.goaway_out = {}
+        self.headers_in_raw = 0
+        self.headers_in_compressed = 0
+        self.headers_out_raw = 0
+        self.headers_out_compressed = 0
+        self.parse_time = 0.0
+        self.encode_time = 0.0
+        self.inflate_time = 0.0
+        self.deflate_time = 0.0
+        self.input_buffer_peak = 0
+        self.frame_queue_peak = 0
+        self.queued_bytes_peak = 0
+        self.unsent_bytes_peak = 0
+        self.streams_peak = 0
+
+    def __repr__(self):
+        return '<ContextStats in={0} out={1} frames>'.format(
+            sum(self.frames_in), sum(self.frames_out))
+
+    def snapshot(self):
+        """ The counters as a dict, by-type and by-code counters keyed by
+            name and only listing what was seen """
+        out = {}
+        for name in BY_TYPE:
+            out[name] = dict((FRAME_NAMES[frame_type], value) for
+                             frame_type, value in enumerate(getattr(self, name))
+                             if value)
+        for name in BY_CODE:
+            names = ERROR_CODES if name.startswith('rst') else GOAWAY_STATUS
+            out[name] = dict((names.get(code, str(code)), value) for
+                             code, value in getattr(self, name).items())
+        for name in TOTALS + PEAKS:
+            out[name] = getattr(self, name)
+        return out
+
+
+def aggregate(snapshots):
+    """ One stats dict out of many (Context.stats() or earlier aggregate()
+        results): counters and current depths are summed, peaks maxed.
+        `connections` counts the Contexts behind it. """
+    total = {'connections': 0}
+    for snapshot in snapshots:
+        total['connections'] += snapshot.get('connections', 1)
+        for name, value in snapshot.items():
+            if name == 'connections':
+                continue
+            if isinstance(value, dict):
+                into = total.setdefault(name, {})
+                for key, count in value.items():
+                    into[key] = into.get(key, 0) + count
+            elif name in PEAKS:
+                total[name] = max(total.get(name, 0), value)
+            elif value is not None:
+                total[name] = total.get(name, 0) + value
+    return total
@@ -0,0 +1,358 @@
+# coding: utf-8
+""" Per-stream latency timelines
+
+        tracer = Tracer(HistogramSink())
+        ctx.tracer = tracer
+        ...
+        tracer.sink.summary()['reply_wait']['p99_ms']
+
+    With `ctx.tracer` set, the Context timestamps each stream's lifecycle:
+
+        syn_queued      syn_sent        syn_received
+        reply_queued    reply_sent      reply_received
+        first_data_sent     last_data_sent
+        first_data_received last_data_received
+        fin_sent        fin_received    rst_sent    rst_received
+        closed
+
+    `*_queued` is put_frame(), `*_sent` the outgoing_chunks() call that
+    encoded the frame (header compression included), `*_received` the frame
+    being parsed. Once a stream is closed and none of its frames are left in
+    the queue, its StreamTrace goes to the sink: HistogramSink (latency
+    histograms per interval), JsonLinesSink or SpanSink (OpenTelemetry-style
+    span dicts). With no tracer (the default) the hooks are a single `is
+    None` test, per batch on the way out and per frame on the way in. """
+import binascii
+import itertools
+import json
+import os
+import time
+import weakref
+
+from spdy.frames import SYN_STREAM, SYN_REPLY, RST_STREAM, FLAG_FIN
+from spdy.stats import timer
+
+# (interval, from event, to event), computed by StreamTrace.intervals()
+INTERVALS = (
+    ('syn_queue', 'syn_queued', 'syn_sent'),
+    ('reply_wait', 'syn_sent', 'reply_received'),
+    ('first_byte', 'syn_sent', 'first_data_received'),
+    ('download', 'first_data_received', 'last_data_received'),
+    ('handler', 'syn_received', 'reply_queued'),
+    ('reply_queue', 'reply_queued', 'reply_sent'),
+    ('upload', 'first_data_sent', 'last_data_sent'),
+    ('total', 'opened', 'closed'),
+)
+
+_EVENT_PREFIX = {
+    SYN_STREAM: 'syn_',
+    SYN_REPLY: 'reply_',
+    RST_STREAM: 'rst_',
+}
+
+
+class StreamTrace(object):
+    """ Timeline of one stream: `events` maps event name to the timer()
+        reading of its first occurrence (the last one for last_data_*) """
+    __slots__ = ('stream_id', 'events', 'frames_out', 'bytes_out',
+                 'frames_in', 'pending', 'done')
+
+    def __init__(self, stream_id, now):
+        self.stream_id = stream_id
+        self.events = {'opened': now}
+        self.frames_out = 0
+        self.bytes_out = 0
+        self.frames_in = 0
+        # frames queued but not encoded yet
+        self.pending = 0
+        self.done = False
+
+    def __repr__(self):
+        return '<StreamTrace id={0} events={1}>'.format(self.stream_id,
+                                                        len(self.events))
+
+    def intervals(self):
+        """ {interval: seconds} for the INTERVALS whose two ends happened """
+        events = self.events
+        out = {}
+        for name, start, end in INTERVALS:
+            if start in events and end in events:
+                out[name] = events[end] - events[start]
+        return out
+
+
+class Tracer(object):
+    """ Collects StreamTraces for the Contexts it's set on (ctx.tracer) and
+        hands the finished ones to `sink.record(trace, ctx)`. A stream is
+        traced from its SYN_STREAM on; frames of other streams are ignored.
+        `clock` replaces timer(), e.g. with a simulation's virtual time. """
+
+    def __init__(self, sink, clock=timer):
+        self.sink = sink
+        self.clock = clock
+        # (ctx, stream_id) -> StreamTrace
+        self.streams = {}
+
+    def _trace(self, ctx, frame, now):
+        stream_id = getattr(frame, 'stream_id', 0)
+        trace = self.streams.get((ctx, stream_id))
+        if trace is None and frame.is_control and \
+                frame.frame_type == SYN_STREAM:
+            trace = self.streams[ctx, stream_id] = StreamTrace(stream_id, now)
+        return trace
+
+    def _event(self, trace, frame, suffix, now):
+        events = trace.events
+        if frame.is_control:
+            prefix = _EVENT_PREFIX.get(frame.frame_type)
+            if prefix is not None:
+                events.setdefault(prefix + suffix, now)
+        else:
+            name = 'first_data_' + suffix
+            if name not in events:
+                events[name] = now
+            events['last_data_' + suffix] = now
+        if frame.flags & FLAG_FIN:
+            events.setdefault('fin_' + suffix, now)
+
+    def queued(self, ctx, frame):
+        now = self.clock()
+        trace = self._trace(ctx, frame, now)
+        if trace is not None:
+            trace.pending += 1
+            self._event(trace, frame, 'queued', now)
+
+    def sent(self, ctx, frames):
+        """ A batch of frames was just encoded """
+        now = self.clock()
+        streams = self.streams
+        for frame in frames:
+            trace = streams.get((ctx, getattr(frame, 'stream_id', 0)))
+            if trace is None:
+                continue
+            if trace.pending:
+                trace.pending -= 1
+            trace.frames_out += 1
+            if not frame.is_control:
+                trace.bytes_out += len(frame.data)
+            self._event(trace, frame, 'sent', now)
+            if trace.done and not trace.pending:
+                self._finish(ctx, trace)
+
+    def received(self, ctx, frame):
+        now = self.clock()
+        trace = self._trace(ctx, frame, now)
+        if trace is not None:
+            trace.frames_in += 1
+            self._event(trace, frame, 'received', now)
+
+    def data_received(self, ctx, stream_id, flags):
+        """ received() for DATA frames, which may never become a DataFrame """
+        trace = self.streams.get((ctx, stream_id))
+        if trace is None:
+            return
+        now = self.clock()
+        trace.frames_in += 1
+        events = trace.events
+        if 'first_data_received' not in events:
+            events['first_data_received'] = now
+        events['last_data_received'] = now
+        if flags & FLAG_FIN:
+            events.setdefault('fin_received', now)
+
+    def closed(self, ctx, stream_id):
+        trace = self.streams.get((ctx, stream_id))
+        if trace is None:
+            return
+        trace.events.setdefault('closed', self.clock())
+        trace.done = True
+        if not trace.pending:
+            self._finish(ctx, trace)
+
+    def _finish(self, ctx, trace):
+        del self.streams[ctx, trace.stream_id]
+        self.sink.record(trace, ctx)
+
+    def flush(self, ctx=None):
+        """ Sends the streams still open (on `ctx`, or everywhere) to the
+            sink as they are; servers call it when a connection goes away """
+        for key, trace in list(self.streams.items()):
+            if ctx is None or key[0] is ctx:
+                self._finish(key[0], trace)
+
+
+class Histogram(object):
+    """ HDR-style histogram of non-negative integers: exact below
+        2 ** precision, then buckets within 1 / 2 ** (precision - 1) of
+        the value, so memory stays small whatever the range """
+
+    def __init__(self, precision=7):
+        self.precision = precision
+        self.counts = {}
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.total = 0
+
+    def __repr__(self):
+        return '<Histogram count={0}>'.format(self.count)
+
+    def _index(self, value):
+        shift = value.bit_length() - self.precision
+        if shift <= 0:
+            return value
+        return (shift << (self.precision - 1)) + (value >> shift)
+
+    def _value(self, index):
+        half = 1 << (self.precision - 1)
+        if index < 2 * half:
+            return index
+        shift = index // half - 1
+        # middle of the bucket
+        return ((index - shift * half) << shift) + (1 << (shift - 1))
+
+    def add(self, value):
+        value = int(value)
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p):
+        """ Value at or below which `p` percent of the values fall """
+        if not self.count:
+            return None
+        rank = max(1, int(round(p / 100.0 * self.count)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+
+class HistogramSink(object):
+    """ One Histogram of microseconds per interval (see INTERVALS) """
+
+    def __init__(self, precision=7):
+        self.precision = precision
+        self.histograms = {}
+        self.streams = 0
+
+    def record(self, trace, ctx=None):
+        self.streams += 1
+        for name, seconds in trace.intervals().items():
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.precision)
+            histogram.add(seconds * 1e6)
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        """ {interval: {'count', 'mean_ms', 'max_ms', 'p50_ms', ...}} """
+        out = {}
+        for name, histogram in sorted(self.histograms.items()):
+            result = {
+                'count': histogram.count,
+                'mean_ms': histogram.total / 1e3 / histogram.count,
+                'max_ms': histogram.max / 1e3,
+            }
+            for p in percentiles:
+                result['p{0:g}_ms'.format(p).replace('.', '')] = \
+                    histogram.percentile(p) / 1e3
+            out[name] = result
+        return out
+
+
+class JsonLinesSink(object):
+    """ Writes each stream as one JSON object per line to `f`: stream id,
+        frame counts and event times in milliseconds since the stream was
+        first seen """
+
+    def __init__(self, f):
+        self.f = f
+
+    def record(self, trace, ctx=None):
+        opened = trace.events['opened']
+        line = {
+            'stream_id': trace.stream_id,
+            'frames_out': trace.frames_out,
+            'bytes_out': trace.bytes_out,
+            'frames_in': trace.frames_in,
+            'events': dict((name, round((when - opened) * 1e3, 3))
+                           for name, when in trace.events.items()),
+        }
+        if ctx is not None:
+            line['side'] = ctx.side
+            line['version'] = ctx.version
+        self.f.write(json.dumps(line, sort_keys=True) + '\n')
+
+
+class SpanSink(object):
+    """ Turns each stream into a span dict shaped like OpenTelemetry's
+        (trace_id, span_id, name, start/end_time_unix_nano, attributes,
+        events) and passes it to `export(span)`, or keeps them in `spans`.
+        All streams of a Context share one trace id. """
+
+    def __init__(self, export=None, name='spdy.stream'):
+        self.export = export
+        self.name = name
+        self.spans = []
+        self._trace_ids = weakref.WeakKeyDictionary()
+        self._span_ids = itertools.count(1)
+        # timer() has no epoch, anchor it to the wall clock once
+        self._offset = time.time() - timer()
+
+    def _trace_id(self, ctx):
+        if ctx is None:
+            return binascii.hexlify(os.urandom(16)).decode()
+        trace_id = self._trace_ids.get(ctx)
+        if trace_id is None:
+            trace_id = self._trace_ids[ctx] = \
+                binascii.hexlify(os.urandom(16)).decode()
+        return trace_id
+
+    def _nanos(self, when):
+        return int((when + self._offset) * 1e9)
+
+    def record(self, trace, ctx=None):
+        events = trace.events
+        attributes = {
+            'spdy.stream_id': trace.stream_id,
+            'spdy.frames_out': trace.frames_out,
+            'spdy.bytes_out': trace.bytes_out,
+            'spdy.frames_in': trace.frames_in,
+        }
+        if ctx is not None:
+            attributes['spdy.side'] = ctx.side
+            attributes['spdy.version'] = ctx.version
+        span = {
+            'trace_id': self._trace_id(ctx),
+            'span_id': '{0:016x}'.format(next(self._span_ids)),
+            'name': self.name,
+            'start_time_unix_nano': self._nanos(events['opened']),
+            'end_time_unix_nano': self._nanos(max(events.values())),
+            'status': 'ERROR' if 'rst_sent' in events or
+                                 'rst_received' in events else 'OK',
+            'attributes': attributes,
+            'events': [{'name': name, 'time_unix_nano': self._nanos(when)}
+                       for name, when in sorted(events.items(),
+                                                key=lambda item: item[1])],
+        }
+        if self.export is not None:
+            self.export(span)
+        else:
+            self.spans.append(span)
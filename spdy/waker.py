@@ -0,0 +1,50 @@
+# coding: utf-8
+""" Wakes a thread blocked in select()/epoll from other threads or signal
+    handlers: an eventfd on Linux (one fd, no buffer to fill up), a non-blocking
+    pipe elsewhere. Wakeups before the next drain() are coalesced. """
+import os
+
+class Waker(object):
+
+    def __init__(self):
+        self._pending = False
+        if hasattr(os, 'eventfd'):
+            self._read_fd = self._write_fd = os.eventfd(
+                0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+            self._token = (1).to_bytes(8, 'little')
+        else:
+            self._read_fd, self._write_fd = os.pipe()
+            os.set_blocking(self._read_fd, False)
+            os.set_blocking(self._write_fd, False)
+            self._token = b'\0'
+
+    def fileno(self):
+        """ Register this for reading in the selector """
+        return self._read_fd
+
+    def wake(self):
+        if self._pending:
+            return
+        self._pending = True
+        try:
+            os.write(self._write_fd, self._token)
+        except (BlockingIOError, InterruptedError):
+            pass # already readable
+
+    def drain(self):
+        """ Call from the woken thread before looking for work, so a wake()
+            racing with it is never lost """
+        try:
+            while os.read(self._read_fd, 4096) and \
+                    self._read_fd != self._write_fd:
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        # only now: a wake() seeing True in between has its work queued
+        # already, one seeing False writes again
+        self._pending = False
+
+    def close(self):
+        os.close(self._read_fd)
+        if self._write_fd != self._read_fd:
+            os.close(self._write_fd)
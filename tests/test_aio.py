@@ -0,0 +1,37 @@
+# coding: utf-8
+import asyncio
+import unittest
+
+from spdy.aio import start_server, open_connection
+from spdy.http import request_headers, response_headers
+
+
+class ClientProtocolTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        async def handler(stream):
+            stream.reply(response_headers(3, 200, {}), fin=True)
+        self.server = await start_server(handler, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_open_stream_after_connection_lost(self):
+        conn = await open_connection('127.0.0.1', self.port)
+        conn.transport.abort()
+        await asyncio.wait_for(conn.wait_closed(), 5)
+        with self.assertRaises(ConnectionResetError):
+            conn.open_stream(request_headers(3, 'GET', '/', 'localhost'))
+
+    async def test_open_stream_while_closing(self):
+        conn = await open_connection('127.0.0.1', self.port)
+        conn.transport.close()
+        with self.assertRaises(ConnectionResetError):
+            conn.open_stream(request_headers(3, 'GET', '/', 'localhost'))
+        await asyncio.wait_for(conn.wait_closed(), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+# coding: utf-8
+import unittest
+
+from spdy.cache import ResponseCache, revalidate
+
+HEADERS = {'cache-control': 'max-age=60'}
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def test_key_by_method(self):
+        cache = ResponseCache()
+        entry = cache.put('GET', 'example.com', '/', {}, 200, HEADERS, b'body')
+        self.assertIsNotNone(entry)
+        self.assertIs(cache.get('GET', 'example.com', '/', {}), entry)
+        # HEAD is answered by the GET entry
+        self.assertIs(cache.get('HEAD', 'example.com', '/', {}), entry)
+        self.assertIsNone(cache.get('POST', 'example.com', '/', {}))
+        self.assertNotEqual(cache._key('GET', 'example.com', '/', {}, ()),
+                            cache._key('OPTIONS', 'example.com', '/', {}, ()))
+
+    def test_invalidate(self):
+        cache = ResponseCache()
+        cache.put('GET', 'example.com', '/', {}, 200, HEADERS, b'body')
+        cache.invalidate('example.com', '/')
+        self.assertEqual(len(cache), 0)
+
+    def test_revalidate(self):
+        self.assertTrue(revalidate({'cache-control': 'no-cache'}))
+        self.assertTrue(revalidate({'cache-control': 'max-age=0'}))
+        self.assertTrue(revalidate({'pragma': 'no-cache'}))
+        self.assertFalse(revalidate({'cache-control': 'max-age=10'}))
+        self.assertFalse(revalidate({}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# coding: utf-8
+import asyncio
+import unittest
+
+from spdy.aio import start_server
+from spdy.client import SpdyClient
+from spdy.frames import MAX_CONCURRENT_STREAMS
+from spdy.http import response_headers
+
+
+class SpdyClientTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.release = asyncio.Event()
+        async def handler(stream):
+            if stream.headers.get(':path') == '/slow':
+                await self.release.wait()
+            stream.reply(response_headers(3, 200, {}), fin=True)
+        self.server = await start_server(
+            handler, '127.0.0.1', 0,
+            protocol_kwargs={'settings': {MAX_CONCURRENT_STREAMS: 1}})
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.release.set()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_request_after_connection_lost(self):
+        client = SpdyClient('127.0.0.1', self.port)
+        await client.connect()
+        self.assertEqual((await client.get('/')).status, 200)
+        client.protocol.transport.abort()
+        with self.assertRaises(ConnectionResetError):
+            await asyncio.wait_for(client.get('/'), 5)
+
+    async def test_slot_waiters_fail_on_connection_lost(self):
+        client = SpdyClient('127.0.0.1', self.port)
+        await client.connect()
+        # SETTINGS comes with the first reply
+        await client.get('/')
+        slow = asyncio.ensure_future(client.get('/slow'))
+        # more waiters than streams the lost connection frees
+        waiting = [asyncio.ensure_future(client.get('/')) for _ in range(3)]
+        await asyncio.sleep(0.1)
+        self.assertEqual(len(client._slot_waiters), 3)
+        client.protocol.transport.abort()
+        for request in [slow] + waiting:
+            with self.assertRaises(ConnectionResetError):
+                await asyncio.wait_for(request, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
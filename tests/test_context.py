@@ -0,0 +1,104 @@
+# coding: utf-8
+import unittest
+
+from spdy.context import Context, CLIENT, SERVER, DEFAULT_WINDOW_SIZE, \
+                         MAX_DATA_FRAME_SIZE
+from spdy.frames import SynStream, SynReply, DataFrame, WindowUpdate, \
+                        Settings, FLAG_FIN, INITIAL_WINDOW_SIZE
+
+
+def _request(version, path='/'):
+    if version == 2:
+        return {'method': 'GET', 'url': path, 'version': 'HTTP/1.1',
+                'host': 'example.com', 'scheme': 'https'}
+    return {':method': 'GET', ':path': path, ':version': 'HTTP/1.1',
+            ':host': 'example.com', ':scheme': 'https'}
+
+def _push_headers(version, path):
+    if version == 2:
+        return {'url': 'https://example.com' + path, 'status': '200 OK',
+                'version': 'HTTP/1.1'}
+    return {':scheme': 'https', ':host': 'example.com', ':path': path,
+            ':status': '200 OK', ':version': 'HTTP/1.1'}
+
+def _frames(ctx):
+    frames = []
+    while True:
+        frame = ctx.get_frame()
+        if not frame:
+            return frames
+        frames.append(frame)
+
+
+class PushTest(unittest.TestCase):
+
+    def _open(self, version):
+        client = Context(CLIENT, version)
+        server = Context(SERVER, version)
+        client.put_frame(SynStream(client.next_stream_id, _request(version),
+                                   flags=FLAG_FIN, version=version))
+        server.incoming(client.outgoing())
+        syn, = _frames(server)
+        server.put_frame(SynReply(syn.stream_id, _push_headers(version, '/'),
+                                  version=version))
+        return client, server, syn.stream_id
+
+    def _pushed(self, client, server, stream_id):
+        client.incoming(server.outgoing())
+        data = [f for f in _frames(client)
+                if isinstance(f, DataFrame) and f.stream_id == stream_id]
+        for frame in data:
+            self.assertLessEqual(len(frame.data), MAX_DATA_FRAME_SIZE)
+        return data
+
+    def test_body_larger_than_window(self):
+        client, server, parent = self._open(3)
+        body = bytes(bytearray(range(256))) * 1024
+        pushed = server.push(parent, _push_headers(3, '/big'), body)
+        server.put_frame(DataFrame(parent, b'', FLAG_FIN))
+
+        data = self._pushed(client, server, pushed)
+        received = b''.join(bytes(f.data) for f in data)
+        self.assertEqual(len(received), DEFAULT_WINDOW_SIZE)
+        self.assertFalse(data[-1].flags & FLAG_FIN)
+
+        while len(received) < len(body):
+            client.put_frame(WindowUpdate(pushed, len(received),
+                                          version=3))
+            server.incoming(client.outgoing())
+            _frames(server)
+            data = self._pushed(client, server, pushed)
+            self.assertTrue(data)
+            received += b''.join(bytes(f.data) for f in data)
+        self.assertEqual(received, body)
+        self.assertTrue(data[-1].flags & FLAG_FIN)
+        self.assertNotIn(pushed, server.streams)
+
+    def test_initial_window_setting(self):
+        client, server, parent = self._open(3)
+        pushed = server.push(parent, _push_headers(3, '/big'), b'x' * 100000)
+        self.assertEqual(len(self._pushed(client, server, pushed)), 4)
+        client.put_frame(Settings(1, {INITIAL_WINDOW_SIZE: (0, 1024)},
+                                  version=3))
+        server.incoming(client.outgoing())
+        server.dispatch()
+        # the window shrank below what is in flight
+        self.assertEqual(self._pushed(client, server, pushed), [])
+        client.put_frame(WindowUpdate(pushed, DEFAULT_WINDOW_SIZE, version=3))
+        server.incoming(client.outgoing())
+        server.dispatch()
+        data, = self._pushed(client, server, pushed)
+        self.assertEqual(len(data.data), 1024)
+
+    def test_v2_body_is_chunked(self):
+        client, server, parent = self._open(2)
+        body = b'x' * (3 * MAX_DATA_FRAME_SIZE + 1)
+        pushed = server.push(parent, _push_headers(2, '/big'), body)
+        data = self._pushed(client, server, pushed)
+        self.assertEqual(len(data), 4)
+        self.assertEqual(b''.join(bytes(f.data) for f in data), body)
+        self.assertTrue(data[-1].flags & FLAG_FIN)
+
+
+if __name__ == '__main__':
+    unittest.main()
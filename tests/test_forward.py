@@ -0,0 +1,31 @@
+# coding: utf-8
+import unittest
+
+from spdy.context import Context, CLIENT, SERVER
+from spdy.forward import Forwarder
+from spdy.frames import Ping
+
+
+class ForwarderTest(unittest.TestCase):
+
+    def test_ping_answered_per_leg(self):
+        client = Context(CLIENT, 3)
+        origin = Context(SERVER, 3)
+        front = Context(SERVER, 3)
+        back = Context(CLIENT, 3)
+        forwarder = Forwarder(front, back)
+        for peer, leg in ((client, front), (origin, back)):
+            ping_id = peer.send_ping()
+            leg.incoming(peer.outgoing())
+            forwarder.forward(leg)
+            # nothing reached the other leg
+            self.assertEqual(forwarder._other[leg].frame_queue, [])
+            peer.incoming(leg.outgoing())
+            frame = peer.get_frame()
+            self.assertIsInstance(frame, Ping)
+            self.assertEqual(frame.uniq_id, ping_id)
+            self.assertIsNotNone(peer.last_rtt)
+
+
+if __name__ == '__main__':
+    unittest.main()
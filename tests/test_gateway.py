@@ -0,0 +1,46 @@
+# coding: utf-8
+import asyncio
+import unittest
+
+from spdy.aio import start_server, open_connection
+from spdy.frames import CANCEL
+from spdy.gateway import ASGIGateway
+from spdy.http import request_headers
+
+
+class ASGIGatewayTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_response_after_reset(self):
+        started = asyncio.Event()
+        reset = asyncio.Event()
+        sent = asyncio.get_running_loop().create_future()
+
+        async def app(scope, receive, send):
+            started.set()
+            await reset.wait()
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': []})
+            await send({'type': 'http.response.body', 'body': b'late'})
+            sent.set_result(await receive())
+
+        server = await start_server(ASGIGateway(app), '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        conn = await open_connection('127.0.0.1', port)
+        try:
+            stream = conn.open_stream(request_headers(3, 'GET', '/',
+                                                      'localhost'), fin=True)
+            await asyncio.wait_for(started.wait(), 5)
+            stream.reset(CANCEL)
+            await asyncio.sleep(0.05)
+            reset.set()
+            with self.assertNoLogs('spdy.gateway'):
+                message = await asyncio.wait_for(sent, 5)
+            self.assertEqual(message, {'type': 'http.disconnect'})
+        finally:
+            conn.transport.close()
+            server.close()
+            await server.wait_closed()
+
+
+if __name__ == '__main__':
+    unittest.main()
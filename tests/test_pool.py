@@ -0,0 +1,60 @@
+# coding: utf-8
+import asyncio
+import unittest
+
+from spdy.aio import start_server
+from spdy.frames import MAX_CONCURRENT_STREAMS
+from spdy.http import response_headers
+from spdy.pool import ConnectionPool
+
+
+async def _serve(version=3):
+    async def handler(stream):
+        stream.reply(response_headers(version, 200, {}))
+        stream.write(stream.headers.get(':path', stream.headers.get('url'))
+                     .encode('ascii'), fin=True)
+    server = await start_server(handler, '127.0.0.1', 0, version=version)
+    return server, server.sockets[0].getsockname()[1]
+
+
+class ConnectionPoolTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.server, self.port = await _serve()
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_cold_origin_saturation(self):
+        # more concurrent requests than one connecting slot can hold
+        pool = ConnectionPool(max_connections=1, default_max_streams=10)
+        async def fetch(i):
+            response = await pool.request('127.0.0.1', self.port, 'GET',
+                                          '/{0}'.format(i))
+            return await response.read()
+        try:
+            bodies = await asyncio.wait_for(
+                asyncio.gather(*[fetch(i) for i in range(150)]), 10)
+        finally:
+            stats = pool.stats()
+            await pool.close()
+        self.assertEqual(bodies, [b'/' + str(i).encode() for i in range(150)])
+        origin, = stats.values()
+        self.assertEqual(origin['opened'], 1)
+        self.assertEqual(origin['requests'], 150)
+
+    async def test_zero_capacity(self):
+        pool = ConnectionPool(max_connections=1)
+        client = await pool.acquire('127.0.0.1', self.port)
+        try:
+            client.protocol.ctx.peer_settings[MAX_CONCURRENT_STREAMS] = 0
+            self.assertEqual(pool._load(client), float('inf'))
+            # saturated and at max_connections: queued on that client
+            self.assertIs(await pool.acquire('127.0.0.1', self.port), client)
+        finally:
+            await pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# coding: utf-8
+import selectors
+import socket
+import unittest
+
+from spdy.context import Context, CLIENT
+from spdy.frames import SynStream, SynReply, DataFrame, WindowUpdate, \
+                        RstStream, FLAG_FIN, CANCEL
+from spdy.server import Server
+
+
+def _request(path='/', method='GET'):
+    return {':method': method, ':path': path, ':version': 'HTTP/1.1',
+            ':host': 'example.com', ':scheme': 'https'}
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.handled = []
+        self.server = Server(self.handled.append, '127.0.0.1', 0, version=3)
+        self.sock = socket.create_connection(self.server.address)
+        self.sock.settimeout(5)
+        self.ctx = Context(CLIENT, 3)
+        self.server.run_once(1)
+        self.conn, = self.server.connections.values()
+
+    def tearDown(self):
+        self.sock.close()
+        self.server.close()
+
+    def send(self, frame):
+        self.ctx.put_frame(frame)
+        self.sock.sendall(self.ctx.outgoing())
+        self.server.run_once(1)
+        self.server.run_once(0)
+
+    def receive(self):
+        frames = []
+        self.sock.settimeout(0.2)
+        try:
+            while True:
+                chunk = self.sock.recv(65536)
+                if not chunk:
+                    break
+                self.ctx.incoming(chunk)
+        except socket.timeout:
+            pass
+        while True:
+            frame = self.ctx.get_frame()
+            if not frame:
+                return frames
+            frames.append(frame)
+
+    def test_request_forgotten_once_closed(self):
+        stream_id = self.ctx.next_stream_id
+        self.send(SynStream(stream_id, _request(), flags=FLAG_FIN, version=3))
+        request, = self.handled
+        request.respond(200, {}, b'hello')
+        self.server.run_once(0)
+        reply, data = self.receive()
+        self.assertIsInstance(reply, SynReply)
+        self.assertEqual(bytes(data.data), b'hello')
+        self.assertEqual(self.conn.requests, {})
+
+    def test_upload_after_response(self):
+        stream_id = self.ctx.next_stream_id
+        self.send(SynStream(stream_id, _request(method='POST'), flags=0,
+                            version=3))
+        request = self.conn.requests[stream_id]
+        # answered early, the client keeps uploading
+        request.respond(200, {}, b'')
+        self.server.run_once(0)
+        self.send(DataFrame(stream_id, b'x' * 1000, 0))
+        frames = self.receive()
+        self.assertIn((stream_id, 1000),
+                      [(f.stream_id, f.delta_window_size) for f in frames
+                       if isinstance(f, WindowUpdate)])
+        self.send(DataFrame(stream_id, b'', FLAG_FIN))
+        self.assertEqual(self.conn.requests, {})
+        self.assertEqual(self.handled, [])
+
+    def test_respond_after_reset(self):
+        stream_id = self.ctx.next_stream_id
+        self.send(SynStream(stream_id, _request(), flags=FLAG_FIN, version=3))
+        request, = self.handled
+        self.send(RstStream(stream_id, CANCEL, version=3))
+        self.assertTrue(request.reset_by_peer)
+        request.respond_start(200)
+        request.finish()
+        self.assertEqual(self.conn.ctx.frame_queue, [])
+
+    def test_no_events(self):
+        self.server._set_events(self.conn, 0)
+        self.assertNotIn(self.conn.sock, self.server.selector.get_map())
+        self.server._set_events(self.conn, selectors.EVENT_READ)
+        key = self.server.selector.get_key(self.conn.sock)
+        self.assertEqual(key.events, selectors.EVENT_READ)
+        self.assertIs(key.data, self.conn)
+
+
+if __name__ == '__main__':
+    unittest.main()
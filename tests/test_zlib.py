@@ -0,0 +1,48 @@
+# coding: utf-8
+import unittest
+
+from spdy.c_zlib import Deflater, Inflater, ZlibError, DictionaryMismatch
+from spdy.context import Context, CLIENT, SERVER, SpdyProtocolError
+from spdy.frames import SynStream, FLAG_FIN
+
+DICTIONARY = b':method:path:host:scheme:version GET HTTP/1.1 https'
+
+
+class InflaterTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        block = Deflater(3).compress(b'hello world' * 10)
+        self.assertEqual(Inflater(3).decompress(block), b'hello world' * 10)
+
+    def test_corrupt_last_block(self):
+        block = Deflater(3).compress(b'hello world')
+        # zlib header and dictionary id, then an invalid block type; the
+        # input is all consumed when inflate() fails
+        with self.assertRaises(ZlibError):
+            Inflater(3).decompress(block[:6] + b'\x07')
+
+    def test_dictionary_mismatch(self):
+        block = Deflater(3, DICTIONARY).compress(b'hello world')
+        with self.assertRaises(DictionaryMismatch):
+            Inflater(3).decompress(block)
+
+
+class ContextTest(unittest.TestCase):
+
+    def test_dictionary_mismatch(self):
+        client = Context(CLIENT, 3, dictionary=DICTIONARY)
+        server = Context(SERVER, 3)
+        client.put_frame(SynStream(client.next_stream_id,
+                                   {':method': 'GET', ':path': '/',
+                                    ':version': 'HTTP/1.1',
+                                    ':host': 'example.com',
+                                    ':scheme': 'https'},
+                                   flags=FLAG_FIN, version=3))
+        server.incoming(client.outgoing())
+        with self.assertRaises(SpdyProtocolError) as cm:
+            server.get_frame()
+        self.assertIn('dictionary', str(cm.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()